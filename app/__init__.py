@@ -1,32 +1,35 @@
 from flask import Flask
+from flask_login import LoginManager
 import os
 
+# Importing the package stays cheap: pymongo is imported by app/db.py on the
+# first query, numpy by the recent-readings buffer and the model (with
+# scikit-learn) by the simulator the first time a job runs. See
+# benchmark_startup.py for the budget.
 app = Flask(__name__)
-app.config.from_pyfile(os.path.join(os.path.dirname(__file__), '..', 'config.py'))
-
-# Must come after app creation
-from app import routes
-from flask_login import LoginManager
-from app.models import load_user as user_loader_func
-
-
 login_manager = LoginManager()
 login_manager.login_view = 'login'  # redirect unauthorized users here
-login_manager.init_app(app)
 
-@login_manager.user_loader
-def load_user(user_id):
-    return user_loader_func(user_id)
+def create_app():
+    """Configure the app once: config, instrumentation, routes and login"""
+    if 'login_manager' in app.extensions:
+        return app
+    app.config.from_pyfile(os.path.join(os.path.dirname(__file__), '..', 'config.py'))
 
-from flask_login import LoginManager
-from app.models import load_user as user_loader_func
+    from app.farm import FARM_ADDRESS, authkey
+    if FARM_ADDRESS:
+        authkey()  # refuse to talk to the farm over an unauthenticated channel
 
+    from app import metrics, query_profiler
+    metrics.init_app(app)
+    query_profiler.init_app(app)
 
-login_manager = LoginManager()
-login_manager.login_view = 'login'  # redirect unauthorized users here
-login_manager.init_app(app)
+    # Routes register on the module-level app with @app.route
+    from app import routes  # noqa: F401
+    from app.models import load_user
 
-@login_manager.user_loader
-def load_user(user_id):
-    return user_loader_func(user_id)
+    login_manager.user_loader(load_user)
+    login_manager.init_app(app)
+    return app
 
+create_app()
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+import time
+
+# Clocks used by the simulator. Everything that reads or waits on time goes
+# through one of these so a job can run against wall time or a virtual clock.
+
+class WallClock:
+    """Real time; sleeping wakes early when the stop event fires"""
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.utcnow()
+
+    def sleep(self, seconds, stop_event=None):
+        if stop_event is not None:
+            stop_event.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+class VirtualClock:
+    """Simulated time that only moves when the simulation sleeps.
+
+    speed=1 paces like real time, speed=100 runs 100x faster and speed=None
+    does not wait at all. Because simulated time never depends on how long
+    the real sleeps took, a seeded run produces identical readings and
+    timestamps at any speed.
+    """
+
+    def __init__(self, start=None, speed=None):
+        self.start = start or datetime.utcnow()
+        self.speed = speed
+        self._elapsed = 0.0
+        self._epoch = (self.start - datetime(1970, 1, 1)).total_seconds()
+
+    def time(self):
+        return self._epoch + self._elapsed
+
+    def now(self):
+        return self.start + timedelta(seconds=self._elapsed)
+
+    def sleep(self, seconds, stop_event=None):
+        if self.speed:
+            real = seconds / self.speed
+            if stop_event is not None:
+                if stop_event.wait(real):
+                    return
+            else:
+                time.sleep(real)
+        elif stop_event is not None and stop_event.is_set():
+            return
+        self._elapsed += seconds
+
+WALL_CLOCK = WallClock()
+
+def parse_speed(value):
+    """'1', '100' or 'max' (as fast as possible) -> clock speed"""
+    if value in (None, '', 'max', 'inf'):
+        return None
+    return float(value)
+
+def make_clock(speed=1, start=None, seed=None):
+    """Wall clock for unseeded real-time 1x runs, a VirtualClock for anything
+    else. A seeded run always gets a VirtualClock, so its readings depend on
+    simulated time only; pass a fixed `start` to pin its timestamps too."""
+    if speed == 1 and start is None and seed is None:
+        return WALL_CLOCK
+    return VirtualClock(start=start, speed=speed)
+
+def parse_utc(value):
+    """Naive UTC datetime from an ISO 8601 string (None for empty); raises ValueError"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"{value!r} is not an ISO 8601 date/time")
+    if parsed.tzinfo is not None:
+        parsed = datetime.utcfromtimestamp(parsed.timestamp())
+    return parsed
@@ -0,0 +1,49 @@
+from threading import Lock
+import os
+
+# One MongoClient per process. MongoClient is thread-safe and pools its own
+# sockets, so every request, stream and simulation shares it instead of
+# opening a client (and its monitor threads) per request. pymongo itself is
+# only imported here, on first use, so importing the app stays cheap.
+_client = None
+_client_lock = Lock()
+
+def command_listener(target):
+    """Wrap an object with started/succeeded/failed(event) as a pymongo CommandListener"""
+    from pymongo import monitoring
+
+    class Forwarder(monitoring.CommandListener):
+        def started(self, event):
+            target.started(event)
+
+        def succeeded(self, event):
+            target.succeeded(event)
+
+        def failed(self, event):
+            target.failed(event)
+
+    return Forwarder()
+
+def get_client():
+    """Return the process-wide MongoClient, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from pymongo import MongoClient
+                from app.metrics import mongo_listener
+                from app.query_profiler import profiler_listener
+                _client = MongoClient(
+                    os.getenv('MONGO_URI'),
+                    maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', '100')),
+                    event_listeners=[command_listener(mongo_listener), command_listener(profiler_listener)]
+                )
+    return _client
+
+def is_cooperative():
+    """True when gevent has monkey-patched the standard library (see wsgi.py)"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
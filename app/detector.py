@@ -0,0 +1,115 @@
+from threading import Lock
+import math
+import os
+
+# Online anomaly / failure detector that sits in the simulator's write path.
+# Per machine it keeps an EWMA mean and variance for a few metrics plus a
+# hysteresis latch on failureProbability: O(1) state and O(1) work per
+# reading, and it never looks at stored history.
+FAILURE_HIGH = float(os.getenv('DETECTOR_FAILURE_HIGH', '0.8'))
+FAILURE_LOW = float(os.getenv('DETECTOR_FAILURE_LOW', '0.6'))
+CONSECUTIVE = int(os.getenv('DETECTOR_CONSECUTIVE', '3'))
+Z_THRESHOLD = float(os.getenv('DETECTOR_Z_THRESHOLD', '4'))
+EWMA_ALPHA = float(os.getenv('DETECTOR_EWMA_ALPHA', '0.1'))
+WARMUP = int(os.getenv('DETECTOR_WARMUP', '12'))
+# Floor on the std dev as a fraction of the mean, so a clamped or perfectly
+# flat signal doesn't turn the first tiny wobble into a huge z-score
+MIN_RELATIVE_STD = float(os.getenv('DETECTOR_MIN_RELATIVE_STD', '0.02'))
+DETECTOR_ENABLED = os.getenv('DETECTOR_ENABLED', '1') == '1'
+
+WATCHED_METRICS = ('torque', 'processTemperature', 'toolWear')
+
+class EWMAStat:
+    """Exponentially weighted mean/variance"""
+    __slots__ = ('alpha', 'mean', 'var', 'count')
+
+    def __init__(self, alpha=EWMA_ALPHA):
+        self.alpha = alpha
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+
+    def zscore(self, x):
+        if self.count == 0:
+            return 0.0
+        std = max(math.sqrt(self.var), abs(self.mean) * MIN_RELATIVE_STD)
+        return (x - self.mean) / std if std > 0 else 0.0
+
+    def add(self, x):
+        if self.count == 0:
+            self.mean, self.count = x, 1
+            return
+        diff = x - self.mean
+        incr = self.alpha * diff
+        self.mean += incr
+        self.var = (1 - self.alpha) * (self.var + diff * incr)
+        self.count += 1
+
+class MachineDetector:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.stats = {metric: EWMAStat() for metric in WATCHED_METRICS}
+        self.armed = True
+        self.high_streak = 0
+        self.anomaly_streak = 0
+
+    def observe(self, reading):
+        """Returns the reasons to raise an alert for this reading, or None"""
+        reasons = []
+        anomalous = []
+        for metric, stat in self.stats.items():
+            value = reading.get(metric)
+            if value is None:
+                continue
+            value = float(value)
+            z = stat.zscore(value)
+            # Only rises matter: torque, heat and wear going up precede failure.
+            # Outliers are kept out of the baseline so a sustained excursion
+            # keeps scoring high instead of inflating the variance.
+            if stat.count > WARMUP and z >= Z_THRESHOLD:
+                anomalous.append(f"{metric} z={z:+.1f}")
+            else:
+                stat.add(value)
+        self.anomaly_streak = self.anomaly_streak + 1 if anomalous else 0
+
+        # Hysteresis: fire after CONSECUTIVE readings at or above FAILURE_HIGH,
+        # re-arm only once the probability falls back to FAILURE_LOW (and
+        # nothing else looks anomalous)
+        probability = float(reading.get('failureProbability', 0))
+        if probability >= FAILURE_HIGH:
+            self.high_streak += 1
+        else:
+            self.high_streak = 0
+            if probability <= FAILURE_LOW and not self.anomaly_streak:
+                self.armed = True
+
+        if not self.armed:
+            return None
+        if self.high_streak >= CONSECUTIVE:
+            reasons.append(f"failureProbability {probability:.0%} >= {FAILURE_HIGH:.0%} "
+                           f"for {self.high_streak} readings")
+        if self.anomaly_streak >= CONSECUTIVE:
+            reasons.append("anomalous " + ", ".join(anomalous))
+        if reasons:
+            self.armed = False
+            return reasons
+        return None
+
+_detectors = {}
+_lock = Lock()
+
+def observe(machine_id, job_id, reading):
+    """Feed one stored reading; returns alert reasons when the detector fires"""
+    if not DETECTOR_ENABLED or reading.get('criticalFailure'):
+        return None
+    with _lock:
+        detector = _detectors.get(machine_id)
+        if detector is None or detector.job_id != job_id:
+            detector = _detectors[machine_id] = MachineDetector(job_id)
+    return detector.observe(reading)
+
+def forget(machine_id, job_id):
+    with _lock:
+        detector = _detectors.get(machine_id)
+        if detector is not None and detector.job_id == job_id:
+            del _detectors[machine_id]
@@ -0,0 +1,25 @@
+from threading import Lock
+
+# In-process publish/subscribe for things that happen on the shop floor
+# (detector alerts, job starts and finishes). Callbacks run synchronously in
+# the publisher's thread, so they must be quick and must not block.
+_subscribers = {}
+_lock = Lock()
+
+def subscribe(topic, callback):
+    with _lock:
+        _subscribers.setdefault(topic, []).append(callback)
+    return callback
+
+def unsubscribe(topic, callback):
+    with _lock:
+        callbacks = _subscribers.get(topic, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+def publish(topic, payload):
+    for callback in list(_subscribers.get(topic, ())):
+        try:
+            callback(payload)
+        except Exception as e:
+            print(f"⚠️ Event subscriber for {topic!r} failed: {e}")
@@ -0,0 +1,110 @@
+from heapq import merge
+from threading import BoundedSemaphore
+from app.readings import FIELDS, FLAGS, EXTRA_FIELDS
+from app.clock import parse_utc
+import csv
+import io
+import json
+import os
+import zlib
+
+# Streaming sensor export (/api/export/sensor and export_sensor_data.py).
+# Each machine's readings come from its own timestamp-ordered, batched cursor
+# (store.readings.between) and heapq.merge interleaves them, so only one
+# reading per machine plus one output chunk is ever held: memory stays flat
+# however long the range is.
+#
+# A resume token names the last row written: "<timestamp>,<machine id>,<n>"
+# where n counts rows with exactly that timestamp and machine (normally 1).
+# NDJSON exports cut short by `limit` end with a {"resume": token} line; CSV
+# has no room for one, so a CSV client (like one whose download broke) builds
+# the token from the last row it received.
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_MAX_CONCURRENT = int(os.getenv('EXPORT_MAX_CONCURRENT', '2'))
+FORMATS = ('ndjson', 'csv')
+COLUMNS = ('timestamp', 'machineId', 'jobId') + FIELDS + EXTRA_FIELDS + FLAGS
+
+# Exports are long; cap how many a process serves at once
+slots = BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+def resume_token(timestamp, machine_id, repeat=1):
+    return f"{timestamp.isoformat()},{machine_id},{repeat}"
+
+def parse_resume_token(token):
+    """(timestamp, machine id, n) from a resume token; raises ValueError"""
+    parts = token.split(',')
+    if len(parts) not in (2, 3) or not parts[1]:
+        raise ValueError("resume must be '<timestamp>,<machine id>[,<n>]'")
+    timestamp = parse_utc(parts[0])
+    repeat = int(parts[2]) if len(parts) == 3 else 1
+    return timestamp, parts[1], repeat
+
+def _keyed(store, machine, start, end):
+    for reading in store.readings.between(machine, start, end):
+        yield reading['timestamp'], machine.id, reading
+
+def merged_readings(store, machines, start=None, end=None, resume=None):
+    """Readings of every machine in (timestamp, machine id) order, after `resume` if given"""
+    if resume:
+        resume_ts, resume_machine, skip = parse_resume_token(resume)
+        start = max(start, resume_ts) if start else resume_ts
+    streams = [_keyed(store, m, start, end) for m in sorted(machines, key=lambda m: m.id)]
+    for timestamp, machine_id, reading in merge(*streams, key=lambda item: item[:2]):
+        if resume:
+            if (timestamp, machine_id) < (resume_ts, resume_machine):
+                continue
+            if (timestamp, machine_id) == (resume_ts, resume_machine) and skip > 0:
+                skip -= 1
+                continue
+        reading.setdefault('machineId', machine_id)
+        yield reading
+
+def row(reading):
+    return {c: reading.get(c) for c in COLUMNS if reading.get(c) is not None}
+
+def _json_default(value):
+    return value.isoformat()
+
+def encode(readings, fmt='ndjson', limit=None, on_row=None, resume_line=True, resume=None, header=True):
+    """Text chunks of about EXPORT_CHUNK_BYTES; when `limit` rows were written
+    and more remain, NDJSON ends with a resume line (unless not `resume_line`).
+    Pass the `resume` token the readings started after so counts carry on from
+    it. CSV starts with a header row unless not `header`."""
+    buffer = io.StringIO()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, COLUMNS, extrasaction='ignore')
+        if header:
+            writer.writeheader()
+    written = 0
+    last = parse_resume_token(resume) if resume else None  # (timestamp, machine id, rows with both)
+    for reading in readings:
+        if limit is not None and written >= limit:
+            if resume_line and last is not None and fmt == 'ndjson':
+                buffer.write(json.dumps({'resume': resume_token(*last)}) + '\n')
+            break
+        values = row(reading)
+        if writer is not None:
+            writer.writerow({k: v.isoformat() if k == 'timestamp' else v for k, v in values.items()})
+        else:
+            buffer.write(json.dumps(values, default=_json_default) + '\n')
+        key = (reading['timestamp'], reading['machineId'])
+        last = (*key, last[2] + 1 if last and last[:2] == key else 1)
+        written += 1
+        if on_row:
+            on_row(last)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def gzipped(chunks):
+    """Gzip-compress a stream of text chunks without buffering it"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
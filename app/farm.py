@@ -0,0 +1,228 @@
+from multiprocessing.connection import Listener, Client
+from threading import Thread, Lock, Event
+from datetime import datetime
+import multiprocessing
+import os
+
+# The simulation farm runs jobs outside the web process:
+#
+#     python run_farm.py --workers 4
+#
+# The farm process listens on SIM_FARM_ADDRESS (host:port) and hands each job
+# to the least-loaded of N worker processes. Every worker runs its jobs as
+# threads and sends readings through its own BatchedWriter. When the web app
+# has SIM_FARM_ADDRESS set, start_simulation/stop_simulation in
+# app/simulator.py become commands on this channel.
+#
+# The channel carries pickled messages, so it is only opened with a real
+# SECRET_KEY (both sides refuse to start on an unset or default one), and a
+# host-less address (":6001") binds to loopback.
+FARM_ADDRESS = os.getenv('SIM_FARM_ADDRESS')
+FARM_BATCH_SIZE = int(os.getenv('SIM_FARM_BATCH_SIZE', '200'))
+FARM_FLUSH_INTERVAL = float(os.getenv('SIM_FARM_FLUSH_INTERVAL', '1'))
+
+INSECURE_SECRET_KEYS = ('', 'default-secret-key')
+
+def authkey():
+    key = os.getenv('SECRET_KEY', '')
+    if key in INSECURE_SECRET_KEYS:
+        raise RuntimeError("The simulation farm needs SECRET_KEY set (not the default) to authenticate its channel")
+    return key.encode()
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+# ------------------ Batched Mongo writer ------------------
+
+class BatchedWriter:
+    """Buffers writes per collection and sends them with one bulk_write"""
+
+    def __init__(self, batch_size=FARM_BATCH_SIZE, flush_interval=FARM_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffers = {}  # full collection name -> (collection, [operations])
+        self._lock = Lock()
+        self._closed = Event()
+        self.inserted = 0
+        self._flusher = Thread(target=self._flush_periodically, daemon=True, name="batched-writer")
+        self._flusher.start()
+
+    def _add(self, collection, operation):
+        with self._lock:
+            _, operations = self._buffers.setdefault(collection.full_name, (collection, []))
+            operations.append(operation)
+            full = len(operations) >= self.batch_size
+        if full:
+            self.flush(collection)
+
+    def insert(self, collection, doc):
+        from pymongo import InsertOne
+        self._add(collection, InsertOne(doc))
+
+    def upsert(self, collection, query, update):
+        from pymongo import UpdateOne
+        self._add(collection, UpdateOne(query, update, upsert=True))
+
+    def flush(self, collection=None):
+        with self._lock:
+            if collection is None:
+                pending = list(self._buffers.values())
+                self._buffers = {}
+            else:
+                entry = self._buffers.pop(collection.full_name, None)
+                pending = [entry] if entry else []
+        for coll, operations in pending:
+            if operations:
+                # Ordered: bucket $push upserts must apply in reading order
+                coll.bulk_write(operations, ordered=True)
+                self.inserted += len(operations)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Batched write failed: {e}")
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+
+# ------------------ Worker processes ------------------
+
+def _worker_main(index, commands, events):
+    """Entry point of one farm worker process"""
+    from app import simulator
+    from app.clock import make_clock
+
+    # Jobs are local threads in here; stop_simulation (also called by the
+    # detector) must not loop back through the farm's command channel.
+    simulator.FARM_ADDRESS = None
+
+    writer = BatchedWriter()
+    print(f"👷 Farm worker {index} ready (pid {os.getpid()})")
+
+    def run_job(job):
+        simulator.active_simulations[job['job_id']] = {
+            'machine_id': job['machine_id'],
+            'stop_event': job['stop_event'],
+            'start_time': job['started']
+        }
+        try:
+            simulator.generate_sensor_data(
+                job['machine_id'], job['job_id'], job['duration'], job['material'],
+                job['job_type'], job['tool_no'], job['stop_event'], writer=writer,
+                clock=make_clock(job.get('speed', 1), job.get('start'), job.get('seed')),
+                rng=simulator.job_rng(job['job_id'], job.get('seed'))
+            )
+        finally:
+            events.put(('finished', index, job['job_id']))
+
+    while True:
+        command, payload = commands.get()
+        if command == 'start':
+            job = dict(payload, stop_event=Event(), started=datetime.utcnow())
+            Thread(target=run_job, args=(job,), daemon=True, name=f"sim-{payload['job_id']}").start()
+        elif command == 'stop':
+            simulator.stop_simulation(payload['job_id'])
+        elif command == 'shutdown':
+            for job_id in list(simulator.active_simulations):
+                simulator.active_simulations[job_id]['stop_event'].set()
+            writer.close()
+            return
+
+class SimulationFarm:
+    def __init__(self, workers=None, address=None):
+        from app.storage import STORAGE_BACKEND
+        if STORAGE_BACKEND == 'memory':
+            raise RuntimeError("The simulation farm writes from several processes; use STORAGE_BACKEND=mongo")
+        authkey()  # fail before any worker is spawned
+        self.worker_count = workers or os.cpu_count() or 1
+        self.address = parse_address(address or FARM_ADDRESS or '127.0.0.1:6001')
+        # spawn, not fork: every worker must open its own MongoClient
+        self._ctx = multiprocessing.get_context('spawn')
+        self._events = self._ctx.Queue()
+        self._workers = []
+        self._jobs = {}  # job_id -> (worker index, machine_id)
+        self._lock = Lock()
+
+    def start(self):
+        for index in range(self.worker_count):
+            commands = self._ctx.Queue()
+            process = self._ctx.Process(target=_worker_main, args=(index, commands, self._events),
+                                        daemon=True, name=f"sim-farm-{index}")
+            process.start()
+            self._workers.append((process, commands))
+        Thread(target=self._collect_events, daemon=True, name="farm-events").start()
+
+    def _collect_events(self):
+        while True:
+            kind, index, job_id = self._events.get()
+            if kind == 'finished':
+                with self._lock:
+                    self._jobs.pop(job_id, None)
+
+    def _least_loaded(self):
+        load = [0] * len(self._workers)
+        for index, _ in self._jobs.values():
+            load[index] += 1
+        return load.index(min(load))
+
+    def handle(self, message):
+        command = message.get('command')
+        with self._lock:
+            if command == 'start':
+                index = self._least_loaded()
+                self._jobs[message['job_id']] = (index, message['machine_id'])
+                self._workers[index][1].put(('start', {k: v for k, v in message.items() if k != 'command'}))
+                return {'ok': True, 'worker': index}
+            if command == 'stop':
+                entry = self._jobs.get(message['job_id'])
+                if entry is None:
+                    return {'ok': False}
+                self._workers[entry[0]][1].put(('stop', {'job_id': message['job_id']}))
+                return {'ok': True, 'worker': entry[0]}
+            if command == 'status':
+                return {'ok': True, 'workers': len(self._workers),
+                        'jobs': {job_id: {'worker': i, 'machineId': m} for job_id, (i, m) in self._jobs.items()}}
+        return {'ok': False, 'error': f'unknown command {command!r}'}
+
+    def _serve_connection(self, conn):
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    return
+                conn.send(self.handle(message))
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        self.start()
+        with Listener(self.address, authkey=authkey()) as listener:
+            print(f"🏭 Simulation farm listening on {self.address[0]}:{self.address[1]} "
+                  f"with {self.worker_count} workers")
+            if self.address[0] not in ('127.0.0.1', 'localhost', '::1'):
+                print("⚠️ The farm accepts connections from other hosts; keep its port firewalled")
+            while True:
+                conn = listener.accept()
+                Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def shutdown(self):
+        for process, commands in self._workers:
+            commands.put(('shutdown', None))
+        for process, _ in self._workers:
+            process.join(timeout=10)
+
+# ------------------ Web-side client ------------------
+
+def farm_request(message, address=None):
+    """Send one command to the farm and return its reply"""
+    conn = Client(parse_address(address or FARM_ADDRESS), authkey=authkey())
+    try:
+        conn.send(message)
+        return conn.recv()
+    finally:
+        conn.close()
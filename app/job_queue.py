@@ -0,0 +1,307 @@
+from datetime import datetime
+from heapq import heappush, heappop
+from itertools import count
+from threading import Thread, Event, Lock
+from app.storage import get_store
+from app.registry import registry, fleet_map
+from app.maintenance import schedule as maintenance_schedule
+from app.simulator import start_simulation, MATERIAL_PROFILES
+from app.forms import JOB_TYPES
+from app.events import subscribe
+from app.clock import parse_utc
+import os
+import time
+import uuid
+
+# Jobs waiting for a lathe live in Jobs.queue (status queued -> dispatched or
+# cancelled); Jobs.queue_state holds a version counter bumped on every submit
+# and cancel, so every process reloads its heap when the queue changes.
+#
+# Each process keeps the queued jobs in a heap ordered by priority (10 first),
+# then deadline, then submit time, plus one heap per pinned machine, and a
+# free-machine index: active lathes with no ongoing job. The index follows the
+# job_started / job_finished events the simulator publishes and is rebuilt
+# from the store every QUEUE_RECONCILE_INTERVAL seconds (farm workers finish
+# jobs in other processes, so their events never reach this one). Dispatching
+# is heap pops against that set; claiming a job (queued -> dispatched) is
+# atomic, so two dispatchers never start the same job.
+VERSION_ID = "queue"
+DISPATCH_INTERVAL = float(os.getenv('QUEUE_DISPATCH_INTERVAL', '2'))
+RECONCILE_INTERVAL = float(os.getenv('QUEUE_RECONCILE_INTERVAL', '30'))
+# Run the dispatcher in the web process (wsgi.py, run.py); set to 0 when it
+# runs on its own with run_dispatcher.py
+JOB_DISPATCHER = os.getenv('JOB_DISPATCHER', '1') == '1'
+DEFAULT_PRIORITY = 5
+MAX_BULK_JOBS = 1000
+
+JOB_TYPE_NAMES = [value for value, _ in JOB_TYPES]
+
+def new_job(spec, submitted_by=None, now=None):
+    """Validated queue document for one job spec; raises ValueError"""
+    job_type = spec.get('jobType')
+    if job_type not in JOB_TYPE_NAMES:
+        raise ValueError(f"jobType must be one of {', '.join(JOB_TYPE_NAMES)}")
+    material = spec.get('material')
+    if material not in MATERIAL_PROFILES:
+        raise ValueError(f"material must be one of {', '.join(MATERIAL_PROFILES)}")
+    try:
+        tool_no = int(spec.get('toolNo'))
+        estimated_time = float(spec.get('estimatedTime'))
+        priority = int(spec.get('priority', DEFAULT_PRIORITY))
+    except (TypeError, ValueError):
+        raise ValueError("toolNo, estimatedTime and priority must be numbers")
+    if tool_no < 1 or estimated_time <= 0:
+        raise ValueError("toolNo and estimatedTime must be positive")
+    if not 1 <= priority <= 10:
+        raise ValueError("priority must be between 1 and 10")
+    try:
+        deadline = parse_utc(spec.get('deadline'))
+    except ValueError as e:
+        raise ValueError(f"deadline {e}")
+    machine_id = spec.get('machineId') or None
+    if machine_id and registry.get(machine_id) is None:
+        raise ValueError(f"Unknown machine {machine_id}")
+    return {
+        "_id": str(uuid.uuid4()),
+        "jobType": job_type,
+        "jobDescription": spec.get('jobDescription') or '',
+        "material": material,
+        "toolNo": tool_no,
+        "estimatedTime": estimated_time,
+        "priority": priority,
+        "deadline": deadline,
+        "machineId": machine_id,
+        "operatorId": spec.get('operatorId') or submitted_by,
+        "submittedBy": submitted_by,
+        "submittedAt": now or datetime.utcnow(),
+        "status": "queued"
+    }
+
+def launch_job(machine, job, now=None):
+    """Insert the job document and start its simulation on `machine`. If the
+    start fails the document is removed again, so the lathe isn't left looking
+    busy and the job can be retried under the same id."""
+    job_id = job['_id']
+    store = get_store()
+    store.jobs.insert(machine, {
+        "_id": job_id,
+        "machineId": machine.id,
+        "operatorId": job.get('operatorId'),
+        "jobId": job_id,
+        "jobType": job['jobType'],
+        "jobDescription": job.get('jobDescription'),
+        "startTime": now or datetime.utcnow(),
+        "status": "ongoing",
+        "estimatedTime": job['estimatedTime'],
+        "actualDuration": 0,
+        "priority": job.get('priority')
+    })
+    try:
+        start_simulation(
+            machine_id=machine.id,
+            job_id=job_id,
+            duration=job['estimatedTime'],
+            material=job['material'],
+            job_type=job['jobType'],
+            tool_no=job['toolNo']
+        )
+    except Exception:
+        store.jobs.remove(machine, job_id)
+        raise
+
+def dispatch_key(job):
+    return (-job['priority'], job.get('deadline') or datetime.max, job['submittedAt'])
+
+class FreeMachineIndex:
+    """Ids of active lathes that have no ongoing job"""
+
+    def __init__(self):
+        self._free = set()
+        self._lock = Lock()
+
+    def mark_free(self, machine_id):
+        machine = registry.get(machine_id)
+        if machine is not None and machine.active:
+            with self._lock:
+                self._free.add(machine_id)
+
+    def mark_busy(self, machine_id):
+        with self._lock:
+            self._free.discard(machine_id)
+
+    def __contains__(self, machine_id):
+        return machine_id in self._free
+
+    def rebuild(self):
+        machines = registry.machines()
+        store = get_store()
+        busy = fleet_map(store.jobs.has_ongoing, machines)
+        free = {m.id for m, b in zip(machines, busy) if not b}
+        with self._lock:
+            self._free = free
+
+    def ids(self):
+        with self._lock:
+            return sorted(self._free)
+
+class JobQueue:
+    def __init__(self, dispatch_interval=DISPATCH_INTERVAL, reconcile_interval=RECONCILE_INTERVAL):
+        self.dispatch_interval = dispatch_interval
+        self.reconcile_interval = reconcile_interval
+        self.free = FreeMachineIndex()
+        self._queued = {}  # job id -> doc
+        self._heap = []  # (key, seq, job id) for unpinned jobs
+        self._pinned = {}  # machine id -> heap of pinned jobs
+        self._seq = count()
+        self._version = None
+        self._reconciled_at = float('-inf')  # reconcile on the first dispatch
+        self._lock = Lock()
+        self._wake = Event()
+        self._thread = None
+        subscribe('job_started', lambda event: self.free.mark_busy(event['machineId']))
+        subscribe('job_finished', self._on_finished)
+
+    def _on_finished(self, event):
+        self.free.mark_free(event['machineId'])
+        self._wake.set()
+
+    def _load(self):
+        store = get_store()
+        version = store.versions.get(VERSION_ID)
+        if version == self._version:
+            return
+        docs = store.queue.pending()
+        heap, pinned = [], {}
+        for job in docs:
+            heappush(pinned.setdefault(job['machineId'], []) if job.get('machineId') else heap,
+                     (dispatch_key(job), next(self._seq), job['_id']))
+        with self._lock:
+            self._queued = {job['_id']: job for job in docs}
+            self._heap, self._pinned = heap, pinned
+        self._version = version
+
+    def _top(self, heap):
+        # Jobs dispatched or cancelled since the heap was built are skipped lazily
+        while heap and heap[0][2] not in self._queued:
+            heappop(heap)
+        return heap[0] if heap else None
+
+    def _pop_for(self, machine_id):
+        """Best queued job for a free machine: its pinned jobs compete with the shared heap"""
+        with self._lock:
+            shared = self._top(self._heap)
+            pinned_heap = self._pinned.get(machine_id, [])
+            pinned = self._top(pinned_heap)
+            if shared is None and pinned is None:
+                return None
+            heap = pinned_heap if shared is None or (pinned is not None and pinned < shared) else self._heap
+            return self._queued.pop(heappop(heap)[2])
+
+    def _requeue(self, job):
+        with self._lock:
+            self._queued[job['_id']] = job
+            heap = self._pinned.setdefault(job['machineId'], []) if job.get('machineId') else self._heap
+            heappush(heap, (dispatch_key(job), next(self._seq), job['_id']))
+
+    def _start(self, job, machine, now):
+        store = get_store()
+        # One indexed lookup guards against a start the index hasn't heard of
+        # yet (a manual start or another dispatcher)
+        if store.jobs.has_ongoing(machine):
+            self.free.mark_busy(machine.id)
+            self._requeue(job)
+            return False
+        if not store.queue.set_status(job['_id'], 'dispatched', {"machineAssigned": machine.id, "dispatchedAt": now}):
+            return False
+        self.free.mark_busy(machine.id)
+        try:
+            launch_job(machine, job, now)
+        except Exception as e:
+            print(f"❌ Failed to start queued job {job['_id']} on {machine.id}: {e}")
+            self.free.mark_free(machine.id)
+            store.queue.set_status(job['_id'], 'queued', {"machineAssigned": None, "dispatchedAt": None},
+                                   if_status='dispatched')
+            self._requeue(job)
+            return False
+        print(f"📋 Dispatched queued job {job['_id']} (priority {job['priority']}) to {machine.id}")
+        return True
+
+    def dispatch_once(self, now=None):
+        """Start queued jobs on every free, non-maintenance lathe; [(job id, machine id)]"""
+        self._load()
+        if time.monotonic() - self._reconciled_at >= self.reconcile_interval:
+            self.free.rebuild()
+            self._reconciled_at = time.monotonic()
+        now = now or datetime.utcnow()
+        started = []
+        for machine in registry.machines():
+            if not self._queued:
+                break
+            if machine.id not in self.free or maintenance_schedule.is_under_maintenance(machine.id, now):
+                continue
+            job = self._pop_for(machine.id)
+            if job is not None and self._start(job, machine, now):
+                started.append((job['_id'], machine.id))
+        return started
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.dispatch_interval)
+            self._wake.clear()
+            try:
+                self.dispatch_once()
+            except Exception as e:
+                print(f"⚠️ Job dispatch failed: {e}")
+
+    def start(self):
+        """Start the dispatcher thread (once per process)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            try:
+                get_store().queue.ensure_indexes()
+            except Exception as e:
+                print(f"⚠️ Job queue index setup failed: {e}")
+            self._thread = Thread(target=self._run, daemon=True, name="job-dispatcher")
+            self._thread.start()
+        print(f"📋 Job dispatcher running (every {self.dispatch_interval:g}s)")
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def _bump(self):
+        get_store().versions.bump(VERSION_ID)
+        self._load()
+        self._wake.set()
+
+    def submit(self, jobs):
+        """Persist validated jobs (see new_job) and wake the dispatcher; their ids"""
+        job_ids = get_store().queue.add_many(jobs)
+        self._bump()
+        return job_ids
+
+    def cancel(self, job_id):
+        cancelled = get_store().queue.set_status(job_id, 'cancelled', {"cancelledAt": datetime.utcnow()})
+        if cancelled:
+            self._bump()
+        return cancelled
+
+    def start_now(self, machine, job, now=None):
+        """Start a job on `machine` right away if it is free; False when it has to wait"""
+        now = now or datetime.utcnow()
+        if maintenance_schedule.is_under_maintenance(machine.id, now) or get_store().jobs.has_ongoing(machine):
+            return False
+        launch_job(machine, job, now)
+        return True
+
+    def queued(self):
+        """Queued jobs in dispatch order"""
+        self._load()
+        with self._lock:
+            jobs = list(self._queued.values())
+        return sorted(jobs, key=dispatch_key)
+
+queue = JobQueue()
@@ -0,0 +1,92 @@
+from app.readings import FIELDS
+import os
+
+# Compact per-job summary stored on the job document as "summary", so job
+# history and comparisons never go back to the raw readings:
+#
+#   {readings, first, last, threshold, secondsAboveThreshold,
+#    peakFailureProbability, sensors: {torque: {count, mean, min, max, last}, ...}}
+#
+# The simulator feeds a JobSummary as it stores each reading and writes it on
+# completion, alert or failure. The stalled-job cleanup and
+# backfill_job_summaries.py rebuild it from the job's readings instead.
+# Time above threshold is reading-to-reading time spent with
+# failureProbability at or over JOB_SUMMARY_THRESHOLD. Means are weighted by
+# each reading's "interval" (app/sampling.py), so they stay time averages when
+# the sampling rate varies.
+SUMMARY_THRESHOLD = float(os.getenv('JOB_SUMMARY_THRESHOLD', '0.5'))
+
+class SensorStats:
+    __slots__ = ('count', 'total', 'weight', 'min', 'max', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.weight = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def add(self, value, weight=1.0):
+        self.count += 1
+        self.total += value * weight
+        self.weight += weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+
+    def to_doc(self):
+        return {'count': self.count, 'mean': round(self.total / self.weight, 4),
+                'min': self.min, 'max': self.max, 'last': self.last}
+
+class JobSummary:
+    """Running count/mean/min/max/last per sensor plus failure-risk exposure"""
+
+    def __init__(self, threshold=SUMMARY_THRESHOLD):
+        self.threshold = threshold
+        self.sensors = {f: SensorStats() for f in FIELDS}
+        self.readings = 0
+        self.first = None
+        self.last = None
+        self.seconds_above = 0.0
+        self._above = False
+
+    def add(self, reading):
+        ts = reading.get('timestamp')
+        if ts is not None:
+            if self.last is not None and self._above:
+                self.seconds_above += max(0.0, (ts - self.last).total_seconds())
+            self.first = self.first or ts
+            self.last = ts
+        # Adaptive sampling spaces readings unevenly; weight means by the time each stands for
+        weight = reading.get('interval') or 1.0
+        for f in FIELDS:
+            value = reading.get(f)
+            if value is not None:
+                self.sensors[f].add(value, weight)
+        probability = reading.get('failureProbability')
+        if probability is not None:
+            self._above = probability >= self.threshold
+        self.readings += 1
+
+    def to_doc(self):
+        return {
+            'readings': self.readings,
+            'first': self.first,
+            'last': self.last,
+            'threshold': self.threshold,
+            'secondsAboveThreshold': round(self.seconds_above, 1),
+            'peakFailureProbability': self.sensors['failureProbability'].max,
+            'sensors': {f: s.to_doc() for f, s in self.sensors.items() if s.count}
+        }
+
+def summarize(readings, threshold=SUMMARY_THRESHOLD):
+    """Summary doc for an iterable of readings in timestamp order"""
+    summary = JobSummary(threshold)
+    for reading in readings:
+        summary.add(reading)
+    return summary.to_doc()
+
+def job_readings(store, machine, job):
+    """The job's readings, bounded by its start/end so the timestamp index is used"""
+    return store.readings.between(machine, job.get('startTime'), job.get('endTime'), job_id=job['_id'])
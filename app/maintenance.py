@@ -0,0 +1,125 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from threading import Thread, Lock
+from app.storage import get_store
+import os
+import time
+
+# Windows live in Maintenance.windows; Maintenance.state holds a version
+# counter that is bumped on every booking/cancellation. Each worker keeps an
+# interval index per machine and only reloads when the version moves, so a
+# maintenance check on the hot path is a dict lookup plus a bisect.
+VERSION_ID = "windows"
+REFRESH_INTERVAL = float(os.getenv('MAINTENANCE_REFRESH_INTERVAL', '5'))
+DEFAULT_WINDOW_MINUTES = 10
+
+class IntervalIndex:
+    """Sorted, merged [start, end] intervals for one machine"""
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(intervals):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def contains(self, t):
+        i = bisect_right(self.starts, t) - 1
+        return i >= 0 and t <= self.ends[i]
+
+    def next_after(self, t):
+        """The window covering t, or the next one to start after it"""
+        i = bisect_right(self.starts, t) - 1
+        if i >= 0 and t <= self.ends[i]:
+            return self.starts[i], self.ends[i]
+        if i + 1 < len(self.starts):
+            return self.starts[i + 1], self.ends[i + 1]
+        return None
+
+class MaintenanceSchedule:
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._indexes = {}
+        self._version = None
+        self._lock = Lock()
+        self._poller = None
+
+    def _load(self):
+        store = get_store()
+        version = store.versions.get(VERSION_ID)
+        if version == self._version:
+            return
+        by_machine = {}
+        # Past windows stay stored as history but never need indexing
+        for w in store.maintenance.find(ending_after=datetime.utcnow()):
+            by_machine.setdefault(w["machineId"], []).append((w["start"], w["end"]))
+        # Swap in a fresh dict so readers never see a half-built index
+        self._indexes = {m: IntervalIndex(iv) for m, iv in by_machine.items()}
+        self._version = version
+
+    def _poll(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self._load()
+            except Exception as e:
+                print(f"⚠️ Maintenance schedule refresh failed: {e}")
+
+    def _ensure_loaded(self):
+        if self._poller is not None:
+            return
+        with self._lock:
+            if self._poller is not None:
+                return
+            try:
+                get_store().maintenance.ensure_indexes()
+                self._load()
+            except Exception as e:
+                print(f"⚠️ Maintenance schedule load failed: {e}")
+            self._poller = Thread(target=self._poll, daemon=True, name="maintenance-poller")
+            self._poller.start()
+
+    def is_under_maintenance(self, machine_id, at=None):
+        self._ensure_loaded()
+        index = self._indexes.get(machine_id)
+        return bool(index) and index.contains(at or datetime.utcnow())
+
+    def current_or_next(self, machine_id, at=None):
+        self._ensure_loaded()
+        index = self._indexes.get(machine_id)
+        return index.next_after(at or datetime.utcnow()) if index else None
+
+    def _bump(self):
+        get_store().versions.bump(VERSION_ID)
+        self._load()
+
+    def book(self, machine_id, start=None, minutes=DEFAULT_WINDOW_MINUTES, reason=None, created_by=None):
+        """Store a maintenance window and make it visible to every worker"""
+        start = start or datetime.utcnow()
+        end = start + timedelta(minutes=minutes)
+        if end <= start:
+            raise ValueError("Maintenance window must end after it starts")
+        window_id = get_store().maintenance.add({
+            "machineId": machine_id,
+            "start": start,
+            "end": end,
+            "reason": reason,
+            "createdBy": created_by,
+            "createdAt": datetime.utcnow()
+        })
+        self._bump()
+        return window_id
+
+    def cancel(self, window_id):
+        cancelled = get_store().maintenance.remove(window_id)
+        if cancelled:
+            self._bump()
+        return cancelled
+
+    def windows(self, machine_id=None, include_past=False):
+        return get_store().maintenance.find(machine_id, None if include_past else datetime.utcnow())
+
+schedule = MaintenanceSchedule()
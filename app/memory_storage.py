@@ -0,0 +1,381 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from threading import Lock
+from bson.objectid import ObjectId
+from app.readings import FIELDS
+from app.storage import RUN_FIELDS, SIGNATURE_FIELDS
+
+# In-process implementation of the store in app/storage.py. Same methods and
+# return shapes as the Mongo one; documents are copied in and out, so callers
+# can't mutate stored state. Readings are kept per machine in timestamp order
+# with a parallel list of timestamps, so latest is O(1) and newest/between are
+# a bisect plus a slice; per-field running sums make averages O(1).
+
+def _copy(doc):
+    return dict(doc) if doc is not None else None
+
+class MemoryJobs:
+    def __init__(self):
+        self._jobs = defaultdict(dict)  # machine id -> {job id: doc}, insertion order
+        self._by_status = defaultdict(lambda: defaultdict(dict))  # machine id -> status -> {job id: None}
+        self._lock = Lock()
+
+    def _index(self, machine_id, job_id, old_status, new_status):
+        if old_status == new_status:
+            return
+        if old_status is not None:
+            self._by_status[machine_id][old_status].pop(job_id, None)
+        if new_status is not None:
+            self._by_status[machine_id][new_status][job_id] = None
+
+    def insert(self, machine, job):
+        with self._lock:
+            if job['_id'] in self._jobs[machine.id]:
+                raise KeyError(f"Duplicate job {job['_id']}")
+            self._jobs[machine.id][job['_id']] = dict(job)
+            self._index(machine.id, job['_id'], None, job.get('status'))
+        return job['_id']
+
+    def get(self, machine, job_id):
+        with self._lock:
+            return _copy(self._jobs[machine.id].get(job_id))
+
+    def current(self, machine, statuses=('ongoing',)):
+        with self._lock:
+            jobs = self._jobs[machine.id]
+            for status in statuses:
+                for job_id in self._by_status[machine.id][status]:
+                    return _copy(jobs[job_id])
+        return None
+
+    def has_ongoing(self, machine):
+        with self._lock:
+            return bool(self._by_status[machine.id]['ongoing'])
+
+    def history(self, machine):
+        with self._lock:
+            jobs = [_copy(j) for j in self._jobs[machine.id].values()]
+        return sorted(jobs, key=lambda j: j.get('startTime') or datetime.min, reverse=True)
+
+    def runs(self, machine):
+        with self._lock:
+            return [{'_id': job_id, **{f: j[f] for f in RUN_FIELDS if f in j}}
+                    for job_id, j in self._jobs[machine.id].items()]
+
+    def signatures(self, machine):
+        with self._lock:
+            return [{'_id': job_id, **{f: j[f] for f in SIGNATURE_FIELDS if f in j},
+                     'summary': {'peakFailureProbability': (j.get('summary') or {}).get('peakFailureProbability')}}
+                    for job_id, j in self._jobs[machine.id].items()
+                    if j.get('status') != 'ongoing' and j.get('signature') != []]
+
+    def between(self, machine, field, start=None, end=None, descending=False, unset=None, batch_size=100):
+        with self._lock:
+            jobs = [j for j in self._jobs[machine.id].values()
+                    if j.get(field) is not None and (unset is None or j.get(unset) is None)
+                    and (start is None or j[field] >= start) and (end is None or j[field] <= end)]
+        jobs.sort(key=lambda j: (j[field], j['_id']), reverse=descending)
+        for job in jobs:
+            yield {k: v for k, v in job.items() if k not in ('summary', 'signature')}
+
+    def update(self, machine, job_id, fields, upsert=False, if_status=None):
+        with self._lock:
+            jobs = self._jobs[machine.id]
+            job = jobs.get(job_id)
+            if job is None:
+                if not upsert or if_status:
+                    return False
+                job = jobs[job_id] = {'_id': job_id}
+            elif if_status and job.get('status') != if_status:
+                return False
+            old_status = job.get('status')
+            job.update(fields)
+            self._index(machine.id, job_id, old_status, job.get('status'))
+            return True
+
+    def remove(self, machine, job_id):
+        with self._lock:
+            job = self._jobs[machine.id].pop(job_id, None)
+            if job is None:
+                return False
+            self._index(machine.id, job_id, job.get('status'), None)
+            return True
+
+    def stalled(self, machine, now):
+        with self._lock:
+            jobs = self._jobs[machine.id]
+            ongoing = [jobs[job_id] for job_id in self._by_status[machine.id]['ongoing']]
+            return [_copy(j) for j in ongoing
+                    if j.get('startTime') and j.get('estimatedTime') is not None
+                    and j['startTime'] + timedelta(minutes=j['estimatedTime']) < now]
+
+    def counts(self, machine):
+        with self._lock:
+            return {'total': len(self._jobs[machine.id]),
+                    'ongoing': len(self._by_status[machine.id]['ongoing'])}
+
+class _Series:
+    __slots__ = ('timestamps', 'docs', 'sums', 'counts')
+
+    def __init__(self):
+        self.timestamps = []
+        self.docs = []
+        self.sums = dict.fromkeys(FIELDS, 0.0)
+        self.counts = dict.fromkeys(FIELDS, 0)
+
+class MemoryReadings:
+    def __init__(self):
+        self._series = defaultdict(_Series)
+        self._lock = Lock()
+
+    def add(self, machine, reading, writer=None):
+        # writer batches Mongo round trips; nothing to batch here
+        doc = dict(reading)
+        ts = doc['timestamp']
+        with self._lock:
+            series = self._series[machine.id]
+            if not series.timestamps or ts >= series.timestamps[-1]:
+                series.timestamps.append(ts)
+                series.docs.append(doc)
+            else:
+                i = bisect_right(series.timestamps, ts)
+                series.timestamps.insert(i, ts)
+                series.docs.insert(i, doc)
+            for f in FIELDS:
+                if doc.get(f) is not None:
+                    series.sums[f] += doc[f]
+                    series.counts[f] += 1
+
+    def add_many(self, machine, batch):
+        # Like readings.store_many, a reading whose _id is already stored is skipped
+        for reading in batch:
+            if '_id' in reading and self._has(machine, reading):
+                continue
+            self.add(machine, reading)
+
+    def _has(self, machine, reading):
+        with self._lock:
+            series = self._series.get(machine.id)
+            if not series:
+                return False
+            ts = reading['timestamp']
+            lo, hi = bisect_left(series.timestamps, ts), bisect_right(series.timestamps, ts)
+            return any(doc.get('_id') == reading['_id'] for doc in series.docs[lo:hi])
+
+    def latest(self, machine):
+        with self._lock:
+            series = self._series.get(machine.id)
+            return _copy(series.docs[-1]) if series and series.docs else None
+
+    def newest(self, machine, limit, after=None):
+        with self._lock:
+            series = self._series.get(machine.id)
+            if not series:
+                return []
+            start = len(series.docs) - limit
+            if after is not None:
+                start = max(start, bisect_right(series.timestamps, after))
+            return [_copy(d) for d in series.docs[max(0, start):]]
+
+    def between(self, machine, start=None, end=None, job_id=None):
+        with self._lock:
+            series = self._series.get(machine.id)
+            if not series:
+                return
+            lo = bisect_left(series.timestamps, start) if start is not None else 0
+            hi = bisect_right(series.timestamps, end) if end is not None else len(series.docs)
+            docs = series.docs[lo:hi]
+        for doc in docs:
+            if job_id is None or doc.get('jobId') == job_id:
+                yield _copy(doc)
+
+    def averages(self, machine):
+        with self._lock:
+            series = self._series.get(machine.id)
+            if not series:
+                return {}
+            return {f: series.sums[f] / series.counts[f] for f in FIELDS if series.counts[f]}
+
+class MemoryAlerts:
+    def __init__(self):
+        self._alerts = defaultdict(list)  # machine id -> docs in timestamp order
+        self._timestamps = defaultdict(list)
+        self._lock = Lock()
+
+    def insert(self, machine, alert):
+        alert.setdefault('_id', ObjectId())
+        with self._lock:
+            timestamps = self._timestamps[machine.id]
+            i = bisect_right(timestamps, alert['timestamp'])
+            timestamps.insert(i, alert['timestamp'])
+            self._alerts[machine.id].insert(i, dict(alert))
+        return alert['_id']
+
+    def history(self, machine):
+        with self._lock:
+            return [_copy(a) for a in reversed(self._alerts[machine.id])]
+
+    def between(self, machine, start=None, end=None, descending=False, batch_size=100):
+        with self._lock:
+            timestamps = self._timestamps[machine.id]
+            lo = bisect_left(timestamps, start) if start is not None else 0
+            hi = bisect_right(timestamps, end) if end is not None else len(timestamps)
+            alerts = self._alerts[machine.id][lo:hi]
+        # Same tie order as the Mongo index: timestamp, then _id
+        alerts = sorted(alerts, key=lambda a: (a['timestamp'], a['_id']), reverse=descending)
+        for alert in alerts:
+            yield _copy(alert)
+
+    def latest_critical(self, machine):
+        with self._lock:
+            for alert in reversed(self._alerts[machine.id]):
+                if (alert.get('machineId') == machine.id and alert.get('severity') == 5
+                        and alert.get('status') == 'active' and alert.get('requiresMaintenance') is True):
+                    return _copy(alert)
+        return None
+
+class MemoryUsers:
+    def __init__(self):
+        self._users = {}  # ObjectId -> doc
+        self._by_login = {}
+        self._lock = Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            return _copy(self._users.get(ObjectId(user_id) if ObjectId.is_valid(user_id) else user_id))
+
+    def find_by_login(self, login):
+        with self._lock:
+            user_id = self._by_login.get(login)
+            return _copy(self._users.get(user_id))
+
+    def record_login(self, user_id, when):
+        with self._lock:
+            if user_id in self._users:
+                self._users[user_id]['lastLogin'] = when
+
+    def save(self, doc):
+        with self._lock:
+            user_id = self._by_login.get(doc['userID'])
+            if user_id is not None:
+                self._users[user_id].update({k: v for k, v in doc.items() if k != 'lastLogin'})
+                return False
+            user_id = doc.get('_id') or ObjectId()
+            self._users[user_id] = dict(doc, _id=user_id, lastLogin=doc.get('lastLogin'))
+            self._by_login[doc['userID']] = user_id
+            return True
+
+class MemoryMachines:
+    def __init__(self):
+        self._machines = {}
+        self._lock = Lock()
+
+    def all(self):
+        with self._lock:
+            return sorted((_copy(m) for m in self._machines.values()), key=lambda m: m['number'])
+
+    def save(self, doc):
+        with self._lock:
+            self._machines[doc['_id']] = dict(doc)
+
+    def add_if_missing(self, doc):
+        with self._lock:
+            self._machines.setdefault(doc['_id'], dict(doc))
+
+class MemoryMaintenance:
+    def __init__(self):
+        self._windows = {}
+        self._lock = Lock()
+
+    def add(self, window):
+        window.setdefault('_id', ObjectId())
+        with self._lock:
+            self._windows[window['_id']] = dict(window)
+        return window['_id']
+
+    def remove(self, window_id):
+        if not ObjectId.is_valid(window_id):
+            return False
+        with self._lock:
+            return self._windows.pop(ObjectId(window_id), None) is not None
+
+    def find(self, machine_id=None, ending_after=None):
+        with self._lock:
+            windows = [_copy(w) for w in self._windows.values()
+                       if (not machine_id or w['machineId'] == machine_id)
+                       and (ending_after is None or w['end'] >= ending_after)]
+        return sorted(windows, key=lambda w: w['start'])
+
+    def ensure_indexes(self):
+        pass
+
+class MemoryQueue:
+    def __init__(self):
+        self._jobs = {}
+        self._lock = Lock()
+
+    def add_many(self, docs):
+        with self._lock:
+            for doc in docs:
+                if doc['_id'] in self._jobs:
+                    raise KeyError(f"Duplicate queued job {doc['_id']}")
+            for doc in docs:
+                self._jobs[doc['_id']] = dict(doc)
+        return [d['_id'] for d in docs]
+
+    def get(self, job_id):
+        with self._lock:
+            return _copy(self._jobs.get(job_id))
+
+    def pending(self):
+        with self._lock:
+            return [_copy(j) for j in self._jobs.values() if j['status'] == 'queued']
+
+    def find(self, statuses=None, limit=100):
+        with self._lock:
+            jobs = [_copy(j) for j in self._jobs.values() if not statuses or j['status'] in statuses]
+        return sorted(jobs, key=lambda j: j['submittedAt'], reverse=True)[:limit]
+
+    def set_status(self, job_id, status, fields=None, if_status='queued'):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != if_status:
+                return False
+            job.update(fields or {}, status=status)
+            return True
+
+    def ensure_indexes(self):
+        pass
+
+class MemoryVersions:
+    def __init__(self):
+        self._versions = defaultdict(int)
+        self._lock = Lock()
+
+    def get(self, name):
+        return self._versions.get(name, 0)
+
+    def bump(self, name):
+        with self._lock:
+            self._versions[name] += 1
+
+class MemoryStore:
+    name = 'memory'
+
+    def __init__(self):
+        self.jobs = MemoryJobs()
+        self.readings = MemoryReadings()
+        self.alerts = MemoryAlerts()
+        self.users = MemoryUsers()
+        self.machines = MemoryMachines()
+        self.maintenance = MemoryMaintenance()
+        self.queue = MemoryQueue()
+        self.versions = MemoryVersions()
+
+    def ensure_indexes(self, machine):
+        pass
+
+    def describe(self):
+        counts = {machine_id: len(s.docs) for machine_id, s in self.readings._series.items()}
+        return f"In-memory store, readings per machine: {counts}"
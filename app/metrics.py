@@ -0,0 +1,244 @@
+from bisect import bisect_left
+from itertools import count
+from threading import Lock, local
+import os
+import time
+
+# Prometheus text-format metrics, served at /metrics. Hot paths (every request,
+# every Mongo command, every simulated reading) write to one of METRICS_SHARDS
+# shards picked per thread/greenlet, each with its own lock, so writers
+# practically never contend; a scrape merges the shards. Values are per
+# process: scrape each gunicorn worker (and farm workers report nothing here).
+METRICS_SHARDS = int(os.getenv('METRICS_SHARDS', '16'))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+_shard_ids = count()
+_local = local()
+
+def _shard_index():
+    index = getattr(_local, 'shard', None)
+    if index is None:
+        index = _local.shard = next(_shard_ids) % METRICS_SHARDS
+    return index
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = [({}, Lock()) for _ in range(METRICS_SHARDS)]
+        _registry.append(self)
+
+    def _shard(self):
+        return self._shards[_shard_index()]
+
+    def _merged(self, combine):
+        merged = {}
+        for values, lock in self._shards:
+            with lock:
+                items = list(values.items())
+            for labels, value in items:
+                merged[labels] = combine(merged[labels], value) if labels in merged else value
+        return merged
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self._samples())
+        return lines
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        values, lock = self._shard()
+        with lock:
+            values[labels] = values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._merged(lambda a, b: a + b).get(labels, 0)
+
+    def _samples(self):
+        for labels, value in sorted(self._merged(lambda a, b: a + b).items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+
+class Gauge(Counter):
+    """inc/dec gauge, or one computed at scrape time with set_function"""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set_function(self, fn):
+        """fn() returns a number, or {label values: number} for labelled gauges"""
+        self._function = fn
+
+    def _samples(self):
+        if self._function is None:
+            yield from super()._samples()
+            return
+        result = self._function()
+        items = result.items() if isinstance(result, dict) else [((), result)]
+        for labels, value in sorted(items):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        values, lock = self._shard()
+        with lock:
+            row = values.get(labels)
+            if row is None:
+                # one count per bucket, one for +Inf, then the sum
+                row = values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[index] += 1
+            row[-1] += value
+
+    def _samples(self):
+        merged = self._merged(lambda a, b: [x + y for x, y in zip(a, b)])
+        for labels, row in sorted(merged.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), row[:-1]):
+                cumulative += bucket_count
+                le = ('le', _format_value(bound) if bound != float('inf') else '+Inf')
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, [le])} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(row[-1])}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}'
+
+class RateMeter:
+    """Events per second over a sliding window of one-second slots"""
+
+    def __init__(self, window=60):
+        self.window = window
+        self._slots = [0] * window
+        self._stamps = [0] * window
+        self._lock = Lock()
+
+    def mark(self, n=1):
+        second = int(time.monotonic())
+        i = second % self.window
+        with self._lock:
+            if self._stamps[i] != second:
+                self._stamps[i], self._slots[i] = second, 0
+            self._slots[i] += n
+
+    def rate(self):
+        now = int(time.monotonic())
+        with self._lock:
+            # The current second is still filling up, so it is left out
+            total = sum(n for n, s in zip(self._slots, self._stamps) if 0 < now - s <= self.window)
+        return total / self.window
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# ------------------ Metrics ------------------
+
+request_latency = Histogram('http_request_duration_seconds', 'Time to produce a response, by route',
+                            ('route', 'method', 'status'))
+streams_in_progress = Gauge('sse_streams_in_progress', 'Open server-sent event streams, by route', ('route',))
+mongo_latency = Histogram('mongo_command_duration_seconds', 'MongoDB command latency',
+                          ('database', 'collection', 'command'))
+mongo_failures = Counter('mongo_command_failures_total', 'MongoDB commands that failed',
+                         ('database', 'collection', 'command'))
+active_simulations = Gauge('simulator_active_simulations', 'Simulations running in this process')
+readings_total = Counter('simulator_readings_total', 'Sensor readings generated in this process')
+readings_per_second = Gauge('simulator_readings_per_second', 'Sensor readings per second over the last minute')
+inference_latency = Histogram('simulator_inference_seconds', 'Failure model predict_proba latency',
+                              buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+detector_alerts = Counter('detector_alerts_total', 'Alerts raised by the online failure detector')
+
+readings_rate = RateMeter()
+readings_per_second.set_function(readings_rate.rate)
+
+def record_reading():
+    readings_total.inc()
+    readings_rate.mark()
+
+# ------------------ Mongo command listener ------------------
+
+class MongoCommandListener:
+    """Times every command on the shared client (registered by app/db.py)"""
+
+    def __init__(self):
+        self._started = {}  # (connection, request id) -> (database, collection)
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else ''
+        self._started[(event.connection_id, event.request_id)] = (event.database_name, collection)
+
+    def _finish(self, event):
+        database, collection = self._started.pop((event.connection_id, event.request_id),
+                                                 (event.database_name, ''))
+        return (database, collection, event.command_name)
+
+    def succeeded(self, event):
+        mongo_latency.observe(self._finish(event), event.duration_micros / 1e6)
+
+    def failed(self, event):
+        labels = self._finish(event)
+        mongo_latency.observe(labels, event.duration_micros / 1e6)
+        mongo_failures.inc(labels)
+
+mongo_listener = MongoCommandListener()
+
+# ------------------ Flask hooks ------------------
+
+def _track_stream(route, iterable):
+    streams_in_progress.inc((route,))
+    try:
+        yield from iterable
+    finally:
+        streams_in_progress.dec((route,))
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+def init_app(app):
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe((route, request.method, str(response.status_code)),
+                                time.perf_counter() - started)
+        if response.is_streamed and response.mimetype == 'text/event-stream':
+            response.response = _track_stream(route, response.response)
+        return response
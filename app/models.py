@@ -1,10 +1,13 @@
 from flask_login import UserMixin
-from pymongo import MongoClient
-from bson.objectid import ObjectId
+from collections import OrderedDict
+from threading import Lock
+from app.storage import get_store
 import os
+import time
 
-client = MongoClient(os.getenv("MONGO_URI"))
-auth_db = client["AuthDB"]  # Auth database
+# Bumped by anything that edits users (create_test_users.py) so every worker
+# drops its cached copies on the next version check.
+USERS_VERSION_ID = "users"
 
 class User(UserMixin):
     def __init__(self, _id, employeeId, userID, userType):
@@ -13,8 +16,106 @@ class User(UserMixin):
         self.userID = userID
         self.userType = userType
 
+    @classmethod
+    def from_record(cls, record):
+        return cls(record['_id'], record['employeeId'], record['userID'], record['userType'])
+
+class UserCache:
+    """Bounded LRU of User objects with a TTL and a shared version counter"""
+
+    def __init__(self, maxsize, ttl, version_check_interval):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._entries = OrderedDict()  # user_id -> (expires_at, user)
+        self._lock = Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _check_version(self, now):
+        # At most one storage round trip per interval, shared by all requests.
+        # The lock is only held to claim the check and to apply its result, so
+        # a slow read never stalls other lookups.
+        with self._lock:
+            if now - self._version_checked_at < self.version_check_interval:
+                return
+            self._version_checked_at = now
+        try:
+            version = get_store().versions.get(USERS_VERSION_ID)
+        except Exception:
+            return
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._entries.clear()
+            self._version = version
+
+    def get(self, user_id):
+        now = time.monotonic()
+        self._check_version(now)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user):
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+user_cache = UserCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+    version_check_interval=float(os.getenv("USER_CACHE_VERSION_CHECK", "5"))
+)
+
 def load_user(user_id):
-    record = auth_db.users.find_one({"_id": ObjectId(user_id)})
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    record = get_store().users.get(user_id)
     if record:
-        return User(record['_id'], record['employeeId'], record['userID'], record['userType'])
+        user = User.from_record(record)
+        user_cache.put(user)
+        return user
     return None
+
+def invalidate_user(user_id=None):
+    """Drop one cached user (or all of them) in this process"""
+    user_cache.invalidate(user_id)
+
+def bump_users_version():
+    """Invalidate cached users in every worker after editing stored users"""
+    get_store().versions.bump(USERS_VERSION_ID)
+    user_cache.invalidate()
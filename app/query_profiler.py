@@ -0,0 +1,168 @@
+from contextvars import ContextVar
+from threading import Lock
+import json
+import re
+import time
+
+# Request-scoped Mongo query profiler. When a request is profiled (config
+# QUERY_PROFILER, or an X-Query-Profile: 1 header in debug mode / with
+# QUERY_PROFILER_HEADER), every command it issues is counted and timed and
+# grouped by shape: the command with every value replaced by "?" and digits in
+# collection names replaced by {n}. A shape that repeats at least
+# N_PLUS_ONE_THRESHOLD times with different collections or parameters is the
+# fleet-loop pattern (one query per lathe) and is flagged as N+1. The summary
+# goes to the log and to the X-Query-Profile response header.
+#
+# The active profile lives in a ContextVar, so fleet_map (app/registry.py)
+# carries it onto its worker threads. Streaming responses are only profiled
+# up to the point the response is returned.
+N_PLUS_ONE_THRESHOLD = 5
+HEADER = 'X-Query-Profile'
+# Driver bookkeeping that says nothing about the query itself
+_IGNORED_KEYS = {'lsid', 'txnNumber', 'autocommit', 'startTransaction', 'readConcern',
+                 'writeConcern', 'ordered', 'cursor', 'batchSize', 'singleBatch', 'comment',
+                 'maxTimeMS', 'bypassDocumentValidation', 'let', 'hint', 'allowDiskUse'}
+
+_active = ContextVar('query_profile', default=None)
+
+def normalize_collection(name):
+    return re.sub(r'\d+', '{n}', name) if isinstance(name, str) else ''
+
+def _shape(value):
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = _shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return '?'
+
+def command_shape(command_name, command):
+    """(shape key, parameters) for a command document"""
+    body = {k: v for k, v in command.items()
+            if k != command_name and not k.startswith('$') and k not in _IGNORED_KEYS}
+    return json.dumps(_shape(body), sort_keys=True, default=str), json.dumps(body, sort_keys=True, default=str)
+
+class QueryProfile:
+    def __init__(self, label):
+        self.label = label
+        self.started = time.perf_counter()
+        self.shapes = {}  # (database, command, collection shape, body shape) -> stats
+        self.count = 0
+        self.seconds = 0.0
+        # fleet_map's worker threads add to the request's profile concurrently
+        self._lock = Lock()
+
+    def add(self, key, collection, params, seconds):
+        with self._lock:
+            stats = self.shapes.setdefault(key, {'count': 0, 'seconds': 0.0, 'variants': set()})
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['variants'].add((collection, params))
+            self.count += 1
+            self.seconds += seconds
+
+    def n_plus_one(self):
+        with self._lock:
+            return [(key, stats) for key, stats in self.shapes.items()
+                    if stats['count'] >= N_PLUS_ONE_THRESHOLD and len(stats['variants']) > 1]
+
+    def summary(self):
+        flagged = self.n_plus_one()
+        with self._lock:
+            count, seconds, shapes = self.count, self.seconds, len(self.shapes)
+        return {
+            'queries': count,
+            'ms': round(seconds * 1000, 2),
+            'shapes': shapes,
+            'nPlusOne': [{
+                'command': f"{key[1]} {key[0]}.{key[2]}",
+                'count': stats['count'],
+                'variants': len(stats['variants']),
+                'ms': round(stats['seconds'] * 1000, 2),
+                'shape': key[3]
+            } for key, stats in sorted(flagged, key=lambda item: -item[1]['count'])]
+        }
+
+    def header(self):
+        summary = self.summary()
+        flagged = ', '.join(f"{s['command']} x{s['count']}" for s in summary['nPlusOne'])
+        return f"queries={summary['queries']}; ms={summary['ms']}; shapes={summary['shapes']}; n+1={flagged or 'none'}"
+
+    def log(self):
+        summary = self.summary()
+        request_ms = (time.perf_counter() - self.started) * 1000
+        print(f"🔎 {self.label}: {summary['queries']} queries, {summary['ms']} ms in Mongo "
+              f"({request_ms:.1f} ms total), {summary['shapes']} shapes")
+        for s in summary['nPlusOne']:
+            print(f"   ⚠️ N+1: {s['command']} x{s['count']} ({s['variants']} variants, {s['ms']} ms) {s['shape']}")
+
+def start(label):
+    profile = QueryProfile(label)
+    return profile, _active.set(profile)
+
+def stop(token):
+    _active.reset(token)
+
+def current():
+    return _active.get()
+
+class ProfilerCommandListener:
+    """Feeds commands to the profile active in the issuing context, if any"""
+
+    def __init__(self):
+        self._pending = {}  # (connection, request id) -> (profile, key, collection, params)
+
+    def started(self, event):
+        profile = _active.get()
+        if profile is None:
+            return
+        collection = event.command.get(event.command_name)
+        collection = collection if isinstance(collection, str) else ''
+        shape, params = command_shape(event.command_name, event.command)
+        key = (event.database_name, event.command_name, normalize_collection(collection), shape)
+        self._pending[(event.connection_id, event.request_id)] = (profile, key, collection, params)
+
+    def _finish(self, event):
+        entry = self._pending.pop((event.connection_id, event.request_id), None)
+        if entry is not None:
+            profile, key, collection, params = entry
+            profile.add(key, collection, params, event.duration_micros / 1e6)
+
+    succeeded = _finish
+    failed = _finish
+
+profiler_listener = ProfilerCommandListener()
+
+# ------------------ Flask hooks ------------------
+
+def init_app(app):
+    from flask import g, request
+
+    def wanted():
+        if app.config.get('QUERY_PROFILER'):
+            return True
+        header_allowed = app.debug or app.config.get('QUERY_PROFILER_HEADER')
+        return bool(header_allowed) and request.headers.get(HEADER) == '1'
+
+    @app.before_request
+    def _start_profile():
+        if wanted():
+            g.query_profile, g.query_profile_token = start(f"{request.method} {request.full_path.rstrip('?')}")
+
+    @app.after_request
+    def _report_profile(response):
+        profile = g.pop('query_profile', None)
+        if profile is not None:
+            profile.log()
+            response.headers[HEADER] = profile.header()
+        return response
+
+    @app.teardown_request
+    def _stop_profile(exc=None):
+        token = g.pop('query_profile_token', None)
+        if token is not None:
+            stop(token)
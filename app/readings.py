@@ -0,0 +1,203 @@
+import os
+
+# Sensor readings can be stored in one of two layouts (SENSOR_LAYOUT):
+#
+# document  one BSON document per reading in lathe{n}_sensory_data (original)
+# bucket    one document per machine, job and minute in
+#           lathe{n}_sensory_data_buckets, with a packed array per field plus
+#           count/sum/min/max, appended with a $push upsert:
+#
+#   {_id: "<jobId>:202501061405", machineId, jobId, minute, count, last,
+#    t: [ts, ...], v: {torque: [...], ..., interval: [...]},
+#    sum: {torque: ...}, min: {...}, max: {...}, criticalFailure: true?}
+#
+# The helpers below hide the layout from the simulator and the routes.
+SENSOR_LAYOUT = os.getenv('SENSOR_LAYOUT', 'document')
+FIELDS = ('airTemperature', 'processTemperature', 'rotationalSpeed',
+          'torque', 'toolWear', 'failureProbability')
+FLAGS = ('alertTriggered', 'criticalFailure')
+# Per-reading values packed alongside FIELDS but without sum/min/max
+EXTRA_FIELDS = ('interval',)
+
+def bucketed(layout=None):
+    return (layout or SENSOR_LAYOUT) == 'bucket'
+
+def minute_of(ts):
+    return ts.replace(second=0, microsecond=0)
+
+def bucket_id(job_id, ts):
+    return f"{job_id}:{ts:%Y%m%d%H%M}"
+
+def bucket_update(reading):
+    """(filter, update) that appends one reading to its minute bucket"""
+    ts = reading['timestamp']
+    values = {f: reading[f] for f in FIELDS if reading.get(f) is not None}
+    extra = {f: reading[f] for f in EXTRA_FIELDS if reading.get(f) is not None}
+    update = {
+        "$setOnInsert": {"machineId": reading['machineId'], "jobId": reading['jobId'], "minute": minute_of(ts)},
+        "$push": dict({"t": ts}, **{f"v.{f}": v for f, v in {**values, **extra}.items()}),
+        "$inc": dict({"count": 1}, **{f"sum.{f}": v for f, v in values.items()}),
+        "$min": {f"min.{f}": v for f, v in values.items()},
+        "$max": dict({"last": ts}, **{f"max.{f}": v for f, v in values.items()})
+    }
+    flags = {f: True for f in FLAGS if reading.get(f)}
+    if flags:
+        update["$set"] = flags
+    return {"_id": bucket_id(reading['jobId'], ts)}, update
+
+def bucket_update_batch(batch):
+    """(filter, update) appending several readings that share one bucket, in order"""
+    first = batch[0]
+    update = {
+        "$setOnInsert": {"machineId": first['machineId'], "jobId": first['jobId'],
+                         "minute": minute_of(first['timestamp'])},
+        "$push": {"t": {"$each": [r['timestamp'] for r in batch]}},
+        "$inc": {"count": len(batch)},
+        "$min": {},
+        "$max": {"last": max(r['timestamp'] for r in batch)}
+    }
+    for f in FIELDS:
+        values = [r[f] for r in batch if r.get(f) is not None]
+        if len(values) != len(batch):
+            continue
+        update["$push"][f"v.{f}"] = {"$each": values}
+        update["$inc"][f"sum.{f}"] = sum(values)
+        update["$min"][f"min.{f}"] = min(values)
+        update["$max"][f"max.{f}"] = max(values)
+    for f in EXTRA_FIELDS:
+        values = [r[f] for r in batch if r.get(f) is not None]
+        if len(values) == len(batch):
+            update["$push"][f"v.{f}"] = {"$each": values}
+    flags = {f: True for f in FLAGS if any(r.get(f) for r in batch)}
+    if flags:
+        update["$set"] = flags
+    return {"_id": bucket_id(first['jobId'], first['timestamp'])}, update
+
+def unpack(bucket):
+    """Expand a bucket back into per-reading documents (document-layout shape)"""
+    values = bucket.get('v', {})
+    readings = []
+    for i, ts in enumerate(bucket.get('t', [])):
+        doc = {"machineId": bucket['machineId'], "jobId": bucket['jobId'], "timestamp": ts}
+        for f in FIELDS + EXTRA_FIELDS:
+            if f in values and i < len(values[f]):
+                doc[f] = values[f][i]
+        readings.append(doc)
+    if readings and bucket.get('criticalFailure'):
+        # The critical reading is always the last one written for the job
+        readings[-1].update({f: True for f in FLAGS})
+    return readings
+
+# ------------------ Writes ------------------
+
+def store(collections, reading, writer=None, layout=None):
+    """Store one reading in the active layout, through a batching writer if given"""
+    if bucketed(layout):
+        target = collections['buckets']
+        query, update = bucket_update(reading)
+        if writer is not None:
+            writer.upsert(target, query, update)
+        else:
+            target.update_one(query, update, upsert=True)
+    else:
+        target = collections['sensor']
+        if writer is not None:
+            writer.insert(target, reading)
+        else:
+            target.insert_one(reading)
+
+def ensure_indexes(collections):
+    collections['sensor'].create_index([("timestamp", -1)])
+    collections['buckets'].create_index([("last", -1)])
+    collections['buckets'].create_index([("jobId", 1), ("minute", 1)])
+
+def store_many(collections, batch, layout=None):
+    """Store readings (in timestamp order per job) with one bulk write. Safe to
+    send again after a crash (app/wal.py), also when the batch overlaps what
+    is stored: readings carry their own _id (the simulator sets it before
+    logging), so stored documents fail as duplicate keys and are skipped; in
+    the bucket layout, readings at or before a bucket's last timestamp are
+    dropped before the append."""
+    from pymongo.errors import BulkWriteError
+    if not bucketed(layout):
+        try:
+            collections['sensor'].insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+        return
+    from pymongo import UpdateOne
+    groups = {}
+    for reading in batch:
+        groups.setdefault(bucket_id(reading['jobId'], reading['timestamp']), []).append(reading)
+    # One lookup of how far each bucket already goes. A job's readings come
+    # from a single process, so nothing else appends to these buckets meanwhile.
+    stored = {doc['_id']: doc.get('last') for doc in
+              collections['buckets'].find({"_id": {"$in": list(groups)}}, {"last": 1})}
+    operations = []
+    for key, group in groups.items():
+        last = stored.get(key)
+        if last is not None:
+            group = [r for r in group if r['timestamp'] > last]
+        if group:
+            operations.append(UpdateOne(*bucket_update_batch(group), upsert=True))
+    if operations:
+        collections['buckets'].bulk_write(operations, ordered=False)
+
+# ------------------ Reads ------------------
+
+def latest(collections, layout=None):
+    """Newest reading for a machine, or None"""
+    if not bucketed(layout):
+        return collections['sensor'].find_one(sort=[("timestamp", -1)])
+    bucket = collections['buckets'].find_one(sort=[("last", -1)])
+    return unpack(bucket)[-1] if bucket and bucket.get('t') else None
+
+def newest(collections, limit, after=None, layout=None):
+    """Up to `limit` newest readings (newer than `after`), oldest first"""
+    if not bucketed(layout):
+        query = {"timestamp": {"$gt": after}} if after is not None else {}
+        docs = list(collections['sensor'].find(query).sort("timestamp", -1).limit(limit))
+        return docs[::-1]
+    query = {"last": {"$gt": after}} if after is not None else {}
+    readings = []
+    # Buckets hold up to a minute each; walk back until enough readings are found
+    for bucket in collections['buckets'].find(query).sort("last", -1):
+        readings[:0] = [r for r in unpack(bucket) if after is None or r['timestamp'] > after]
+        if len(readings) >= limit:
+            break
+    return readings[-limit:]
+
+def between(collections, start=None, end=None, job_id=None, batch_size=1000, layout=None):
+    """Readings in [start, end] (optionally for one job) in timestamp order, lazily"""
+    if not bucketed(layout):
+        query = {}
+        if start or end:
+            query["timestamp"] = {k: v for k, v in (("$gte", start), ("$lte", end)) if v is not None}
+        if job_id:
+            query["jobId"] = job_id
+        yield from collections['sensor'].find(query).sort("timestamp", 1).batch_size(batch_size)
+        return
+    query = {}
+    if start or end:
+        query["minute"] = {k: v for k, v in (("$gte", start and minute_of(start)), ("$lte", end)) if v is not None}
+    if job_id:
+        query["jobId"] = job_id
+    for bucket in collections['buckets'].find(query).sort("minute", 1).batch_size(max(1, batch_size // 12)):
+        for reading in unpack(bucket):
+            ts = reading['timestamp']
+            if (start is None or ts >= start) and (end is None or ts <= end):
+                yield reading
+
+def averages(collections, layout=None):
+    """{field: mean} over every stored reading for a machine"""
+    if not bucketed(layout):
+        group = {"_id": None}
+        group.update({f: {"$avg": f"${f}"} for f in FIELDS})
+        return next(collections['sensor'].aggregate([{"$group": group}]), {})
+    # Buckets carry their own sums, so the aggregate never unwinds the arrays
+    group = {"_id": None, "count": {"$sum": "$count"}}
+    group.update({f: {"$sum": f"$sum.{f}"} for f in FIELDS})
+    totals = next(collections['buckets'].aggregate([{"$group": group}]), {})
+    count = totals.get("count") or 0
+    return {f: totals[f] / count for f in FIELDS if count and totals.get(f) is not None}
@@ -0,0 +1,128 @@
+from datetime import datetime
+from threading import Lock
+from app.storage import get_store
+import os
+import time
+
+# Fixed-size in-memory ring buffer of recent readings per machine. The
+# simulator appends every reading it stores; the API reads from here, so
+# sparklines and "last N minutes" stats never touch the database. A buffer is
+# cold-started from one indexed query the first time a machine is read.
+RECENT_FIELDS = ('airTemperature', 'processTemperature', 'rotationalSpeed',
+                 'torque', 'toolWear', 'failureProbability')
+RECENT_CAPACITY = int(os.getenv('RECENT_BUFFER_SIZE', '720'))  # 1 hour at 5 s
+# Readings written by another process (the simulation farm) never reach
+# record(); with a sync interval the buffer pulls newer rows from storage instead.
+RECENT_SYNC_INTERVAL = float(os.getenv('RECENT_SYNC_INTERVAL', '5' if os.getenv('SIM_FARM_ADDRESS') else '0'))
+
+_EPOCH = datetime(1970, 1, 1)
+
+def _to_epoch(ts):
+    return (ts - _EPOCH).total_seconds()
+
+class RingBuffer:
+    def __init__(self, capacity=RECENT_CAPACITY):
+        import numpy as np  # deferred: only processes that serve /recent pay for it
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, len(RECENT_FIELDS)), dtype=np.float32)
+        self.count = 0
+        self.head = 0  # next slot to write
+        self.synced_at = 0.0
+        self._lock = Lock()
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes
+
+    @property
+    def last_timestamp(self):
+        return self.timestamps[(self.head - 1) % self.capacity] if self.count else None
+
+    def append(self, reading):
+        ts = _to_epoch(reading['timestamp'])
+        with self._lock:
+            # Cold start and live appends can overlap; keep the series monotonic
+            if self.count and ts <= self.timestamps[(self.head - 1) % self.capacity]:
+                return
+            self.timestamps[self.head] = ts
+            self.values[self.head] = [reading.get(f, 0) or 0 for f in RECENT_FIELDS]
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def latest(self, n):
+        """Up to n newest readings, oldest first, as (timestamps, values) copies"""
+        import numpy as np
+        with self._lock:
+            n = max(0, min(n, self.count))
+            idx = (np.arange(self.head - n, self.head)) % self.capacity
+            return self.timestamps[idx], self.values[idx]
+
+    def window(self, seconds, now=None):
+        """Readings from the last `seconds` (relative to now or the newest reading)"""
+        timestamps, values = self.latest(self.count)
+        if not len(timestamps):
+            return timestamps, values
+        cutoff = (now if now is not None else timestamps[-1]) - seconds
+        start = timestamps.searchsorted(cutoff, side='left')
+        return timestamps[start:], values[start:]
+
+    def stats(self, seconds, now=None):
+        timestamps, values = self.window(seconds, now)
+        if not len(timestamps):
+            return {'count': 0}
+        return {
+            'count': int(len(timestamps)),
+            'from': datetime.utcfromtimestamp(timestamps[0]).isoformat(),
+            'to': datetime.utcfromtimestamp(timestamps[-1]).isoformat(),
+            'fields': {
+                field: {
+                    'mean': round(float(values[:, i].mean()), 4),
+                    'min': round(float(values[:, i].min()), 4),
+                    'max': round(float(values[:, i].max()), 4),
+                    'std': round(float(values[:, i].std()), 4),
+                    'last': round(float(values[-1, i]), 4)
+                } for i, field in enumerate(RECENT_FIELDS)
+            }
+        }
+
+_buffers = {}
+_lock = Lock()
+
+def _sync(buffer, machine):
+    """Pull readings newer than the buffer's tail with one indexed range query"""
+    last = buffer.last_timestamp
+    after = datetime.utcfromtimestamp(last) if last is not None else None
+    for doc in get_store().readings.newest(machine, buffer.capacity, after=after):
+        buffer.append(doc)
+    buffer.synced_at = time.monotonic()
+
+def get_buffer(machine):
+    """The machine's buffer, cold-started from stored readings on first use"""
+    machine_id = machine.id
+    buffer = _buffers.get(machine_id)
+    if buffer is None:
+        with _lock:
+            buffer = _buffers.get(machine_id)
+            if buffer is None:
+                buffer = RingBuffer()
+                _sync(buffer, machine)
+                _buffers[machine_id] = buffer
+    elif RECENT_SYNC_INTERVAL and time.monotonic() - buffer.synced_at >= RECENT_SYNC_INTERVAL:
+        _sync(buffer, machine)
+    return buffer
+
+def record(machine_id, reading):
+    """Called from the simulator write path; only feeds buffers already in use"""
+    buffer = _buffers.get(machine_id)
+    if buffer is not None:
+        buffer.append(reading)
+
+def memory_report():
+    per_machine = {machine_id: b.nbytes for machine_id, b in _buffers.items()}
+    return {
+        'capacity': RECENT_CAPACITY,
+        'bytesPerMachine': RECENT_CAPACITY * (8 + 4 * len(RECENT_FIELDS)),
+        'machines': len(per_machine),
+        'totalBytes': sum(per_machine.values())
+    }
@@ -0,0 +1,153 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from threading import Thread, Lock
+from app.db import get_client
+from app.storage import get_store
+import os
+import time
+
+# The fleet lives in Fleet.machines, one document per lathe:
+#   {_id: "LATHE-01", number: 1, plant: "Main", line: "Line-1", active: True,
+#    jobsCollection: "lathe1_job_detail", sensorCollection: "lathe1_sensory_data",
+#    alertsCollection: "lathe1_alerts"}
+# Every worker caches the whole list and reloads it when the version counter in
+# Fleet.state moves, the same way app/maintenance.py handles its windows.
+VERSION_ID = "machines"
+REFRESH_INTERVAL = float(os.getenv('REGISTRY_REFRESH_INTERVAL', '30'))
+FLEET_QUERY_CONCURRENCY = int(os.getenv('FLEET_QUERY_CONCURRENCY', '16'))
+DEFAULT_FLEET_SIZE = 20
+
+def default_machine_doc(number, plant="Main", line="Line-1"):
+    return {
+        "_id": f"LATHE-{number:02d}",
+        "number": number,
+        "plant": plant,
+        "line": line,
+        "active": True,
+        "jobsCollection": f"lathe{number}_job_detail",
+        "sensorCollection": f"lathe{number}_sensory_data",
+        "alertsCollection": f"lathe{number}_alerts"
+    }
+
+class Machine:
+    def __init__(self, doc):
+        self.id = doc["_id"]
+        self.number = doc["number"]
+        self.plant = doc.get("plant")
+        self.line = doc.get("line")
+        self.active = doc.get("active", True)
+        self.jobs_collection = doc["jobsCollection"]
+        self.sensor_collection = doc["sensorCollection"]
+        self.alerts_collection = doc["alertsCollection"]
+
+    def collections(self, client=None, db_prefix=''):
+        """The machine's Mongo collections (used by MongoStore and the layout tools)"""
+        client = client or get_client()
+        return {
+            'jobs': client[f'{db_prefix}Jobs'][self.jobs_collection],
+            'sensor': client[f'{db_prefix}SensorData'][self.sensor_collection],
+            'buckets': client[f'{db_prefix}SensorData'][f"{self.sensor_collection}_buckets"],
+            'alerts': client[f'{db_prefix}Alerts'][self.alerts_collection]
+        }
+
+class MachineRegistry:
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._machines = []
+        self._by_id = {}
+        self._version = None
+        self._lock = Lock()
+        self._poller = None
+
+    def _load(self):
+        store = get_store()
+        version = store.versions.get(VERSION_ID)
+        if version == self._version and self._machines:
+            return
+        docs = store.machines.all()
+        if not docs:
+            seed_default_fleet()
+            version = store.versions.get(VERSION_ID)
+            docs = store.machines.all()
+        loaded = [Machine(d) for d in docs]
+        self._machines, self._by_id = loaded, {m.id: m for m in loaded}
+        self._version = version
+
+    def _poll(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self._load()
+            except Exception as e:
+                print(f"⚠️ Machine registry refresh failed: {e}")
+
+    def _ensure_loaded(self):
+        if self._poller is not None:
+            return
+        with self._lock:
+            if self._poller is not None:
+                return
+            self._load()
+            self._poller = Thread(target=self._poll, daemon=True, name="registry-poller")
+            self._poller.start()
+
+    def get(self, machine_id):
+        self._ensure_loaded()
+        return self._by_id.get(machine_id)
+
+    def machines(self, plant=None, line=None, include_inactive=False):
+        self._ensure_loaded()
+        return [
+            m for m in self._machines
+            if (include_inactive or m.active)
+            and (not plant or m.plant == plant)
+            and (not line or m.line == line)
+        ]
+
+    def page(self, plant=None, line=None, page=1, per_page=50):
+        """Returns (machines on this page, all machines matching the filter)"""
+        matching = self.machines(plant, line)
+        page = max(1, page)
+        start = (page - 1) * per_page
+        return matching[start:start + per_page], matching
+
+    def groups(self):
+        """{plant: {line: [machine ids]}} for the active fleet"""
+        grouped = {}
+        for m in self.machines():
+            grouped.setdefault(m.plant, {}).setdefault(m.line, []).append(m.id)
+        return grouped
+
+    def reload(self):
+        with self._lock:
+            self._version = None
+            self._load()
+
+def bump_version():
+    get_store().versions.bump(VERSION_ID)
+
+def register_machine(doc):
+    """Insert or update one machine and make sure its collections are indexed"""
+    store = get_store()
+    store.machines.save(doc)
+    store.ensure_indexes(Machine(doc))
+    bump_version()
+
+def seed_default_fleet(count=DEFAULT_FLEET_SIZE):
+    """The original fixed fleet: LATHE-01..LATHE-20 on one line"""
+    store = get_store()
+    for number in range(1, count + 1):
+        store.machines.add_if_missing(default_machine_doc(number))
+    bump_version()
+    print(f"🏭 Seeded machine registry with {count} lathes")
+
+_fleet_pool = ThreadPoolExecutor(max_workers=FLEET_QUERY_CONCURRENCY, thread_name_prefix="fleet-query")
+
+def fleet_map(fn, machines):
+    """Run fn(machine) for every machine concurrently; results keep machine order"""
+    # Each call runs in a copy of the caller's context (e.g. the request's
+    # query profile, see app/query_profiler.py)
+    calls = [(copy_context(), m) for m in machines]
+    return list(_fleet_pool.map(lambda call: call[0].run(fn, call[1]), calls))
+
+registry = MachineRegistry()
@@ -0,0 +1,283 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
+from threading import Condition, Lock
+from app.twin_feed import MachineState, reading_state, encode_frame
+import os
+import secrets
+import time
+
+# Historical replay (/api/replay, /stream/replay/<id>): plays back one
+# machine's readings over [from, to] through the live views (lathe_detail's
+# SSE format and the twin's binary frames) at 1x-100x, with pause and seek.
+#
+# A session reads through an indexed range cursor (store.readings.between).
+# Chunks of REPLAY_READ_AHEAD readings are fetched on a small shared pool
+# while the previous chunk plays, so a stream never waits on the database and
+# a session holds at most two chunks plus REPLAY_HISTORY sent readings.
+#
+# Playback time is anchored: position = anchor position + (now - anchor) *
+# speed, frozen while paused. A reading goes out once the position passes
+# its timestamp. A seek inside the buffered chunk just drops readings; any
+# other seek opens a new cursor at the target, never at the window start.
+# Gaps longer than REPLAY_MAX_GAP seconds of wall time (idle time between
+# jobs) are shortened to it.
+#
+# Every stream of a session sees the same playback. Idle sessions (no stream
+# and no control for REPLAY_IDLE_TIMEOUT seconds) are dropped; so are ended
+# ones nobody has controlled for that long, even with a stream still open.
+REPLAY_READ_AHEAD = int(os.getenv('REPLAY_READ_AHEAD', '500'))
+REPLAY_HISTORY = 256
+REPLAY_MAX_SESSIONS = int(os.getenv('REPLAY_MAX_SESSIONS', '50'))
+REPLAY_IDLE_TIMEOUT = float(os.getenv('REPLAY_IDLE_TIMEOUT', '600'))
+REPLAY_MAX_GAP = float(os.getenv('REPLAY_MAX_GAP', '2'))
+MIN_SPEED = 1.0
+MAX_SPEED = 100.0
+
+_fetch_pool = ThreadPoolExecutor(max_workers=int(os.getenv('REPLAY_FETCH_WORKERS', '4')),
+                                 thread_name_prefix="replay-fetch")
+
+def clamp_speed(speed):
+    return max(MIN_SPEED, min(float(speed), MAX_SPEED))
+
+class ReplaySession:
+    def __init__(self, store, machine, start, end, speed=1.0, owner=None):
+        self.id = secrets.token_urlsafe(12)
+        self.store = store
+        self.machine = machine
+        self.start = start
+        self.end = end
+        self.speed = clamp_speed(speed)
+        self.owner = owner
+        self.paused = False
+        self.ended = False
+        self.last_access = time.monotonic()
+
+        self._changed = Condition(Lock())
+        self._position = start  # playback position at self._anchor
+        self._anchor = time.monotonic()
+        self._buffer = deque()  # fetched, not yet played
+        self._cursor = None
+        self._pending = None  # Future of the next chunk
+        self._exhausted = False
+        self._sent = deque(maxlen=REPLAY_HISTORY)  # (seq, reading) already played
+        self._seq = 0
+        self._open(start)
+
+    # ---- reading ahead ----
+
+    def _open(self, at):
+        """Start reading the window from `at` (called with the lock held or before sharing)"""
+        if self._pending is not None:
+            self._pending.result()  # the old cursor must be idle before it's closed
+            self._pending = None
+        if self._cursor is not None:
+            self._cursor.close()
+        self._buffer.clear()
+        self._exhausted = False
+        self._cursor = self.store.readings.between(self.machine, at, self.end)
+        self._read_ahead()
+
+    def _read_ahead(self):
+        if self._pending is None and not self._exhausted and len(self._buffer) < REPLAY_READ_AHEAD:
+            self._pending = _fetch_pool.submit(lambda cursor: list(islice(cursor, REPLAY_READ_AHEAD)), self._cursor)
+
+    def _peek(self):
+        """Next unplayed reading or None at the end; waits only when the buffer ran dry"""
+        while True:
+            if self._pending is not None and (not self._buffer or self._pending.done()):
+                self._collect()
+            self._read_ahead()
+            if self._buffer or self._pending is None:
+                return self._buffer[0] if self._buffer else None
+
+    def _collect(self):
+        chunk = self._pending.result()
+        self._pending = None
+        self._buffer.extend(chunk)
+        if len(chunk) < REPLAY_READ_AHEAD:
+            self._exhausted = True
+
+    # ---- playback ----
+
+    def _now_position(self, now):
+        if self.paused:
+            return self._position
+        return self._position + timedelta(seconds=(now - self._anchor) * self.speed)
+
+    def _reanchor(self, now, position=None):
+        self._position = self._now_position(now) if position is None else position
+        self._anchor = now
+
+    def _advance(self, now):
+        """Move readings that are due into the sent history"""
+        position = self._now_position(now)
+        while True:
+            reading = self._peek()
+            if reading is None:
+                if not self.ended:
+                    self.ended = True
+                    self._changed.notify_all()
+                return None
+            ahead = (reading['timestamp'] - position).total_seconds() / self.speed
+            if ahead > 0:
+                if ahead > REPLAY_MAX_GAP and not self.paused:
+                    self._reanchor(now, reading['timestamp'] - timedelta(seconds=REPLAY_MAX_GAP * self.speed))
+                    ahead = REPLAY_MAX_GAP
+                return ahead
+            self._buffer.popleft()
+            self._seq += 1
+            self._sent.append((self._seq, reading))
+            self._changed.notify_all()
+
+    def readings_after(self, seq, timeout):
+        """(readings played since `seq` as [(seq, reading)], state); waits up to
+        `timeout` for the next one. Readings older than REPLAY_HISTORY are skipped."""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            if not self.ended:
+                # An open stream on a finished replay doesn't keep it alive
+                self.last_access = time.monotonic()
+            while True:
+                now = time.monotonic()
+                ahead = self._advance(now)
+                new = [(s, r) for s, r in self._sent if s > seq]
+                remaining = deadline - now
+                if new or remaining <= 0:
+                    return new, self.state(now)
+                # Sleep until the next reading is due, a control wakes us, or timeout
+                self._changed.wait(remaining if self.paused or ahead is None else min(ahead, remaining))
+
+    # ---- controls ----
+
+    def pause(self):
+        with self._changed:
+            if not self.paused:
+                self._reanchor(time.monotonic())
+                self.paused = True
+            self._touched()
+
+    def play(self):
+        with self._changed:
+            if self.paused:
+                self.paused = False
+                self._anchor = time.monotonic()
+            self._touched()
+
+    def set_speed(self, speed):
+        with self._changed:
+            self._reanchor(time.monotonic())
+            self.speed = clamp_speed(speed)
+            self._touched()
+
+    def seek(self, at):
+        """Jump to `at` (clamped to the window); buffered readings are reused when `at` is inside them"""
+        at = max(self.start, min(at, self.end)) if self.end else max(self.start, at)
+        with self._changed:
+            if self._pending is not None and self._pending.done():
+                self._collect()
+            if self._buffer and self._buffer[0]['timestamp'] <= at <= self._buffer[-1]['timestamp']:
+                while self._buffer[0]['timestamp'] < at:
+                    self._buffer.popleft()
+            else:
+                self._open(at)
+            self._reanchor(time.monotonic(), at)
+            self.ended = False
+            self._touched()
+
+    def _touched(self):
+        self.last_access = time.monotonic()
+        self._changed.notify_all()
+
+    def close(self):
+        with self._changed:
+            if self._pending is not None:
+                self._pending.result()
+                self._pending = None
+            self._cursor.close()
+            self.ended = True
+            self._changed.notify_all()
+
+    def state(self, now=None):
+        return {
+            'id': self.id,
+            'machineId': self.machine.id,
+            'from': self.start.isoformat(),
+            'to': self.end.isoformat() if self.end else None,
+            'position': self._now_position(now or time.monotonic()).isoformat(),
+            'speed': self.speed,
+            'paused': self.paused,
+            'ended': self.ended,
+            'buffered': len(self._buffer)
+        }
+
+def sse_data(reading, state):
+    """The sensor_data_stream "active" payload plus where the replay is"""
+    data = {
+        "status": "active",
+        "airTemperature": reading.get("airTemperature", 0),
+        "processTemperature": reading.get("processTemperature", 0),
+        "rotationalSpeed": reading.get("rotationalSpeed", 0),
+        "torque": reading.get("torque", 0),
+        "toolWear": reading.get("toolWear", 0),
+        "failureProbability": reading.get("failureProbability", 0),
+        "timestamp": reading["timestamp"].isoformat(),
+        "jobId": reading.get("jobId")
+    }
+    data["replay"] = state
+    return data
+
+def twin_frame(machine_id, reading, seq):
+    """A one-machine twin frame (layout 1) for the reading, versioned by its sequence number"""
+    state = MachineState()
+    state.running = reading is not None and reading.get('jobId') is not None
+    state.timestamp, state.values, state.flags = reading_state(reading)
+    return encode_frame(seq, [(machine_id, state)])
+
+class ReplayManager:
+    def __init__(self, max_sessions=REPLAY_MAX_SESSIONS, idle_timeout=REPLAY_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = Lock()
+
+    def _reap(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        for session_id, session in list(self._sessions.items()):
+            if session.last_access < cutoff:
+                del self._sessions[session_id]
+                session.close()
+
+    def create(self, store, machine, start, end, speed=1.0, owner=None):
+        """A new session, or None when REPLAY_MAX_SESSIONS are open"""
+        with self._lock:
+            self._reap()
+            if len(self._sessions) >= self.max_sessions:
+                return None
+        # Opened outside the lock (it starts a fetch); the count is checked
+        # again together with the insert so concurrent creates can't overshoot
+        session = ReplaySession(store, machine, start, end, speed, owner)
+        with self._lock:
+            if len(self._sessions) < self.max_sessions:
+                self._sessions[session.id] = session
+                return session
+        session.close()
+        return None
+
+    def get(self, session_id):
+        with self._lock:
+            self._reap()
+            return self._sessions.get(session_id)
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+        return session is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+sessions = ReplayManager()
@@ -1,13 +1,24 @@
 from app import app
-from flask import Flask, flash, render_template, redirect, url_for, Response, request, g
+from flask import Flask, flash, render_template, redirect, url_for, Response, request, g, abort
 from app.forms import JobForm, AlertForm, LoginForm
-from app.simulator import start_simulation
-from app.models import User, auth_db
+from app.job_queue import queue as job_queue, new_job, MAX_BULK_JOBS
+from app.events import publish
+from app.job_summary import summarize, job_readings
+from app.utilization import utilization, BUCKETS as UTILIZATION_BUCKETS
+from app.similarity import similarity, METRICS as SIMILARITY_METRICS
+from app.export import FORMATS as EXPORT_FORMATS
+from app.timeline import timeline, decode_cursor as decode_timeline_cursor, TYPES as TIMELINE_TYPES, \
+    ORDERS as TIMELINE_ORDERS, TIMELINE_PAGE_SIZE, TIMELINE_MAX_PAGE_SIZE
+from app.clock import parse_utc
+from app.models import User, user_cache, invalidate_user
+from app.storage import get_store, STORAGE_BACKEND
+from app.maintenance import schedule as maintenance_schedule
+from app.registry import registry as machine_registry, fleet_map
+from app import recent, metrics, sampler, export, twin_feed, replay
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash
 from functools import wraps
-from datetime import datetime, timedelta
-from pymongo import MongoClient
+from datetime import datetime, timezone, timedelta
 import os
 from datetime import datetime
 import json
@@ -37,37 +48,129 @@ def manager_required(f):
     return decorated_function
 
 # ------------------ DB Helpers ------------------
-lathe_maintenance = {}
 
 def get_db():
-    if 'mongo_client' not in g:
-        g.mongo_client = MongoClient(os.getenv('MONGO_URI'))
-    return g.mongo_client
+    # Shared process-wide store; safe to call from stream generators that
+    # outlive the request context.
+    return get_store()
 
-def get_collections(machine_id):
-    machine_num = int(machine_id.split('-')[1])
-    client = get_db()  # ✅ use the correct function name
+def get_machine(machine_id):
+    machine = machine_registry.get(machine_id)
+    if machine is None:
+        abort(404)
+    return machine
+
+# ------------------ Fleet Helpers ------------------
+
+def fleet_filters():
+    """plant/line filters and paging shared by the fleet-wide routes"""
     return {
-        'jobs': client['Jobs'][f'lathe{machine_num}_job_detail'],
-        'sensor': client['SensorData'][f'lathe{machine_num}_sensory_data'],
-        'alerts': client['Alerts'][f'lathe{machine_num}_alerts']
+        'plant': request.args.get('plant') or None,
+        'line': request.args.get('line') or None,
+        'page': request.args.get('page', 1, type=int),
+        'per_page': max(1, min(request.args.get('per_page', 50, type=int), 200))
     }
 
-@app.teardown_appcontext
-def close_db(error):
-    if 'db' in g:
-        g.db.close()
+def machine_is_on(machine):
+    return get_db().jobs.has_ongoing(machine)
+
+def fleet_statuses(machines, now):
+    is_on = fleet_map(machine_is_on, machines)
+    return [{
+        'id': m.id,
+        'plant': m.plant,
+        'line': m.line,
+        'is_on': on,
+        'under_maintenance': maintenance_schedule.is_under_maintenance(m.id, now)
+    } for m, on in zip(machines, is_on)]
+
+def fleet_summary(statuses):
+    on_count = sum(1 for lathe in statuses if lathe['is_on'])
+    return {'total': len(statuses), 'on': on_count, 'off': len(statuses) - on_count}
 # ------------------ Debug mongodb ------------------
 @app.route('/debug/mongodb')
 @login_required
 def debug_mongodb():
     try:
-        db = get_db()
-        # Test connection
-        collections = db.list_database_names()
-        return f"✅ MongoDB Connected! Databases: {collections}"
+        return f"✅ Storage connected ({STORAGE_BACKEND}): {get_db().describe()}"
     except Exception as e:
-        return f"❌ MongoDB Connection Failed: {str(e)}"
+        return f"❌ Storage connection failed: {str(e)}"
+
+# ------------------ Metrics ------------------
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Scrapers can't log in; set METRICS_TOKEN to require a bearer token
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ------------------ Digital twin feed ------------------
+
+def twin_authorized():
+    # Twins send TWIN_TOKEN as a bearer token when it is set; otherwise a login session
+    token = os.getenv('TWIN_TOKEN')
+    if token:
+        return request.headers.get('Authorization') == f"Bearer {token}"
+    return current_user.is_authenticated
+
+@app.route('/api/twin/frame')
+def twin_frame():
+    """Latest packed fleet frame; with ?since=<version>&wait=<s>, long-poll until it changes"""
+    if not twin_authorized():
+        abort(401)
+    since = request.args.get('since', type=int)
+    if since is not None:
+        wait = max(0.0, min(request.args.get('wait', twin_feed.TWIN_MAX_WAIT, type=float), twin_feed.TWIN_MAX_WAIT))
+        if twin_feed.feed.wait(since, wait) == since:
+            return Response(status=204, headers={'X-Twin-Version': str(since)})
+    version, frame = twin_feed.feed.frame()
+    return Response(frame, mimetype='application/octet-stream',
+                    headers={'X-Twin-Version': str(version), 'Cache-Control': 'no-cache'})
+
+@app.route('/api/twin/stream')
+def twin_stream():
+    """Packed frames back to back, each sent when the snapshot changes, at most ?hz= per second"""
+    if not twin_authorized():
+        abort(401)
+    hz = max(0.1, min(request.args.get('hz', twin_feed.TWIN_STREAM_HZ, type=float), twin_feed.TWIN_MAX_HZ))
+
+    def generate():
+        sent = None
+        while True:
+            started = time.monotonic()
+            # Unchanged for TWIN_MAX_WAIT seconds: the same frame again, as a heartbeat
+            twin_feed.feed.wait(sent, twin_feed.TWIN_MAX_WAIT)
+            sent, frame = twin_feed.feed.frame()
+            yield frame
+            time.sleep(max(0.0, 1.0 / hz - (time.monotonic() - started)))
+
+    return Response(generate(), mimetype='application/octet-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/debug/profile')
+@login_required
+@manager_required
+def sampling_profile():
+    """Sample every thread's stack for ?seconds= at ?hz=; collapsed stacks for flame graphs"""
+    result = sampler.profile(
+        seconds=request.args.get('seconds', 10, type=float),
+        hz=request.args.get('hz', sampler.SAMPLER_HZ, type=float),
+        include_idle=request.args.get('idle') == '1'
+    )
+    if result is None:
+        return jsonify({'error': 'A profiling session is already running'}), 409
+    if request.args.get('format') == 'json':
+        return jsonify(result.summary())
+    return Response(result.collapsed(), mimetype='text/plain', headers={
+        'X-Sampler-Samples': str(result.samples),
+        'X-Sampler-Roles': ', '.join(f"{role}={n}" for role, n in result.roles.most_common())
+    })
+
+@app.route('/debug/user-cache')
+@login_required
+def debug_user_cache():
+    return jsonify(user_cache.stats())
 
 # ------------------ Auth Routes ------------------
 
@@ -79,11 +182,12 @@ def home():
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        record = auth_db.users.find_one({"userID": form.userID.data})
+        record = get_db().users.find_by_login(form.userID.data)
         if record and check_password_hash(record['passwordHash'], form.password.data or ""):
-            user = User(record['_id'], record['employeeId'], record['userID'], record['userType'])
+            user = User.from_record(record)
             login_user(user)
-            auth_db.users.update_one({'_id': record['_id']}, {'$set': {'lastLogin': datetime.now()}})
+            user_cache.put(user)
+            get_db().users.record_login(record['_id'], datetime.now())
             return redirect(url_for('manager_landing') if user.userType == "manager" else 'dashboard')
         else:
             flash('Invalid credentials', 'danger')
@@ -92,6 +196,7 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
+    invalidate_user(current_user.id)
     logout_user()
     return redirect(url_for('login'))
 
@@ -170,81 +275,157 @@ def manager_landing():
 @login_required
 @manager_required
 def analytics_dashboard():
-    db = get_db()
-    lathe_jobs = []
-    lathe_rotationalSpeed = []   # was lathe_rpm
-    lathe_airTemperature = []    # was lathe_temp
-    lathe_processTemperature = []  # if you track separately
-    lathe_torque = []            # new metric
-    lathe_toolWear = []          # new metric
-
-    total_jobs = 0
-    active_jobs = 0
-
-    for machine_num in range(1, 21):
-        job_coll = db['Jobs'][f'lathe{machine_num}_job_detail']
-        sensor_coll = db['SensorData'][f'lathe{machine_num}_sensory_data']
-
-        # Count jobs
-        jobs_count = job_coll.count_documents({})
-        lathe_jobs.append(jobs_count)
-        total_jobs += jobs_count
-        active_jobs += job_coll.count_documents({'status': 'ongoing'})
-
-        # 🔥 FIXED - Using correct parameter names
-        try:
-            rpm = sensor_coll.aggregate([
-                {"$group": {"_id": None, "avg": {"$avg": "$rotationalSpeed"}}}  # ✅ Fixed
-            ])
-            lathe_rotationalSpeed.append(round(next(rpm, {}).get('avg', 0), 2))
-        except:
-            lathe_rotationalSpeed.append(0)
+    filters = fleet_filters()
+    machines = machine_registry.machines(filters['plant'], filters['line'])
 
+    def machine_analytics(machine):
+        store = get_db()
+        # One pass over each collection instead of a query per metric
+        jobs = store.jobs.counts(machine)
         try:
-            air_temp = sensor_coll.aggregate([
-                {"$group": {"_id": None, "avg": {"$avg": "$airTemperature"}}}
-            ])
-            lathe_airTemperature.append(round(next(air_temp, {}).get('avg', 0), 2))
-        except:
-            lathe_airTemperature.append(0)
+            averages = store.readings.averages(machine)
+        except Exception:
+            averages = {}
+        return jobs, averages
 
-        try:
-            process_temp = sensor_coll.aggregate([
-                {"$group": {"_id": None, "avg": {"$avg": "$processTemperature"}}}
-            ])
-            lathe_processTemperature.append(round(next(process_temp, {}).get('avg', 0), 2))
-        except:
-            lathe_processTemperature.append(0)
+    results = fleet_map(machine_analytics, machines)
 
-        try:
-            torque = sensor_coll.aggregate([
-                {"$group": {"_id": None, "avg": {"$avg": "$torque"}}}
-            ])
-            lathe_torque.append(round(next(torque, {}).get('avg', 0), 2))
-        except:
-            lathe_torque.append(0)
+    def series(field):
+        return [round(averages.get(field) or 0, 2) for _, averages in results]
 
-        try:
-            tool_wear = sensor_coll.aggregate([
-                {"$group": {"_id": None, "avg": {"$avg": "$toolWear"}}}
-            ])
-            lathe_toolWear.append(round(next(tool_wear, {}).get('avg', 0), 2))
-        except:
-            lathe_toolWear.append(0)
+    lathe_jobs = [jobs.get('total', 0) for jobs, _ in results]
 
     return render_template(
         "analytics_dashboard.html",
+        lathe_labels=[m.id for m in machines],
         lathe_jobs=lathe_jobs,
-        lathe_rotationalSpeed=lathe_rotationalSpeed,
-        lathe_airTemperature=lathe_airTemperature,
-        lathe_processTemperature=lathe_processTemperature,
-        lathe_torque=lathe_torque,
-        lathe_toolWear=lathe_toolWear,
-        total_jobs=total_jobs,
-        active_jobs=active_jobs
+        lathe_rotationalSpeed=series('rotationalSpeed'),
+        lathe_airTemperature=series('airTemperature'),
+        lathe_processTemperature=series('processTemperature'),
+        lathe_torque=series('torque'),
+        lathe_toolWear=series('toolWear'),
+        total_jobs=sum(lathe_jobs),
+        active_jobs=sum(jobs.get('ongoing', 0) for jobs, _ in results),
+        groups=machine_registry.groups(),
+        filters=filters
     )
 
 
+@app.route('/api/utilization')
+@login_required
+@manager_required
+def utilization_report():
+    """Busy/alert/maintenance/idle seconds and OEE per lathe over ?start=&end= (ISO, UTC)"""
+    try:
+        end = parse_utc(request.args.get('end')) or datetime.utcnow()
+        start = parse_utc(request.args.get('start')) or end - timedelta(hours=24)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    bucket = request.args.get('bucket') or None
+    if bucket and bucket not in UTILIZATION_BUCKETS:
+        return jsonify({'error': f"bucket must be one of {', '.join(UTILIZATION_BUCKETS)}"}), 400
+    if end <= start:
+        return jsonify({'error': 'end must be after start'}), 400
+
+    if request.args.get('machines'):
+        machine_ids = request.args['machines'].split(',')
+    else:
+        machine_ids = [m.id for m in machine_registry.machines(request.args.get('plant') or None,
+                                                                request.args.get('line') or None)]
+    started = time.perf_counter()
+    try:
+        report = utilization.query(machine_ids, start, end, bucket)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(dict(report, start=start.isoformat(), end=end.isoformat(), bucket=bucket,
+                        queryMs=round((time.perf_counter() - started) * 1000, 2)))
+
+@app.route('/api/export/sensor')
+@login_required
+@manager_required
+def export_sensor():
+    """Stream readings of ?machines= between ?from= and ?to= as NDJSON or CSV, merged by timestamp"""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        start = parse_utc(request.args.get('from'))
+        end = parse_utc(request.args.get('to'))
+        resume = request.args.get('resume') or None
+        if resume:
+            export.parse_resume_token(resume)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+    if request.args.get('machines'):
+        machines = [get_machine(machine_id) for machine_id in request.args['machines'].split(',')]
+    else:
+        machines = machine_registry.machines(request.args.get('plant') or None, request.args.get('line') or None)
+    if not export.slots.acquire(blocking=False):
+        return jsonify({'error': 'Too many exports running, try again shortly'}), 429
+
+    compress = request.args.get('gzip') == '1'
+
+    def generate():
+        readings = export.merged_readings(get_db(), machines, start, end, resume)
+        # A resumed CSV continues a file that already has its header row
+        chunks = export.encode(readings, fmt, limit, resume=resume, header=not resume)
+        if compress:
+            yield from export.gzipped(chunks)
+        else:
+            for chunk in chunks:
+                yield chunk.encode()
+
+    filename = f"sensor-export.{fmt}{'.gz' if compress else ''}"
+    mimetype = 'application/gzip' if compress else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response = Response(generate(), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    # Runs when the stream ends or the client goes away, even before the first chunk
+    response.call_on_close(export.slots.release)
+    return response
+
+@app.route('/api/timeline')
+@login_required
+def event_timeline():
+    """Job starts, job ends and alerts across the fleet, one page at a time in time order"""
+    types = request.args.get('types')
+    types = types.split(',') if types else TIMELINE_TYPES
+    unknown = [t for t in types if t not in TIMELINE_TYPES]
+    if unknown:
+        return jsonify({'error': f"types must be among {', '.join(TIMELINE_TYPES)}"}), 400
+    order = request.args.get('order', 'desc')
+    if order not in TIMELINE_ORDERS:
+        return jsonify({'error': f"order must be one of {', '.join(TIMELINE_ORDERS)}"}), 400
+    limit = request.args.get('limit', TIMELINE_PAGE_SIZE, type=int)
+    if not 1 <= limit <= TIMELINE_MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {TIMELINE_MAX_PAGE_SIZE}'}), 400
+    try:
+        start = parse_utc(request.args.get('from'))
+        end = parse_utc(request.args.get('to'))
+        timeline_cursor = request.args.get('cursor') or None
+        if timeline_cursor:
+            decode_timeline_cursor(timeline_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if request.args.get('machines'):
+        machines = [get_machine(machine_id) for machine_id in request.args['machines'].split(',')]
+    else:
+        machines = machine_registry.machines(request.args.get('plant') or None, request.args.get('line') or None)
+
+    started = time.perf_counter()
+    events, next_cursor = timeline.page(get_db(), machines, set(types), start, end, order, limit, timeline_cursor)
+    for event in events:
+        for field, value in event.items():
+            if isinstance(value, datetime):
+                event[field] = value.isoformat()
+    return jsonify({
+        'events': events,
+        'next': next_cursor,
+        'order': order,
+        'queryMs': round((time.perf_counter() - started) * 1000, 2)
+    })
 
 # ------------------ Lathe Dashboard ------------------
 
@@ -253,40 +434,23 @@ def analytics_dashboard():
 def dashboard():
      # Clean up stalled jobs automatically
     cleanup_stalled_jobs()
-    db = get_db()
-    active_machines = []
-    lathe_statuses = []
-    now = datetime.utcnow()
-
-    for machine_num in range(1, 21):
-        machine_id = f"LATHE-{machine_num:02d}"
-        job_coll = db['Jobs'][f'lathe{machine_num}_job_detail']
-        is_on = bool(job_coll.find_one({"status": "ongoing"}))
-
-        # Dummy in-memory maintenance check
-        maintenance = lathe_maintenance.get(machine_id)
-        under_maintenance = False
-        if maintenance and maintenance['start'] <= now <= maintenance['end']:
-            under_maintenance = True
-        elif maintenance and now > maintenance['end']:
-            del lathe_maintenance[machine_id]  # Clean expired
-
-        lathe_statuses.append({
-            'id': machine_id,
-            'is_on': is_on,
-            'under_maintenance': under_maintenance
-        })
+    filters = fleet_filters()
+    page_machines, machines = machine_registry.page(**filters)
 
-    total_lathes = 20
-    on_count = sum(1 for lathe in lathe_statuses if lathe['is_on'])
-    off_count = total_lathes - on_count
+    # Summary covers every machine matching the filter; the grid shows one page
+    statuses = fleet_statuses(machines, datetime.utcnow())
+    summary = fleet_summary(statuses)
+    page_ids = {m.id for m in page_machines}
 
     return render_template(
         'dashboard.html',
-        lathe_statuses=lathe_statuses,
-        total_lathes=total_lathes,
-        on_count=on_count,
-        off_count=off_count
+        lathe_statuses=[lathe for lathe in statuses if lathe['id'] in page_ids],
+        total_lathes=summary['total'],
+        on_count=summary['on'],
+        off_count=summary['off'],
+        groups=machine_registry.groups(),
+        filters=filters,
+        page_count=max(1, -(-len(machines) // filters['per_page']))
     )
 
 
@@ -295,19 +459,14 @@ def dashboard():
 @app.route('/lathe/<machine_id>', methods=['GET', 'POST'])
 @login_required
 def lathe_detail(machine_id):
-    collections = get_collections(machine_id)
+    machine = get_machine(machine_id)
+    store = get_db()
     alert_form = AlertForm()
 
-    now = datetime.utcnow()
-    maintenance = lathe_maintenance.get(machine_id)
-    under_maintenance = False
-    if maintenance and maintenance['start'] <= now <= maintenance['end']:
-        under_maintenance = True
-    elif maintenance and now > maintenance['end']:
-        del lathe_maintenance[machine_id]
+    under_maintenance = maintenance_schedule.is_under_maintenance(machine_id)
 
     if alert_form.validate_on_submit():
-        collections['alerts'].insert_one({
+        store.alerts.insert(machine, {
             "machineId": machine_id,
             "timestamp": datetime.utcnow(),
             "message": alert_form.message.data,
@@ -316,15 +475,21 @@ def lathe_detail(machine_id):
         flash('Alert created successfully!', 'success')
         return redirect(url_for('lathe_detail', machine_id=machine_id))
 
-    current_job = collections['jobs'].find_one({"status": "ongoing"})
-    sensor_data = collections['sensor'].find_one(sort=[("timestamp", -1)])
+    current_job = store.jobs.current(machine)
+    sensor_data = store.readings.latest(machine)
+
+    # ?replay=<session id> plays a replay session through the live panel
+    replay_session = replay.sessions.get(request.args.get('replay', ''))
+    if replay_session is not None and (replay_session.machine.id != machine_id or not owns_replay(replay_session)):
+        replay_session = None
 
     return render_template('lathe_detail.html',
         machine_id=machine_id,
         current_job=current_job,
         sensor_data=sensor_data,
         alert_form=alert_form,
-        under_maintenance=under_maintenance
+        under_maintenance=under_maintenance,
+        replay=replay_session.state() if replay_session else None
     )
 
 
@@ -332,40 +497,37 @@ def lathe_detail(machine_id):
 @login_required
 @operator_required
 def start_simulator(machine_id):
-    collections = get_collections(machine_id)
+    machine = get_machine(machine_id)
     form = JobForm()
 
     if form.validate_on_submit():
-        job_id = str(uuid.uuid4())
-        print(f"🎯 Creating job {job_id} for {machine_id}")  # Debug
-        
-        job_data = {
-            "_id": job_id,
-            "machineId": machine_id,
-            "operatorId": form.operator_name.data,
-            "jobId": job_id,
-            "jobType": form.job_type.data,
-            "jobDescription": form.job_description.data,
-            "startTime": datetime.utcnow(),
-            "status": "ongoing",
-            "estimatedTime": form.estimated_time.data,
-            "actualDuration": 0
-        }
-
-        collections['jobs'].insert_one(job_data)
-        print(f"✅ Job inserted into database")  # Debug
-        
-        start_simulation(
-            machine_id=machine_id,
-            job_id=job_id,
-            duration=form.estimated_time.data,
-            material=form.material.data,
-            job_type=form.job_type.data,
-            tool_no=form.tool_no.data
-        )
-        print(f"🚀 Simulation thread started")  # Debug
-        
-        flash('Simulation started successfully!', 'success')
+        try:
+            job = new_job({
+                "jobType": form.job_type.data,
+                "jobDescription": form.job_description.data,
+                "material": form.material.data,
+                "toolNo": form.tool_no.data,
+                "estimatedTime": form.estimated_time.data,
+                "operatorId": form.operator_name.data,
+                "machineId": machine_id
+            }, submitted_by=current_user.userID)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return render_template('simulator_form.html', form=form, machine_id=machine_id)
+
+        # A busy or under-maintenance lathe gets the job queued, pinned to it
+        try:
+            started = job_queue.start_now(machine, job)
+        except Exception as e:
+            print(f"❌ Failed to start job {job['_id']} on {machine_id}: {e}")
+            flash(f'Could not start the simulation: {e}', 'danger')
+            return render_template('simulator_form.html', form=form, machine_id=machine_id)
+        if started:
+            print(f"🚀 Job {job['_id']} started on {machine_id}")
+            flash('Simulation started successfully!', 'success')
+        else:
+            job_queue.submit([job])
+            flash(f'Lathe {machine_id} is busy; the job was queued and will start when it is free.', 'info')
         return redirect(url_for('dashboard'))
 
     return render_template('simulator_form.html', form=form, machine_id=machine_id)
@@ -374,25 +536,23 @@ def start_simulator(machine_id):
 @app.route('/lathe/<machine_id>/jobs')
 @login_required
 def job_history(machine_id):
-    collections = get_collections(machine_id)
-    jobs = list(collections['jobs'].find(sort=[("startTime", -1)]))
+    jobs = get_db().jobs.history(get_machine(machine_id))
     return render_template('jobs.html', jobs=jobs, machine_id=machine_id)
 
 @app.route('/lathe/<machine_id>/alerts', methods=['GET'])
 @login_required
 def alert_history(machine_id):
-    collections = get_collections(machine_id)
-    alerts = list(collections['alerts'].find(sort=[("timestamp", -1)]))
+    alerts = get_db().alerts.history(get_machine(machine_id))
     return render_template('alerts.html', alerts=alerts, machine_id=machine_id)
 
 @app.route('/lathe/<machine_id>/alerts', methods=['POST'])
 @login_required
 def handle_alert(machine_id):
-    collections = get_collections(machine_id)
+    machine = get_machine(machine_id)
     alert_form = AlertForm()
 
     if alert_form.validate_on_submit():
-        collections['alerts'].insert_one({
+        get_db().alerts.insert(machine, {
             "machineId": machine_id,
             "timestamp": datetime.utcnow(),
             "alertType": "General",
@@ -420,35 +580,136 @@ def add_alert(machine_id):
 @login_required
 @manager_required
 def schedule_maintenance(machine_id):
-    # Schedule maintenance for 10 minutes
-    lathe_maintenance[machine_id] = {
-        "start": datetime.utcnow(),
-        "end": datetime.utcnow() + timedelta(minutes=10)
-    }
+    # Defaults to a 10 minute window starting now; ?start=<ISO>&minutes=<n>
+    # books a future one.
+    get_machine(machine_id)
+    try:
+        start = None
+        if request.args.get('start'):
+            start = datetime.fromisoformat(request.args['start'])
+            if start.tzinfo:
+                start = start.astimezone(timezone.utc).replace(tzinfo=None)
+        minutes = float(request.args.get('minutes', 10))
+        maintenance_schedule.book(machine_id, start=start, minutes=minutes,
+                                  reason=request.args.get('reason'), created_by=current_user.userID)
+    except ValueError as e:
+        flash(f"Could not schedule maintenance: {e}", "danger")
+        return redirect(url_for('lathe_detail', machine_id=machine_id))
     flash(f"{machine_id} scheduled for maintenance.", "info")
     return redirect(url_for('lathe_detail', machine_id=machine_id))
 
+@app.route('/lathe/<machine_id>/maintenance/windows')
+@login_required
+def maintenance_windows(machine_id):
+    get_machine(machine_id)
+    windows = maintenance_schedule.windows(machine_id, include_past=request.args.get('past') == '1')
+    return jsonify([{
+        'id': str(w['_id']),
+        'machineId': w['machineId'],
+        'start': w['start'].isoformat(),
+        'end': w['end'].isoformat(),
+        'reason': w.get('reason'),
+        'createdBy': w.get('createdBy')
+    } for w in windows])
+
+@app.route('/maintenance/<window_id>/cancel', methods=['POST'])
+@login_required
+@manager_required
+def cancel_maintenance(window_id):
+    try:
+        cancelled = maintenance_schedule.cancel(window_id)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+    return jsonify({'success': cancelled})
+
+# ------------------ Job Queue ------------------
+
+@app.route('/api/queue/jobs', methods=['POST'])
+@login_required
+@operator_required
+def submit_queued_jobs():
+    """Queue one job (a JSON object) or a shift's worth ({"jobs": [...]}) in one call"""
+    body = request.get_json(silent=True)
+    specs = body.get('jobs') if isinstance(body, dict) and 'jobs' in body else [body]
+    if not isinstance(specs, list) or not specs or not all(isinstance(s, dict) for s in specs):
+        return jsonify({'error': 'Expected a job object or {"jobs": [...]}'}), 400
+    if len(specs) > MAX_BULK_JOBS:
+        return jsonify({'error': f'At most {MAX_BULK_JOBS} jobs per request'}), 400
+
+    now = datetime.utcnow()
+    jobs, errors = [], []
+    for i, spec in enumerate(specs):
+        try:
+            jobs.append(new_job(spec, submitted_by=current_user.userID, now=now))
+        except ValueError as e:
+            errors.append({'index': i, 'error': str(e)})
+    if errors:
+        # All or nothing, so a rejected bulk load can be fixed and resent as is
+        return jsonify({'error': 'Invalid jobs', 'errors': errors}), 400
+    return jsonify({'queued': job_queue.submit(jobs)}), 201
+
+@app.route('/api/queue')
+@login_required
+def queued_jobs():
+    """Queued jobs in dispatch order (or ?status=dispatched|cancelled, newest first)"""
+    status = request.args.get('status', 'queued')
+    if status == 'queued':
+        jobs = job_queue.queued()
+    else:
+        jobs = get_db().queue.find([status], limit=request.args.get('limit', 100, type=int))
+    return jsonify({
+        'status': status,
+        'jobs': [{k: v.isoformat() if isinstance(v, datetime) else v for k, v in j.items()} for j in jobs],
+        'freeMachines': job_queue.free.ids(),
+        'dispatcherRunning': job_queue.running
+    })
+
+@app.route('/api/queue/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+@operator_required
+def cancel_queued_job(job_id):
+    # Operators cancel only the jobs they submitted
+    job = get_db().queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.get('submittedBy') != current_user.userID:
+        return jsonify({'error': 'Only the operator who queued the job can cancel it'}), 403
+    return jsonify({'success': job_queue.cancel(job_id)})
+
 @app.route('/lathe/<machine_id>/status')
 @login_required
 def current_status(machine_id):
-    collections = get_collections(machine_id)
-    current_job = collections['jobs'].find_one({"status": "ongoing"})
-    sensor_data = collections['sensor'].find_one(sort=[("timestamp", -1)])
+    machine = get_machine(machine_id)
+    current_job = get_db().jobs.current(machine)
+    sensor_data = get_db().readings.latest(machine)
     return render_template('status.html',
         current_job=current_job,
         sensor_data=sensor_data,
         machine_id=machine_id
     )
 
+@app.route('/simulation/farm')
+@login_required
+@manager_required
+def simulation_farm_status():
+    from app.farm import FARM_ADDRESS, farm_request
+    if not FARM_ADDRESS:
+        return jsonify({'enabled': False})
+    try:
+        return jsonify(dict(farm_request({'command': 'status'}), enabled=True))
+    except OSError as e:
+        return jsonify({'enabled': True, 'ok': False, 'error': str(e)})
+
 @app.route('/simulation/status/<machine_id>')
 @login_required
 def simulation_status(machine_id):
-    collections = get_collections(machine_id)
+    machine = get_machine(machine_id)
+    store = get_db()
 
     def generate():
         while True:
-            last_data = collections['sensor'].find_one(sort=[("timestamp", -1)])
-            current_job = collections['jobs'].find_one({"status": "ongoing"})
+            last_data = store.readings.latest(machine)
+            current_job = store.jobs.current(machine)
 
             data = {"status": "completed"}
             if last_data and current_job:
@@ -468,19 +729,75 @@ def simulation_status(machine_id):
 
     return Response(generate(), mimetype="text/event-stream")
 
+#------------------ Recent readings (in-memory) ------------------
+@app.route('/api/lathe/<machine_id>/recent')
+@login_required
+def recent_readings(machine_id):
+    """Newest n readings from the machine's ring buffer"""
+    buffer = recent.get_buffer(get_machine(machine_id))
+    n = max(1, min(request.args.get('n', 60, type=int), buffer.capacity))
+    timestamps, values = buffer.latest(n)
+    return jsonify({
+        'machineId': machine_id,
+        'count': int(len(timestamps)),
+        'timestamps': [datetime.utcfromtimestamp(t).isoformat() for t in timestamps],
+        'fields': {field: values[:, i].astype(float).round(4).tolist() for i, field in enumerate(recent.RECENT_FIELDS)}
+    })
+
+@app.route('/api/lathe/<machine_id>/recent/stats')
+@login_required
+def recent_stats(machine_id):
+    """Mean/min/max/std/last per field over the last `seconds` of readings"""
+    buffer = recent.get_buffer(get_machine(machine_id))
+    seconds = max(1, request.args.get('seconds', 300, type=float))
+    return jsonify(dict(buffer.stats(seconds), machineId=machine_id, seconds=seconds))
+
+#------------------ Similar jobs ------------------
+@app.route('/api/lathe/<machine_id>/job/<job_id>/similar')
+@login_required
+def similar_jobs(machine_id, job_id):
+    """Top-k past jobs whose sensor signature is closest to this one's, and how they ended"""
+    machine = get_machine(machine_id)
+    job = get_db().jobs.get(machine, job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job {job_id}"}), 404
+    metric = request.args.get('metric', 'cosine')
+    if metric not in SIMILARITY_METRICS:
+        return jsonify({'error': f"metric must be one of {', '.join(SIMILARITY_METRICS)}"}), 400
+    k = max(1, min(request.args.get('k', 5, type=int), 50))
+    started = time.perf_counter()
+    result = similarity.similar(machine, job, k, metric,
+                                same_machine=request.args.get('scope') == 'machine')
+    if result is None:
+        return jsonify({'error': 'Not enough readings for this job yet'}), 409
+    outcomes = {}
+    for match in result['similar']:
+        outcomes[match['status']] = outcomes.get(match['status'], 0) + 1
+        for field in ('startTime', 'endTime'):
+            if match[field] is not None:
+                match[field] = match[field].isoformat()
+    return jsonify(dict(result, machineId=machine_id, jobId=job_id, metric=metric, outcomes=outcomes,
+                        queryMs=round((time.perf_counter() - started) * 1000, 2)))
+
+@app.route('/debug/recent-buffers')
+@login_required
+def debug_recent_buffers():
+    return jsonify(recent.memory_report())
+
 #------------------Live streaming of sensor data------------------
 @app.route('/stream/sensor-data/<machine_id>')
 @login_required
 def sensor_data_stream(machine_id):
     """Stream real-time sensor data for a specific machine"""
-    collections = get_collections(machine_id)
+    machine = get_machine(machine_id)
+    store = get_db()
     
     def generate():
         while True:
             try:
                 # Get latest sensor data
-                latest_sensor = collections['sensor'].find_one(sort=[("timestamp", -1)])
-                current_job = collections['jobs'].find_one({"status": "ongoing"})
+                latest_sensor = store.readings.latest(machine)
+                current_job = store.jobs.current(machine)
                 
                 if latest_sensor and current_job:
                     data = {
@@ -507,39 +824,134 @@ def sensor_data_stream(machine_id):
     return Response(generate(), mimetype="text/event-stream", 
                    headers={'Cache-Control': 'no-cache'})
 
+# ------------------ Historical replay ------------------
+
+def get_replay(session_id):
+    """The session, or 404 when it doesn't exist or belongs to another user"""
+    session = replay.sessions.get(session_id)
+    if session is None or not owns_replay(session):
+        abort(404)
+    return session
+
+def owns_replay(session):
+    # Twin clients stream with a token and no user; they may watch any session
+    if not current_user.is_authenticated:
+        return True
+    return session.owner == current_user.userID
+
+@app.route('/api/replay', methods=['POST'])
+@login_required
+def create_replay():
+    """Start replaying {"machineId", "from", "to", "speed"}; the session to control and stream"""
+    body = request.get_json(silent=True) or request.form
+    machine = get_machine(body.get('machineId', ''))
+    try:
+        start = parse_utc(body.get('from'))
+        end = parse_utc(body.get('to'))
+        speed = float(body.get('speed') or 1)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if start is None:
+        return jsonify({'error': 'from is required'}), 400
+    if end is not None and end <= start:
+        return jsonify({'error': 'to must be after from'}), 400
+    session = replay.sessions.create(get_db(), machine, start, end, speed, owner=current_user.userID)
+    if session is None:
+        return jsonify({'error': 'Too many replays open, try again shortly'}), 429
+    return jsonify(dict(session.state(),
+                        stream=url_for('replay_stream', session_id=session.id),
+                        view=url_for('lathe_detail', machine_id=machine.id, replay=session.id))), 201
+
+@app.route('/api/replay/<session_id>')
+@login_required
+def replay_state(session_id):
+    return jsonify(get_replay(session_id).state())
+
+@app.route('/api/replay/<session_id>/control', methods=['POST'])
+@login_required
+def control_replay(session_id):
+    """{"action": "play" | "pause" | "seek" (with "at") | "speed" (with "speed")}"""
+    session = get_replay(session_id)
+    body = request.get_json(silent=True) or request.form
+    action = body.get('action')
+    try:
+        if action == 'play':
+            session.play()
+        elif action == 'pause':
+            session.pause()
+        elif action == 'seek':
+            at = parse_utc(body.get('at'))
+            if at is None:
+                return jsonify({'error': 'seek needs at'}), 400
+            session.seek(at)
+        elif action == 'speed':
+            session.set_speed(float(body.get('speed')))
+        else:
+            return jsonify({'error': 'action must be play, pause, seek or speed'}), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(session.state())
+
+@app.route('/api/replay/<session_id>', methods=['DELETE'])
+@login_required
+def close_replay(session_id):
+    if not replay.sessions.close(get_replay(session_id).id):
+        abort(404)
+    return jsonify({'success': True})
+
+@app.route('/stream/replay/<session_id>')
+def replay_stream(session_id):
+    """The replay as sensor_data_stream events, or as twin frames with ?format=twin"""
+    twin = request.args.get('format') == 'twin'
+    if not (current_user.is_authenticated or (twin and twin_authorized())):
+        abort(401)
+    session = get_replay(session_id)
+
+    def generate_events():
+        seq, ended = 0, False
+        while replay.sessions.get(session_id) is session:
+            played, state = session.readings_after(seq, 15)
+            for seq, reading in played:
+                yield f"data: {json.dumps(replay.sse_data(reading, state))}\n\n"
+            if state['ended'] and not ended:
+                yield f"data: {json.dumps({'status': 'ended', 'replay': state})}\n\n"
+            elif not played:
+                yield ": keepalive\n\n"
+            ended = state['ended']
+
+    def generate_frames():
+        seq, frame = 0, None
+        while replay.sessions.get(session_id) is session:
+            played, _ = session.readings_after(seq, twin_feed.TWIN_MAX_WAIT)
+            if played:
+                # Twins want the latest state, not every reading they missed
+                seq, reading = played[-1]
+                frame = replay.twin_frame(session.machine.id, reading, seq)
+            if frame is not None:
+                yield frame
+
+    if twin:
+        return Response(generate_frames(), mimetype='application/octet-stream', headers={'Cache-Control': 'no-cache'})
+    return Response(generate_events(), mimetype="text/event-stream", headers={'Cache-Control': 'no-cache'})
+
 @app.route('/stream/dashboard-status')
 @login_required
 def dashboard_status_stream():
     """Stream real-time status for all lathes on dashboard"""
+    filters = fleet_filters()
+
     def generate():
-        db = get_db()
-        
         while True:
             try:
-                lathe_statuses = []
                 now = datetime.utcnow()
-                
-                for machine_num in range(1, 21):
-                    machine_id = f"LATHE-{machine_num:02d}"
-                    job_coll = db['Jobs'][f'lathe{machine_num}_job_detail']
-                    is_on = bool(job_coll.find_one({"status": "ongoing"}))
-                    
-                    # Check maintenance status
-                    maintenance = lathe_maintenance.get(machine_id)
-                    under_maintenance = False
-                    if maintenance and maintenance['start'] <= now <= maintenance['end']:
-                        under_maintenance = True
-                    elif maintenance and now > maintenance['end']:
-                        del lathe_maintenance[machine_id]
-                    
-                    lathe_statuses.append({
-                        'id': machine_id,
-                        'is_on': is_on,
-                        'under_maintenance': under_maintenance
-                    })
+                # Re-read the registry each tick so added machines show up
+                page_machines, machines = machine_registry.page(**filters)
+                statuses = fleet_statuses(machines, now)
+                page_ids = {m.id for m in page_machines}
                 
                 data = {
-                    "lathe_statuses": lathe_statuses,
+                    "lathe_statuses": [lathe for lathe in statuses if lathe['id'] in page_ids],
+                    "summary": fleet_summary(statuses),
                     "timestamp": now.isoformat()
                 }
                 
@@ -558,37 +970,34 @@ def dashboard_status_stream():
 @login_required
 def cleanup_stalled_jobs():
     """Clean up jobs that should have completed but status is still 'ongoing'"""
-    db = get_db()
     current_time = datetime.utcnow()
-    
-    for machine_num in range(1, 21):
-        job_coll = db['Jobs'][f'lathe{machine_num}_job_detail']
+
+    def cleanup_machine(machine):
+        store = get_db()
         
         # Find jobs that are ongoing but should have completed
-        stalled_jobs = job_coll.find({
-            "status": "ongoing",
-            "$expr": {
-                "$lt": [
-                    {"$add": ["$startTime", {"$multiply": ["$estimatedTime", 60000]}]}, # estimatedTime in ms
-                    current_time
-                ]
-            }
-        })
+        stalled_jobs = store.jobs.stalled(machine, current_time)
         
         for job in stalled_jobs:
             # Calculate actual duration
             actual_duration = (current_time - job['startTime']).total_seconds() / 60
             
-            # Update job to completed
-            job_coll.update_one(
-                {"_id": job["_id"]},
-                {"$set": {
-                    "status": "completed",
-                    "endTime": current_time,
-                    "actualDuration": round(actual_duration, 2)
-                }}
-            )
+            # Update job to completed; its simulation is gone, so the summary
+            # is rebuilt from the readings it left behind
+            store.jobs.update(machine, job["_id"], {
+                "status": "completed",
+                "endTime": current_time,
+                "actualDuration": round(actual_duration, 2),
+                "summary": summarize(job_readings(store, machine, job))
+            })
             print(f"Cleaned up stalled job: {job['_id']} on {job['machineId']}")
+            publish('job_finished', {
+                "machineId": machine.id, "jobId": job["_id"], "status": "completed",
+                "startTime": job["startTime"], "endTime": current_time,
+                "estimatedTime": job.get("estimatedTime"), "actualDuration": round(actual_duration, 2)
+            })
+
+    fleet_map(cleanup_machine, machine_registry.machines())
     
     return "Stalled jobs cleaned up", 200
 
@@ -598,12 +1007,12 @@ def cleanup_stalled_jobs():
 def trigger_alert(machine_id):
     """Trigger alert and stop simulation for the machine"""
     try:
-        collections = get_collections(machine_id)
+        machine = get_machine(machine_id)
         alert_form = AlertForm()
         
         if alert_form.validate_on_submit():
             # Find current ongoing job
-            current_job = collections['jobs'].find_one({"status": "ongoing"})
+            current_job = get_db().jobs.current(machine)
             
             if current_job:
                 job_id = current_job['_id']
@@ -626,7 +1035,7 @@ def trigger_alert(machine_id):
                         "requiresMaintenance": True,
                         "failureProbability": ">80%"
                     }
-                    collections['alerts'].insert_one(alert_record)
+                    get_db().alerts.insert(machine, alert_record)
                     
                     flash_message = f'🚨 CRITICAL ALERT: {machine_id} simulation stopped! Failure probability >80%. Immediate maintenance required!'
                     flash(flash_message, 'critical')
@@ -668,18 +1077,13 @@ def trigger_alert(machine_id):
 def get_alert_status(machine_id):
     """Get current alert status for a machine"""
     try:
-        collections = get_collections(machine_id)
+        machine = get_machine(machine_id)
         
         # Check for active critical alerts
-        critical_alert = collections['alerts'].find_one({
-            "machineId": machine_id,
-            "severity": 5,
-            "status": "active",
-            "requiresMaintenance": True
-        }, sort=[("timestamp", -1)])
+        critical_alert = get_db().alerts.latest_critical(machine)
         
         # Check job status
-        current_job = collections['jobs'].find_one({"status": {"$in": ["ongoing", "alert_triggered"]}})
+        current_job = get_db().jobs.current(machine, ("ongoing", "alert_triggered"))
         
         return jsonify({
             'hasCriticalAlert': bool(critical_alert),
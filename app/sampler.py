@@ -0,0 +1,158 @@
+from collections import Counter
+from threading import Lock
+import gc
+import os
+import sys
+import threading
+import time
+
+# On-demand sampling profiler (GET /debug/profile, managers only). A sampler
+# thread wakes SAMPLER_HZ times a second, grabs every thread's stack with
+# sys._current_frames() (plus every parked greenlet's when gevent is active)
+# and counts collapsed stacks per thread role. Nothing is traced between
+# samples, so it is safe to run against production traffic. Output is the
+# "role;frame;frame;... count" format flamegraph.pl and speedscope read.
+SAMPLER_HZ = float(os.getenv('SAMPLER_HZ', '100'))
+MAX_SECONDS = 60
+MAX_HZ = 1000
+GREENLET_REFRESH = 1.0  # seconds between gc scans for new greenlets
+
+# Leaf frames that mean the thread is parked, not burning CPU
+IDLE_LEAVES = {
+    'threading.py:wait', 'threading.py:_wait_for_tstate_lock', 'queue.py:get',
+    'selectors.py:select', 'socket.py:accept', 'socketserver.py:serve_forever',
+    'hub.py:switch', 'hub.py:wait', 'hub.py:run', 'hub.py:sleep', 'connection.py:_recv', 'thread.py:_worker',
+    'clock.py:sleep', 'registry.py:_poll', 'maintenance.py:_poll', 'utilization.py:_poll',
+    'similarity.py:_poll', 'twin_feed.py:_poll'
+}
+
+_session_lock = Lock()
+
+def _original(module, name, default):
+    """The unpatched stdlib function when gevent has monkey-patched it"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return default
+    return monkey.get_original(module, name) if monkey.is_module_patched(module) else default
+
+def frame_label(frame):
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+def collapse(frame):
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+def thread_role(name, labels):
+    if name.startswith('sim-'):
+        return 'simulation'
+    if 'routes.py:generate' in labels:
+        return 'stream'
+    if name.startswith('fleet-query'):
+        return 'fleet-query'
+    if any(l.endswith(':full_dispatch_request') or l.endswith(':wsgi_app') for l in labels):
+        return 'request'
+    if name.startswith(('registry-poller', 'maintenance-poller', 'batched-writer', 'farm-events', 'job-dispatcher',
+                        'utilization-poller', 'similarity-', 'twin-poller', 'replay-fetch', 'wal-')):
+        return 'background'
+    return 'other'
+
+class StackSampler:
+    def __init__(self, hz=SAMPLER_HZ, include_idle=False):
+        self.interval = 1.0 / max(1.0, min(hz, MAX_HZ))
+        self.include_idle = include_idle
+        self.stacks = Counter()
+        self.roles = Counter()
+        self.samples = 0
+        self.busy_seconds = 0.0
+        self._greenlets = []
+        self._greenlets_at = 0.0
+        self._sleep = _original('time', 'sleep', time.sleep)
+
+    def _greenlet_frames(self, now):
+        try:
+            import greenlet
+        except ImportError:
+            return []
+        if now - self._greenlets_at >= GREENLET_REFRESH:
+            self._greenlets = [o for o in gc.get_objects() if isinstance(o, greenlet.greenlet)]
+            self._greenlets_at = now
+        # A running greenlet has no gr_frame; its OS thread shows it instead
+        return [(id(g), g.gr_frame) for g in self._greenlets if not g.dead and g.gr_frame is not None]
+
+    def _record(self, names, ident, frame):
+        labels = collapse(frame)
+        if not labels or (not self.include_idle and labels[-1] in IDLE_LEAVES):
+            return
+        name = names.get(ident, '')
+        role = thread_role(name, labels)
+        self.stacks[';'.join([role] + labels)] += 1
+        self.roles[role] += 1
+
+    def sample_once(self, own_ident):
+        started = time.perf_counter()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != own_ident:
+                self._record(names, ident, frame)
+        for ident, frame in self._greenlet_frames(started):
+            self._record(names, ident, frame)
+        self.samples += 1
+        self.busy_seconds += time.perf_counter() - started
+
+    def run(self, seconds):
+        """Sample for `seconds` on the calling thread"""
+        own_ident = _original('_thread', 'get_ident', threading.get_ident)()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            self.sample_once(own_ident)
+            self._sleep(self.interval)
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {n}" for stack, n in self.stacks.most_common()) + '\n'
+
+    def summary(self):
+        return {
+            'samples': self.samples,
+            'intervalMs': round(self.interval * 1000, 3),
+            'samplerBusyMs': round(self.busy_seconds * 1000, 1),
+            'roles': dict(self.roles.most_common()),
+            'stacks': [{'stack': stack, 'count': n} for stack, n in self.stacks.most_common()]
+        }
+
+def profile(seconds, hz=SAMPLER_HZ, include_idle=False):
+    """Run one sampling session on a real OS thread; None if one is already running.
+
+    Under gevent the sampler must not be a greenlet: a CPU-bound greenlet never
+    yields, which is exactly when samples are needed. The caller waits with the
+    (possibly patched) time.sleep so it doesn't block the hub.
+    """
+    if not _session_lock.acquire(blocking=False):
+        return None
+    try:
+        sampler = StackSampler(hz, include_idle)
+        seconds = max(0.1, min(seconds, MAX_SECONDS))
+        done = []
+
+        def run():
+            try:
+                sampler.run(seconds)
+            finally:
+                done.append(True)
+
+        start_thread = _original('_thread', 'start_new_thread', None)
+        if start_thread is None:
+            worker = threading.Thread(target=run, daemon=True, name="stack-sampler")
+            worker.start()
+            worker.join()
+        else:
+            start_thread(run, ())
+            while not done:
+                time.sleep(0.05)
+        return sampler
+    finally:
+        _session_lock.release()
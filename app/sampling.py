@@ -0,0 +1,111 @@
+import os
+
+# How often the simulator takes a reading (SAMPLING_MODE):
+#
+# fixed     every SENSOR_INTERVAL seconds (the original behaviour)
+# adaptive  back off (x2 per reading, up to SAMPLING_MAX_INTERVAL) while every
+#           sensor stays within its deadband of the reading that last broke
+#           out of it; return to SENSOR_INTERVAL when one leaves it; drop to
+#           SAMPLING_MIN_INTERVAL while failureProbability is at or over
+#           SAMPLING_RISK_THRESHOLD or a sensor jumps more than
+#           SAMPLING_RATE_FACTOR deadbands in one SENSOR_INTERVAL.
+#
+# Either way every reading carries "interval": the seconds since the job's
+# previous reading, i.e. the stretch of time it stands for. Time-weighted
+# aggregates (app/job_summary.py) weight by it.
+SENSOR_INTERVAL = float(os.getenv('SENSOR_INTERVAL', '5'))
+SAMPLING_MODE = os.getenv('SAMPLING_MODE', 'fixed')
+MIN_INTERVAL = float(os.getenv('SAMPLING_MIN_INTERVAL', '1'))
+MAX_INTERVAL = float(os.getenv('SAMPLING_MAX_INTERVAL', '60'))
+RISK_THRESHOLD = float(os.getenv('SAMPLING_RISK_THRESHOLD', '0.5'))
+RATE_FACTOR = float(os.getenv('SAMPLING_RATE_FACTOR', '3'))
+BACKOFF = 2.0
+MODES = ('fixed', 'adaptive')
+
+# Half-widths a little over the simulator's reading-to-reading noise; "%" is
+# relative to the reading the deadband is anchored on
+DEFAULT_DEADBANDS = {
+    'airTemperature': '12',      # K
+    'processTemperature': '15%',
+    'rotationalSpeed': '12%',
+    'torque': '35%',
+    'toolWear': '2',             # min
+    'failureProbability': '0.3'
+}
+
+def parse_deadbands(value):
+    """{field: (absolute, relative)} from DEFAULT_DEADBANDS plus "field=width[%],..." overrides"""
+    widths = dict(DEFAULT_DEADBANDS)
+    for item in filter(None, (value or '').split(',')):
+        field, _, width = item.partition('=')
+        if field.strip() not in widths:
+            raise ValueError(f"Unknown sampling deadband field {field!r}")
+        widths[field.strip()] = width.strip()
+    return {f: (0.0, float(w[:-1]) / 100) if w.endswith('%') else (float(w), 0.0) for f, w in widths.items()}
+
+DEADBANDS = parse_deadbands(os.getenv('SAMPLING_DEADBANDS'))
+
+class FixedSampler:
+    """A reading every `interval` seconds"""
+
+    def __init__(self, interval=SENSOR_INTERVAL):
+        self.interval = interval
+        self._last_time = None
+
+    def stamp(self, reading, now):
+        """Set reading['interval'] to the seconds since the previous reading (clock time `now`)"""
+        elapsed = self.interval if self._last_time is None else now - self._last_time
+        reading['interval'] = round(elapsed, 3)
+        self._last_time = now
+
+    def next_interval(self, reading):
+        return self.interval
+
+class AdaptiveSampler(FixedSampler):
+    """Deadband back-off with a fast path for risk and sharp changes"""
+
+    def __init__(self, interval=SENSOR_INTERVAL, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 deadbands=None, risk_threshold=RISK_THRESHOLD, rate_factor=RATE_FACTOR):
+        super().__init__(interval)
+        self.base = interval
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
+        self.deadbands = deadbands or DEADBANDS
+        self.risk_threshold = risk_threshold
+        self.rate_factor = rate_factor
+        self._anchor = None  # values of the reading that last left the deadband
+        self._previous = None
+
+    def width(self, field, anchor):
+        absolute, relative = self.deadbands[field]
+        return absolute or relative * abs(anchor)
+
+    def _sharp(self, values, previous, elapsed):
+        # Change scaled to one base interval; shorter gaps count as a full one,
+        # or sampling faster would make the same noise look like a sharper change
+        scale = self.base / max(elapsed, self.base)
+        return any(abs(v - previous[f]) * scale >= self.rate_factor * self.width(f, previous[f])
+                   for f, v in values.items() if f in previous)
+
+    def next_interval(self, reading):
+        values = {f: reading[f] for f in self.deadbands if reading.get(f) is not None}
+        elapsed = reading.get('interval') or self.interval
+        previous, self._previous = self._previous, values
+
+        if values.get('failureProbability', 0.0) >= self.risk_threshold or (
+                previous is not None and self._sharp(values, previous, elapsed)):
+            self._anchor = values
+            self.interval = self.min_interval
+        elif self._anchor is not None and all(
+                abs(v - self._anchor[f]) <= self.width(f, self._anchor[f]) for f, v in values.items() if f in self._anchor):
+            self.interval = min(self.interval * BACKOFF, self.max_interval)
+        else:
+            self._anchor = values
+            self.interval = self.base
+        return self.interval
+
+def make_sampler(mode=None):
+    mode = mode or SAMPLING_MODE
+    if mode not in MODES:
+        raise ValueError(f"SAMPLING_MODE must be one of {', '.join(MODES)}")
+    return AdaptiveSampler() if mode == 'adaptive' else FixedSampler()
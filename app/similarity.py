@@ -0,0 +1,294 @@
+from queue import Queue
+from threading import Thread, Lock
+from app.storage import get_store
+from app.registry import registry, fleet_map
+from app.readings import FIELDS
+from app.job_summary import job_readings
+from app.events import subscribe
+import os
+import time
+
+# Similar-job search. Every finished job gets a signature: each sensor series
+# resampled onto SIGNATURE_POINTS evenly spaced points over the job's run plus
+# mean/std/min/max/last, concatenated into one vector. The signature is saved
+# on the job document ("signature"), so a worker only has to read it back,
+# and each worker keeps all of them in one float32 matrix with a row of
+# metadata per job.
+#
+# A query standardizes every column (so rpm doesn't drown out tool wear) and
+# ranks rows by cosine similarity or L2 distance in one matrix product. Past
+# SIMILARITY_IVF_MIN_JOBS jobs a coarse k-means index (about sqrt(n) clusters)
+# narrows a query to the SIMILARITY_NPROBE nearest clusters before the exact
+# ranking.
+#
+# Signatures are computed by a background thread as jobs finish
+# (job_finished events); the poller also picks up jobs finished elsewhere
+# (farm workers, other gunicorn workers) every SIMILARITY_REFRESH_INTERVAL.
+# A job with too few readings for a signature is saved with "signature": []
+# so it is never picked up again.
+SIGNATURE_POINTS = int(os.getenv('SIGNATURE_POINTS', '16'))
+SIGNATURE_STATS = ('mean', 'std', 'min', 'max', 'last')
+SIGNATURE_DIM = len(FIELDS) * (SIGNATURE_POINTS + len(SIGNATURE_STATS))
+REFRESH_INTERVAL = float(os.getenv('SIMILARITY_REFRESH_INTERVAL', '300'))
+IVF_MIN_JOBS = int(os.getenv('SIMILARITY_IVF_MIN_JOBS', '20000'))
+NPROBE = int(os.getenv('SIMILARITY_NPROBE', '8'))
+KMEANS_ITERATIONS = 10
+MAX_BACKFILL_PER_REFRESH = 200
+METRICS = ('cosine', 'l2')
+
+def signature(readings):
+    """float32 signature of a job's readings (timestamp order), or None if too short"""
+    import numpy as np  # deferred like app/recent.py
+    readings = [r for r in readings if r.get('timestamp') is not None]
+    if len(readings) < 2:
+        return None
+    t0 = readings[0]['timestamp']
+    t = np.array([(r['timestamp'] - t0).total_seconds() for r in readings], dtype=np.float64)
+    t = t / t[-1] if t[-1] > 0 else np.linspace(0.0, 1.0, len(t))
+    grid = np.linspace(0.0, 1.0, SIGNATURE_POINTS)
+    parts = []
+    for field in FIELDS:
+        values = np.array([r.get(field) if r.get(field) is not None else np.nan for r in readings],
+                          dtype=np.float64)
+        present = ~np.isnan(values)
+        if not present.any():
+            parts.append(np.zeros(SIGNATURE_POINTS + len(SIGNATURE_STATS)))
+            continue
+        x, y = t[present], values[present]
+        parts.append(np.interp(grid, x, y))
+        parts.append([y.mean(), y.std(), y.min(), y.max(), y[-1]])
+    return np.concatenate(parts).astype(np.float32)
+
+def job_meta(machine_id, job):
+    return {
+        'machineId': machine_id,
+        'jobId': job['_id'],
+        'status': job.get('status'),
+        'jobType': job.get('jobType'),
+        'startTime': job.get('startTime'),
+        'endTime': job.get('endTime') or job.get('alertTime'),
+        'peakFailureProbability': (job.get('summary') or {}).get('peakFailureProbability')
+    }
+
+class VectorIndex:
+    """Signatures in a growable float32 matrix, with cached standardized rows and clusters"""
+
+    def __init__(self, dim=SIGNATURE_DIM):
+        import numpy as np
+        self.dim = dim
+        self.matrix = np.zeros((0, dim), dtype=np.float32)
+        self.meta = []
+        self.rows = {}  # (machine id, job id) -> row
+        self._size = 0
+        self._scaled = None  # (column mean, column std, standardized rows, unit rows)
+        self._clusters = None  # (centroids, assignment per row, rows clustered)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, meta, vector):
+        import numpy as np
+        key = (meta['machineId'], meta['jobId'])
+        row = self.rows.get(key)
+        if row is None:
+            if self._size == len(self.matrix):
+                grown = np.zeros((max(64, 2 * len(self.matrix)), self.dim), dtype=np.float32)
+                grown[:self._size] = self.matrix[:self._size]
+                self.matrix = grown
+            row = self.rows[key] = self._size
+            self.meta.append(meta)
+            self._size += 1
+        else:
+            self.meta[row] = meta
+        self.matrix[row] = vector
+        self._scaled = None
+
+    def _standardized(self):
+        import numpy as np
+        if self._scaled is None:
+            data = self.matrix[:self._size]
+            mean = data.mean(axis=0)
+            std = data.std(axis=0)
+            std[std == 0] = 1.0
+            scaled = (data - mean) / std
+            norms = np.linalg.norm(scaled, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self._scaled = (mean, std, scaled, scaled / norms)
+            if self._clusters is not None:
+                self._assign_clusters()
+        return self._scaled
+
+    def _build_clusters(self, rng_seed=0):
+        """k-means (Lloyd) on the unit rows, about sqrt(n) clusters"""
+        import numpy as np
+        unit = self._scaled[3]
+        k = max(2, int(np.sqrt(len(unit))))
+        rng = np.random.default_rng(rng_seed)
+        centroids = unit[rng.choice(len(unit), k, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(unit @ centroids.T, axis=1)
+            for c in range(k):
+                members = unit[assignment == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self._clusters = (centroids, np.argmax(unit @ centroids.T, axis=1), len(unit))
+
+    def _assign_clusters(self):
+        import numpy as np
+        centroids, _, built_for = self._clusters
+        unit = self._scaled[3]
+        if len(unit) > 1.5 * built_for:
+            self._build_clusters()  # grown enough that the clusters are stale
+        else:
+            self._clusters = (centroids, np.argmax(unit @ centroids.T, axis=1), built_for)
+
+    def search(self, vector, k=5, metric='cosine', exclude=(), machine_id=None, use_clusters=None):
+        """[(row, score)] best first; score is cosine similarity or L2 distance"""
+        import numpy as np
+        if not self._size:
+            return [], 'exact'
+        mean, std, scaled, unit = self._standardized()
+        query = (np.asarray(vector, dtype=np.float32) - mean) / std
+        query_unit = query / (np.linalg.norm(query) or 1.0)
+
+        if use_clusters is None:
+            use_clusters = self._size >= IVF_MIN_JOBS
+        candidates = None
+        method = 'exact'
+        if use_clusters and self._size > 2:
+            if self._clusters is None:
+                self._build_clusters()
+            centroids, assignment, _ = self._clusters
+            probes = np.argsort(-(centroids @ query_unit))[:NPROBE]
+            candidates = np.flatnonzero(np.isin(assignment, probes))
+            method = f'clusters({len(centroids)}, nprobe={min(NPROBE, len(centroids))})'
+        if candidates is None:
+            candidates = np.arange(self._size)
+        skip = [self.rows[key] for key in exclude if key in self.rows]
+        if skip:
+            candidates = candidates[~np.isin(candidates, skip)]
+        if machine_id is not None:
+            candidates = np.array([i for i in candidates.tolist() if self.meta[i]['machineId'] == machine_id],
+                                  dtype=np.int64)
+        if not len(candidates):
+            return [], method
+
+        if metric == 'cosine':
+            scores = unit[candidates] @ query_unit
+            order = np.argsort(-scores)[:k]
+        else:
+            scores = np.linalg.norm(scaled[candidates] - query, axis=1)
+            order = np.argsort(scores)[:k]
+        return [(int(candidates[i]), float(scores[i])) for i in order], method
+
+class SimilarityIndex:
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._index = None
+        self._lock = Lock()
+        self._start_lock = Lock()
+        self._pending = Queue()
+        self._worker = None
+        self._poller = None
+        subscribe('job_finished', self._on_finished)
+
+    def _on_finished(self, event):
+        # Reading a job's readings is too slow for the simulator's thread
+        self._ensure_worker()
+        self._pending.put((event['machineId'], event['jobId']))
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = Thread(target=self._work, daemon=True, name="similarity-indexer")
+                    self._worker.start()
+
+    def _work(self):
+        while True:
+            machine_id, job_id = self._pending.get()
+            try:
+                machine = registry.get(machine_id)
+                job = get_store().jobs.get(machine, job_id) if machine else None
+                if job is not None and job.get('status') != 'ongoing':
+                    self.index_job(machine, job)
+            except Exception as e:
+                print(f"⚠️ Similarity indexing failed for {job_id}: {e}")
+
+    def index_job(self, machine, job, store=None):
+        """Compute, save and index one finished job's signature; the vector or None"""
+        store = store or get_store()
+        vector = signature(job_readings(store, machine, job))
+        if vector is None:
+            store.jobs.update(machine, job['_id'], {"signature": []})
+            return None
+        store.jobs.update(machine, job['_id'], {"signature": [round(float(v), 5) for v in vector]})
+        with self._lock:
+            if self._index is not None:
+                self._index.add(job_meta(machine.id, job), vector)
+        return vector
+
+    def _load(self):
+        import numpy as np
+        store = get_store()
+        machines = registry.machines(include_inactive=True)
+        index = VectorIndex()
+        missing = []
+        for machine, jobs in zip(machines, fleet_map(store.jobs.signatures, machines)):
+            for job in jobs:
+                vector = job.get('signature')
+                if vector and len(vector) == SIGNATURE_DIM:
+                    index.add(job_meta(machine.id, job), np.asarray(vector, dtype=np.float32))
+                else:
+                    missing.append((machine, job))
+        with self._lock:
+            self._index = index
+        return missing
+
+    def _backfill(self, missing):
+        # Jobs that finished where no indexer saw them (farm workers)
+        for machine, job in missing[:MAX_BACKFILL_PER_REFRESH]:
+            self.index_job(machine, job)
+
+    def _poll(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self._backfill(self._load())
+            except Exception as e:
+                print(f"⚠️ Similarity index refresh failed: {e}")
+
+    def _ensure_loaded(self):
+        if self._poller is not None:
+            return
+        with self._start_lock:
+            if self._poller is not None:
+                return
+            missing = self._load()
+            self._poller = Thread(target=self._poll, daemon=True, name="similarity-poller")
+            self._poller.start()
+        if missing:
+            self._ensure_worker()
+            for machine, job in missing[:MAX_BACKFILL_PER_REFRESH]:
+                self._pending.put((machine.id, job['_id']))
+
+    def similar(self, machine, job, k=5, metric='cosine', same_machine=False, use_clusters=None):
+        """Most similar finished jobs to `job` (which may still be running)"""
+        self._ensure_loaded()
+        with self._lock:
+            row = self._index.rows.get((machine.id, job['_id']))
+            vector = self._index.matrix[row].copy() if row is not None else None
+        if vector is None:
+            vector = signature(job_readings(get_store(), machine, job))
+            if vector is None:
+                return None
+        with self._lock:
+            hits, method = self._index.search(vector, k, metric, exclude={(machine.id, job['_id'])},
+                                              machine_id=machine.id if same_machine else None,
+                                              use_clusters=use_clusters)
+            indexed = len(self._index)
+            results = [dict(self._index.meta[i], score=round(score, 4)) for i, score in hits]
+        return {'indexed': indexed, 'method': method, 'similar': results}
+
+similarity = SimilarityIndex()
@@ -1,41 +1,82 @@
-from threading import Thread, Event
-from pymongo import MongoClient
+from threading import Thread, Event, Lock
+from app.registry import registry
+from app.storage import get_store
+from app.farm import FARM_ADDRESS, farm_request
+from app.clock import WALL_CLOCK, make_clock, parse_speed, parse_utc
+from app.events import publish
+from app import detector, recent, metrics, twin_feed, wal
+from app.job_summary import JobSummary
+from app.sampling import make_sampler
+from app.training import current_model_path, MODEL_DIR
 import random
-import time
 import os
+import time
 from datetime import datetime
 import pickle
-import numpy as np
 
 # Global dictionary to track running simulations and their stop events
 active_simulations = {}
+metrics.active_simulations.set_function(lambda: len(active_simulations))
 
-# Load ML model with better error handling
+# SIMULATION_SPEED: 1 (real time), 100 (100x faster) or "max" (no waiting).
+# SIMULATION_SEED: when set, each job's RNG is seeded from it and the job id,
+# and the job runs on a VirtualClock at any speed (real sleep jitter never
+# reaches the readings).
+# SIMULATION_START: ISO 8601 start time of every seeded job's clock, so the
+# timestamps repeat too (default: when the job starts).
+SIMULATION_SPEED = parse_speed(os.getenv('SIMULATION_SPEED', '1'))
+SIMULATION_SEED = os.getenv('SIMULATION_SEED')
+SIMULATION_START = parse_utc(os.getenv('SIMULATION_START'))
+WAL_SETTLE_TIMEOUT = 5
+
+# The ML model is unpickled (pulling in numpy and scikit-learn) the first time
+# a simulation needs it, not when the web app imports this module. A model
+# trained by train_failure_model.py (the highest version in ML_MODEL_DIR, or
+# ML_MODEL_VERSION) wins over ML_MODEL_PATH.
 MODEL_PATH = os.getenv('ML_MODEL_PATH', 'model.pkl')
-ml_model = None
+MODEL_VERSION = os.getenv('ML_MODEL_VERSION')
+_model = None
+_model_loaded = False
+_model_lock = Lock()
 
-print("=" * 50)
-print("SIMULATOR INITIALIZATION")
-print("=" * 50)
+def _load_model():
+    print("=" * 50)
+    print("SIMULATOR INITIALIZATION")
+    print("=" * 50)
 
-# Try multiple paths for the ML model
-model_paths = ['model.pkl', 'app/model.pkl', os.path.join(os.getcwd(), 'model.pkl')]
+    # Try multiple paths for the ML model
+    model_paths = [MODEL_PATH, 'model.pkl', 'app/model.pkl', os.path.join(os.getcwd(), 'model.pkl')]
+    trained = current_model_path(version=MODEL_VERSION)
+    if trained:
+        model_paths.insert(0, trained)
+    elif MODEL_VERSION:
+        print(f"⚠️ Model version {MODEL_VERSION} not found in {MODEL_DIR}")
 
-for path in model_paths:
-    try:
-        if os.path.exists(path):
-            print(f"Found model file at: {path}")
-            with open(path, 'rb') as f:
-                ml_model = pickle.load(f)
-            print(f"✅ ML model loaded successfully from {path}")
-            break
-        else:
-            print(f"Model file not found at: {path}")
-    except Exception as e:
-        print(f"❌ Error loading model from {path}: {str(e)}")
+    for path in dict.fromkeys(model_paths):
+        try:
+            if os.path.exists(path):
+                print(f"Found model file at: {path}")
+                with open(path, 'rb') as f:
+                    model = pickle.load(f)
+                print(f"✅ ML model loaded successfully from {path}")
+                return model
+            else:
+                print(f"Model file not found at: {path}")
+        except Exception as e:
+            print(f"❌ Error loading model from {path}: {str(e)}")
 
-if ml_model is None:
     print("⚠️ No ML model loaded - will use random failure probability")
+    return None
+
+def get_model():
+    """The failure model (or None), loaded once on first use"""
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                _model = _load_model()
+                _model_loaded = True
+    return _model
 
 # Material properties database (typical values)
 MATERIAL_PROFILES = {
@@ -71,11 +112,11 @@ TOOL_WEAR_RATES = {
     'Wood': 0.05
 }
 
-def calculate_machine_parameters(material, job_type, tool_diameter):
+def calculate_machine_parameters(material, job_type, tool_diameter, rng=random):
     base_rpm = {
-        'Mild Steel': random.randint(800, 1200),
-        'Aluminum': random.randint(1500, 2500),
-        'Wood': random.randint(2800, 3500)
+        'Mild Steel': rng.randint(800, 1200),
+        'Aluminum': rng.randint(1500, 2500),
+        'Wood': rng.randint(2800, 3500)
     }[material]
 
     base_torque_ranges = {
@@ -88,11 +129,11 @@ def calculate_machine_parameters(material, job_type, tool_diameter):
     }
 
     torque_range = base_torque_ranges[job_type]
-    base_torque = random.uniform(torque_range[0], torque_range[1]) * \
+    base_torque = rng.uniform(torque_range[0], torque_range[1]) * \
                   MATERIAL_PROFILES[material]['torque_factor'] * (tool_diameter / 10)
     return base_rpm, base_torque
 
-def generate_critical_failure_data(machine_id, job_id, material, job_type, tool_no):
+def generate_critical_failure_data(machine_id, job_id, material, job_type, tool_no, clock=WALL_CLOCK):
     """Generate sensor data that indicates >80% failure probability"""
     material_props = MATERIAL_PROFILES[material]
     
@@ -104,8 +145,10 @@ def generate_critical_failure_data(machine_id, job_id, material, job_type, tool_
     critical_tool_wear = 45  # Excessive tool wear
     
     # Calculate failure probability (should be >80%)
+    ml_model = get_model()
     if ml_model is not None:
         try:
+            import numpy as np
             features = np.array([[critical_air_temp, critical_process_temp, 
                                critical_rpm, critical_torque, critical_tool_wear]])
             failure_prob = ml_model.predict_proba(features)[0][1]
@@ -117,7 +160,7 @@ def generate_critical_failure_data(machine_id, job_id, material, job_type, tool_
     return {
         "machineId": machine_id,
         "jobId": job_id,
-        "timestamp": datetime.utcnow(),
+        "timestamp": clock.now(),
         "airTemperature": critical_air_temp,
         "processTemperature": critical_process_temp,
         "rotationalSpeed": critical_rpm,
@@ -128,111 +171,177 @@ def generate_critical_failure_data(machine_id, job_id, material, job_type, tool_
         "criticalFailure": True
     }
 
-def generate_sensor_data(machine_id, job_id, duration, material, job_type, tool_no, stop_event):
-    client = None
-    jobs_collection = None
+def raise_detector_alert(machine, job_id, reading, reasons, store, clock=WALL_CLOCK, stop_event=None):
+    """Record an automatic critical alert, stop the job and publish the event"""
+    machine_id = machine.id
+    probability = reading.get("failureProbability", 0)
+    alert_record = {
+        "machineId": machine_id,
+        "jobId": job_id,
+        "timestamp": clock.now(),
+        "alertType": "Critical Failure Risk",
+        "severity": 5,
+        "message": "Automatic alert: " + "; ".join(reasons),
+        "status": "active",
+        "triggeredBy": "detector",
+        "requiresMaintenance": True,
+        "failureProbability": f"{probability:.0%}",
+        "reasons": reasons
+    }
+    store.alerts.insert(machine, alert_record)
+    metrics.detector_alerts.inc()
+    print(f"🚨 Detector fired for {machine_id} ({job_id}): {'; '.join(reasons)}")
+    # Jobs not tracked in active_simulations (e.g. replays) are stopped directly
+    if not stop_simulation(job_id) and stop_event is not None:
+        stop_event.set()
+    publish('alert', {
+        "alertId": str(alert_record["_id"]),
+        "machineId": machine_id,
+        "jobId": job_id,
+        "timestamp": alert_record["timestamp"],
+        "failureProbability": probability,
+        "reasons": reasons
+    })
+
+def generate_sensor_data(machine_id, job_id, duration, material, job_type, tool_no, stop_event,
+                         writer=None, clock=None, rng=None, store=None):
+    # clock/rng default to wall time and the global random module; pass a
+    # VirtualClock and a seeded random.Random for reproducible accelerated runs.
+    # store defaults to the process-wide one (see app/storage.py).
+    from bson.objectid import ObjectId
+    clock = clock or WALL_CLOCK
+    rng = rng or random
+    # Readings go through this process's write-ahead log when SENSOR_WAL=1,
+    # unless the caller brought its own store (replays, benchmarks)
+    log = wal.get_log() if store is None else None
+    logged = None  # log position past this job's last reading
+    store = store or get_store()
+    machine = None
     start_time = None
+    summary = JobSummary()
+    sampler = make_sampler()
+    # What the job_finished event reports (app/utilization.py indexes it)
+    run = {"machineId": machine_id, "jobId": job_id, "status": None, "startTime": None, "endTime": None}
     
     print(f"🚀 Starting simulation for {machine_id}, Job: {job_id}")
     
     try:
-        client = MongoClient(os.getenv('MONGO_URI'))
-        print(f"✅ Connected to MongoDB")
-        
-        machine_number = int(machine_id.split('-')[1])
-        jobs_collection = client['Jobs'][f'lathe{machine_number}_job_detail']
-        sensor_collection = client['SensorData'][f'lathe{machine_number}_sensory_data']
+        machine = registry.get(machine_id)
+        if machine is None:
+            raise ValueError(f"Unknown machine {machine_id}")
+
+        def store_reading(doc):
+            nonlocal logged
+            sampler.stamp(doc, clock.time())
+            if log is not None:
+                # A fixed _id makes a second forward of the reading a duplicate key
+                doc['_id'] = ObjectId()
+                logged = log.append(machine_id, doc)
+            else:
+                # Farm workers batch writes through their BatchedWriter
+                store.readings.add(machine, doc, writer)
+            summary.add(doc)
+            recent.record(machine_id, doc)
+            twin_feed.feed.record(machine_id, doc)
+            metrics.record_reading()
+
+        ml_model = get_model()
+        if ml_model is not None:
+            import numpy as np
 
         tool_diameter = 10 + tool_no * 2
-        base_rpm, base_torque = calculate_machine_parameters(material, job_type, tool_diameter)
+        base_rpm, base_torque = calculate_machine_parameters(material, job_type, tool_diameter, rng)
         material_props = MATERIAL_PROFILES[material]
 
         duration_seconds = duration * 60
-        start_time = time.time()
+        start_time = clock.time()
         end_time = start_time + duration_seconds
+        run["startTime"] = clock.now()
+        # Published from the job's own clock so the utilization index agrees with the job document
+        publish('job_started', {"machineId": machine_id, "jobId": job_id, "startTime": run["startTime"]})
 
         # Update job details
-        job_update_result = jobs_collection.update_one(
-            {"_id": job_id},
-            {"$set": {
-                "machineId": machine_id,
-                "jobId": job_id,
-                "jobType": job_type,
-                "startTime": datetime.utcnow(),
-                "status": "ongoing",
-                "estimatedTime": duration
-            }},
-            upsert=True
-        )
-        print(f"✅ Job document updated: {job_update_result.modified_count} modified, {job_update_result.upserted_id}")
+        store.jobs.update(machine, job_id, {
+            "machineId": machine_id,
+            "jobId": job_id,
+            "jobType": job_type,
+            "startTime": run["startTime"],
+            "status": "ongoing",
+            "estimatedTime": duration
+        }, upsert=True)
+        print(f"✅ Job document updated for {job_id}")
 
         data_points_inserted = 0
         
-        while time.time() < end_time:
-            # Check if stop event is set (alert triggered)
+        while True:
+            # Check if stop event is set (alert triggered), also after the
+            # last tick: a detector alert on it must still stop the job
             if stop_event.is_set():
                 print(f"🛑 Simulation stopped by alert for {machine_id}")
                 
                 # Inject critical failure data point
                 critical_sensor_data = generate_critical_failure_data(
-                    machine_id, job_id, material, job_type, tool_no
+                    machine_id, job_id, material, job_type, tool_no, clock
                 )
-                sensor_collection.insert_one(critical_sensor_data)
+                store_reading(critical_sensor_data)
                 print(f"⚠️ Critical failure data injected for {machine_id}")
                 
                 # Update job status to require maintenance
-                jobs_collection.update_one(
-                    {"_id": job_id},
-                    {"$set": {
-                        "status": "alert_triggered",
-                        "alertTime": datetime.utcnow(),
-                        "requiresMaintenance": True,
-                        "alertMessage": "Machine at risk of failure - immediate maintenance required"
-                    }}
-                )
+                run.update(status="alert_triggered", endTime=clock.now())
+                store.jobs.update(machine, job_id, {
+                    "status": "alert_triggered",
+                    "alertTime": run["endTime"],
+                    "requiresMaintenance": True,
+                    "alertMessage": "Machine at risk of failure - immediate maintenance required",
+                    "summary": summary.to_doc()
+                })
                 break
-            
-            elapsed = (time.time() - start_time) / 60
+            if clock.time() >= end_time:
+                break
+
+            elapsed = (clock.time() - start_time) / 60
 
             # Tool wear in minutes
             tool_wear_minutes = min(duration * 0.8, TOOL_WEAR_RATES[material] * elapsed)
 
             # RPM with wear effect
             wear_factor = 1 - (tool_wear_minutes / (duration * 2))
-            current_rpm = base_rpm * wear_factor * random.normalvariate(1, 0.03)
+            current_rpm = base_rpm * wear_factor * rng.normalvariate(1, 0.03)
             current_rpm = max(100, current_rpm)
 
             # Torque with wear effect
             torque_increase_factor = 1 + (tool_wear_minutes / duration) * 0.4
-            current_torque = base_torque * torque_increase_factor * random.normalvariate(1, 0.08)
+            current_torque = base_torque * torque_increase_factor * rng.normalvariate(1, 0.08)
             current_torque = max(5, current_torque)
 
             # Air temperature (K)
-            air_temp_k = material_props['base_air_temp'] + random.normalvariate(0, 3)
+            air_temp_k = material_props['base_air_temp'] + rng.normalvariate(0, 3)
             air_temp_k = max(273, min(air_temp_k, 313))
 
             # Process temperature (K)
             process_temp_base = air_temp_k * material_props['process_temp_multiplier']
             machining_heat = (current_torque * current_rpm / 1000) * 15
             wear_heat = tool_wear_minutes * 8
-            process_temp_k = process_temp_base + machining_heat + wear_heat + random.normalvariate(0, 10)
+            process_temp_k = process_temp_base + machining_heat + wear_heat + rng.normalvariate(0, 10)
             process_temp_k = max(air_temp_k + 50, min(process_temp_k, 1073))
 
             # ML Prediction with safe handling
             if ml_model is not None:
                 try:
                     features = np.array([[air_temp_k, process_temp_k, current_rpm, current_torque, tool_wear_minutes]])
+                    inference_started = time.perf_counter()
                     failure_prob = ml_model.predict_proba(features)[0][1]
+                    metrics.inference_latency.observe((), time.perf_counter() - inference_started)
                 except Exception as ml_error:
                     print(f"⚠️ ML prediction error: {ml_error}")
-                    failure_prob = random.uniform(0.0, 0.3)  # Fallback random value
+                    failure_prob = rng.uniform(0.0, 0.3)  # Fallback random value
             else:
-                failure_prob = random.uniform(0.0, 0.3)  # Random failure probability when no model
+                failure_prob = rng.uniform(0.0, 0.3)  # Random failure probability when no model
 
             sensor_data = {
                 "machineId": machine_id,
                 "jobId": job_id,
-                "timestamp": datetime.utcnow(),
+                "timestamp": clock.now(),
                 "airTemperature": round(air_temp_k, 2),
                 "processTemperature": round(process_temp_k, 2),
                 "rotationalSpeed": round(current_rpm, 1),
@@ -241,15 +350,19 @@ def generate_sensor_data(machine_id, job_id, duration, material, job_type, tool_
                 "failureProbability": float(failure_prob)
             }
 
-            insert_result = sensor_collection.insert_one(sensor_data)
+            store_reading(sensor_data)
+
+            reasons = detector.observe(machine_id, job_id, sensor_data)
+            if reasons:
+                raise_detector_alert(machine, job_id, sensor_data, reasons, store, clock, stop_event)
             data_points_inserted += 1
             
             if data_points_inserted % 5 == 0:  # Print every 5th insertion
                 print(f"📊 Inserted {data_points_inserted} sensor data points for {machine_id}")
 
-            remaining = end_time - time.time()
+            remaining = end_time - clock.time()
             if remaining > 0:
-                time.sleep(min(5, remaining))
+                clock.sleep(min(sampler.next_interval(sensor_data), remaining), stop_event)
 
         if not stop_event.is_set():
             print(f"✅ Simulation completed normally for {job_id}")
@@ -259,43 +372,67 @@ def generate_sensor_data(machine_id, job_id, duration, material, job_type, tool_
         import traceback
         traceback.print_exc()
         
-        if jobs_collection is not None:
-            jobs_collection.update_one(
-                {"_id": job_id},
-                {"$set": {"status": "failed", "error": str(e)}}
-            )
+        if machine is not None:
+            run.update(status="failed", endTime=clock.now())
+            store.jobs.update(machine, job_id, {"status": "failed", "error": str(e), "endTime": run["endTime"],
+                                                "summary": summary.to_doc()})
     finally:
+        if log is not None:
+            # Readers of the finished job (summaries, similarity) expect its readings stored
+            if logged is not None and not wal.settle(WAL_SETTLE_TIMEOUT, logged):
+                print(f"⚠️ Readings of {job_id} are still queued in the sensor WAL")
+        elif writer is not None:
+            try:
+                writer.flush()
+            except Exception as e:
+                print(f"❌ Failed to flush readings for {job_id}: {str(e)}")
+
         # Clean up simulation tracking
         if job_id in active_simulations:
             del active_simulations[job_id]
+        detector.forget(machine_id, job_id)
         
         # Always mark job as completed if not already marked as alert_triggered
-        if jobs_collection is not None:
+        if machine is not None:
+            actual_duration = None
             try:
-                actual_duration = None
                 if start_time:
-                    actual_duration = round((time.time() - start_time) / 60, 2)
+                    actual_duration = round((clock.time() - start_time) / 60, 2)
                 
                 # Only update if job is still ongoing
-                completion_result = jobs_collection.update_one(
-                    {"_id": job_id, "status": "ongoing"},
-                    {"$set": {
-                        "status": "completed",
-                        "endTime": datetime.utcnow(),
-                        "actualDuration": actual_duration
-                    }}
-                )
+                ended = clock.now()
+                completed = store.jobs.update(machine, job_id, {
+                    "status": "completed",
+                    "endTime": ended,
+                    "actualDuration": actual_duration,
+                    "summary": summary.to_doc()
+                }, if_status="ongoing")
                 
-                if completion_result.modified_count > 0:
+                if completed:
+                    run.update(status="completed", endTime=ended)
                     print(f"✅ Job {job_id} marked as completed")
                     
             except Exception as e:
                 print(f"❌ Failed to mark job as completed: {str(e)}")
-        
-        if client:
-            client.close()
+            publish('job_finished', dict(run, estimatedTime=duration, actualDuration=actual_duration))
+
+def job_rng(job_id, seed=SIMULATION_SEED):
+    """Seeded per-job RNG, or the global random module when no seed is set"""
+    if seed is None:
+        return random
+    return random.Random(f"{seed}:{job_id}")
+
+def start_simulation(machine_id, job_id, duration, material, job_type, tool_no,
+                     speed=SIMULATION_SPEED, seed=SIMULATION_SEED, start=SIMULATION_START):
+    if FARM_ADDRESS:
+        reply = farm_request({
+            'command': 'start', 'machine_id': machine_id, 'job_id': job_id, 'duration': duration,
+            'material': material, 'job_type': job_type, 'tool_no': tool_no,
+            'speed': speed, 'seed': seed, 'start': start
+        })
+        print(f"🏭 Job {job_id} sent to simulation farm worker {reply.get('worker')}")
+        return None
 
-def start_simulation(machine_id, job_id, duration, material, job_type, tool_no):
     print(f"🎯 Starting simulation thread for {machine_id}")
     
     # Create stop event for this simulation
@@ -307,7 +444,10 @@ def start_simulation(machine_id, job_id, duration, material, job_type, tool_no):
     }
     
     thread = Thread(target=generate_sensor_data,
-                   args=(machine_id, job_id, duration, material, job_type, tool_no, stop_event))
+                   args=(machine_id, job_id, duration, material, job_type, tool_no, stop_event),
+                   kwargs={'clock': make_clock(speed, start if seed is not None else None, seed),
+                           'rng': job_rng(job_id, seed)},
+                   name=f"sim-{job_id}")
     thread.daemon = True
     thread.start()
     print(f"🧵 Thread started for job {job_id}")
@@ -315,6 +455,8 @@ def start_simulation(machine_id, job_id, duration, material, job_type, tool_no):
 
 def stop_simulation(job_id):
     """Stop simulation for a specific job"""
+    if FARM_ADDRESS:
+        return farm_request({'command': 'stop', 'job_id': job_id}).get('ok', False)
     if job_id in active_simulations:
         active_simulations[job_id]['stop_event'].set()
         print(f"🛑 Stop signal sent to simulation {job_id}")
@@ -0,0 +1,343 @@
+from threading import Lock
+from app.db import get_client
+from app import readings
+import os
+
+# Every read and write of jobs, readings, alerts, users, machines,
+# maintenance windows, queued jobs and cache versions goes through a store:
+#
+#     store = get_store()
+#     store.jobs.current(machine)
+#     store.readings.add(machine, reading, writer)
+#
+# STORAGE_BACKEND picks the implementation: "mongo" (default, the collections
+# described in app/registry.py and app/readings.py) or "memory"
+# (app/memory_storage.py), which needs no external process and keeps sorted
+# indexes for the latest-reading and range queries. The memory backend lives
+# in one process, so it can't be shared with a simulation farm or with several
+# gunicorn workers.
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'mongo')
+
+# Where each shared version counter has always lived in Mongo
+VERSION_LOCATIONS = {
+    'users': ('AuthDB', 'cache_state'),
+    'machines': ('Fleet', 'state'),
+    'windows': ('Maintenance', 'state'),
+    'queue': ('Jobs', 'queue_state')
+}
+
+# Job fields that describe when a job ran and how it ended
+RUN_FIELDS = ('status', 'startTime', 'endTime', 'alertTime', 'estimatedTime', 'actualDuration')
+SIGNATURE_FIELDS = ('status', 'jobType', 'startTime', 'endTime', 'alertTime', 'signature')
+# Job fields the timeline (app/timeline.py) ranges over; each has an index
+TIME_FIELDS = ('startTime', 'endTime', 'alertTime')
+
+def time_range(field, start=None, end=None):
+    """Query for documents with `field` set and in [start, end]"""
+    bounds = {k: v for k, v in (("$gte", start), ("$lte", end)) if v is not None}
+    return {field: bounds or {"$ne": None}}
+
+# ------------------ Mongo repositories ------------------
+
+class MongoJobs:
+    def __init__(self, store):
+        self._store = store
+
+    def _coll(self, machine):
+        return self._store.collections(machine)['jobs']
+
+    def insert(self, machine, job):
+        self._coll(machine).insert_one(job)
+        return job['_id']
+
+    def get(self, machine, job_id):
+        return self._coll(machine).find_one({"_id": job_id})
+
+    def current(self, machine, statuses=('ongoing',)):
+        """The machine's job in one of `statuses`, or None"""
+        return self._coll(machine).find_one({"status": {"$in": list(statuses)}})
+
+    def has_ongoing(self, machine):
+        return self._coll(machine).find_one({"status": "ongoing"}, {"_id": 1}) is not None
+
+    def history(self, machine):
+        return list(self._coll(machine).find(sort=[("startTime", -1)]))
+
+    def runs(self, machine):
+        """Just the timing fields of every job (app/utilization.py)"""
+        return list(self._coll(machine).find({}, {f: 1 for f in RUN_FIELDS}))
+
+    def signatures(self, machine):
+        """Finished jobs with their signature, if any (app/similarity.py); jobs
+        marked as too short for one (signature []) are left out"""
+        projection = {f: 1 for f in SIGNATURE_FIELDS}
+        projection["summary.peakFailureProbability"] = 1
+        return list(self._coll(machine).find({"status": {"$ne": "ongoing"}, "signature": {"$ne": []}}, projection))
+
+    def between(self, machine, field, start=None, end=None, descending=False, unset=None, batch_size=100):
+        """Jobs with `field` in [start, end] ordered by it (then _id), lazily,
+        without summary or signature; `unset` names a field they must not have"""
+        query = time_range(field, start, end)
+        if unset:
+            query[unset] = None
+        direction = -1 if descending else 1
+        cursor = self._coll(machine).find(query, {"summary": 0, "signature": 0})
+        yield from cursor.sort([(field, direction), ("_id", direction)]).batch_size(batch_size)
+
+    def update(self, machine, job_id, fields, upsert=False, if_status=None):
+        """$set fields on one job (only while it has `if_status`); True if it changed"""
+        query = {"_id": job_id}
+        if if_status:
+            query["status"] = if_status
+        result = self._coll(machine).update_one(query, {"$set": fields}, upsert=upsert)
+        return bool(result.modified_count or result.upserted_id)
+
+    def remove(self, machine, job_id):
+        return bool(self._coll(machine).delete_one({"_id": job_id}).deleted_count)
+
+    def stalled(self, machine, now):
+        """Ongoing jobs whose estimated end is already past"""
+        return list(self._coll(machine).find({
+            "status": "ongoing",
+            "$expr": {
+                "$lt": [
+                    {"$add": ["$startTime", {"$multiply": ["$estimatedTime", 60000]}]},  # estimatedTime in ms
+                    now
+                ]
+            }
+        }))
+
+    def counts(self, machine):
+        """{'total': n, 'ongoing': n} in one pass over the collection"""
+        doc = next(self._coll(machine).aggregate([
+            {"$group": {
+                "_id": None,
+                "total": {"$sum": 1},
+                "ongoing": {"$sum": {"$cond": [{"$eq": ["$status", "ongoing"]}, 1, 0]}}
+            }}
+        ]), {})
+        return {'total': doc.get('total', 0), 'ongoing': doc.get('ongoing', 0)}
+
+class MongoReadings:
+    """Sensor readings in whichever layout SENSOR_LAYOUT selects (app/readings.py)"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def add(self, machine, reading, writer=None):
+        readings.store(self._store.collections(machine), reading, writer)
+
+    def add_many(self, machine, batch):
+        """One bulk write; repeating a batch doesn't duplicate readings (see readings.store_many)"""
+        readings.store_many(self._store.collections(machine), batch)
+
+    def latest(self, machine):
+        return readings.latest(self._store.collections(machine))
+
+    def newest(self, machine, limit, after=None):
+        return readings.newest(self._store.collections(machine), limit, after=after)
+
+    def between(self, machine, start=None, end=None, job_id=None):
+        return readings.between(self._store.collections(machine), start, end, job_id)
+
+    def averages(self, machine):
+        return readings.averages(self._store.collections(machine))
+
+class MongoAlerts:
+    def __init__(self, store):
+        self._store = store
+
+    def _coll(self, machine):
+        return self._store.collections(machine)['alerts']
+
+    def insert(self, machine, alert):
+        self._coll(machine).insert_one(alert)
+        return alert['_id']
+
+    def history(self, machine):
+        return list(self._coll(machine).find(sort=[("timestamp", -1)]))
+
+    def between(self, machine, start=None, end=None, descending=False, batch_size=100):
+        """Alerts with timestamp in [start, end] in timestamp (then _id) order, lazily"""
+        direction = -1 if descending else 1
+        cursor = self._coll(machine).find(time_range("timestamp", start, end))
+        yield from cursor.sort([("timestamp", direction), ("_id", direction)]).batch_size(batch_size)
+
+    def latest_critical(self, machine):
+        """Newest active severity-5 alert that requires maintenance"""
+        return self._coll(machine).find_one({
+            "machineId": machine.id,
+            "severity": 5,
+            "status": "active",
+            "requiresMaintenance": True
+        }, sort=[("timestamp", -1)])
+
+class MongoUsers:
+    def __init__(self, store):
+        self._coll = store.client[f'{store.db_prefix}AuthDB']['users']
+
+    def get(self, user_id):
+        from bson.objectid import ObjectId
+        if not ObjectId.is_valid(user_id):
+            return None
+        return self._coll.find_one({"_id": ObjectId(user_id)})
+
+    def find_by_login(self, login):
+        return self._coll.find_one({"userID": login})
+
+    def record_login(self, user_id, when):
+        self._coll.update_one({'_id': user_id}, {'$set': {'lastLogin': when}})
+
+    def save(self, doc):
+        """Insert or update a user by userID; True when it was created"""
+        result = self._coll.update_one({"userID": doc["userID"]}, {
+            "$set": {k: v for k, v in doc.items() if k != "lastLogin"},
+            "$setOnInsert": {"lastLogin": doc.get("lastLogin")}
+        }, upsert=True)
+        return result.upserted_id is not None
+
+class MongoMachines:
+    def __init__(self, store):
+        self._coll = store.client[f'{store.db_prefix}Fleet']['machines']
+
+    def all(self):
+        return list(self._coll.find(sort=[("number", 1)]))
+
+    def save(self, doc):
+        self._coll.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+
+    def add_if_missing(self, doc):
+        self._coll.update_one({"_id": doc["_id"]}, {"$setOnInsert": doc}, upsert=True)
+
+class MongoMaintenance:
+    def __init__(self, store):
+        self._coll = store.client[f'{store.db_prefix}Maintenance']['windows']
+
+    def add(self, window):
+        return self._coll.insert_one(window).inserted_id
+
+    def remove(self, window_id):
+        from bson.objectid import ObjectId
+        if not ObjectId.is_valid(window_id):
+            return False
+        return bool(self._coll.delete_one({"_id": ObjectId(window_id)}).deleted_count)
+
+    def find(self, machine_id=None, ending_after=None):
+        """Windows ordered by start, optionally for one machine / still open at a time"""
+        query = {}
+        if ending_after is not None:
+            query["end"] = {"$gte": ending_after}
+        if machine_id:
+            query["machineId"] = machine_id
+        return list(self._coll.find(query, sort=[("start", 1)]))
+
+    def ensure_indexes(self):
+        self._coll.create_index([("machineId", 1), ("end", 1)])
+        self._coll.create_index([("end", 1)])
+
+class MongoQueue:
+    """Jobs waiting for a lathe (Jobs.queue); app/job_queue.py orders and dispatches them"""
+
+    def __init__(self, store):
+        self._coll = store.client[f'{store.db_prefix}Jobs']['queue']
+
+    def add_many(self, docs):
+        if docs:
+            self._coll.insert_many(docs)
+        return [d['_id'] for d in docs]
+
+    def get(self, job_id):
+        return self._coll.find_one({"_id": job_id})
+
+    def pending(self):
+        return list(self._coll.find({"status": "queued"}))
+
+    def find(self, statuses=None, limit=100):
+        query = {"status": {"$in": list(statuses)}} if statuses else {}
+        return list(self._coll.find(query, sort=[("submittedAt", -1)], limit=limit))
+
+    def set_status(self, job_id, status, fields=None, if_status='queued'):
+        """Move a job out of `if_status`; False if another worker got there first"""
+        result = self._coll.update_one({"_id": job_id, "status": if_status},
+                                       {"$set": dict(fields or {}, status=status)})
+        return bool(result.modified_count)
+
+    def ensure_indexes(self):
+        self._coll.create_index([("status", 1), ("submittedAt", -1)])
+
+class MongoVersions:
+    """Named counters that workers poll to know when to drop cached data"""
+
+    def __init__(self, store):
+        self._client = store.client
+        self._prefix = store.db_prefix
+
+    def _coll(self, name):
+        db, coll = VERSION_LOCATIONS.get(name, ('AppState', 'versions'))
+        return self._client[self._prefix + db][coll]
+
+    def get(self, name):
+        doc = self._coll(name).find_one({"_id": name})
+        return doc.get("version", 0) if doc else 0
+
+    def bump(self, name):
+        self._coll(name).update_one({"_id": name}, {"$inc": {"version": 1}}, upsert=True)
+
+class MongoStore:
+    name = 'mongo'
+
+    def __init__(self, client=None, db_prefix=''):
+        self.client = client or get_client()
+        self.db_prefix = db_prefix
+        self.jobs = MongoJobs(self)
+        self.readings = MongoReadings(self)
+        self.alerts = MongoAlerts(self)
+        self.users = MongoUsers(self)
+        self.machines = MongoMachines(self)
+        self.maintenance = MongoMaintenance(self)
+        self.queue = MongoQueue(self)
+        self.versions = MongoVersions(self)
+
+    def collections(self, machine):
+        return machine.collections(self.client, self.db_prefix)
+
+    def ensure_indexes(self, machine):
+        collections = self.collections(machine)
+        collections['jobs'].create_index("status")
+        for field in TIME_FIELDS:
+            collections['jobs'].create_index([(field, 1), ("_id", 1)])
+        collections['alerts'].create_index([("timestamp", 1), ("_id", 1)])
+        readings.ensure_indexes(collections)
+
+    def describe(self):
+        return f"MongoDB, databases: {self.client.list_database_names()}"
+
+# ------------------ Backend selection ------------------
+
+_store = None
+_store_lock = Lock()
+
+def create_store(backend=None, **kwargs):
+    """A new store; kwargs (client, db_prefix) only apply to the mongo backend"""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'mongo':
+        return MongoStore(**kwargs)
+    if backend == 'memory':
+        from app.memory_storage import MemoryStore
+        return MemoryStore()
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r} (expected 'mongo' or 'memory')")
+
+def get_store():
+    """The process-wide store for STORAGE_BACKEND, created on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+    return _store
+
+def set_store(store):
+    """Swap the process-wide store (benchmarks and scripts that pick a backend)"""
+    global _store
+    with _store_lock:
+        _store = store
@@ -0,0 +1,128 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from heapq import merge
+from itertools import chain
+from threading import Lock
+from app.clock import parse_utc
+from app.registry import fleet_map
+import json
+import os
+
+# Fleet-wide event timeline (/api/timeline). Every machine keeps its jobs and
+# alerts in its own collections, so one page of "what happened" is a k-way
+# merge: one range cursor per (machine, source), each sorted on an indexed
+# time field, opened concurrently and merged lazily with heapq.merge.
+#
+#   job_started   jobs by startTime
+#   job_finished  jobs by endTime, plus alert-stopped jobs by alertTime
+#   alert         alerts by timestamp
+#
+# Each cursor's first batch is page size + 1 documents, so a page reads at
+# most that many from any collection (the +1 tells whether there is a next
+# page); events skipped on resume are the only reason to fetch a second batch.
+#
+# Events are ordered by (time, machine id, type, id) and the page cursor is
+# the key of the last event returned, so paging is stable while new events
+# keep arriving.
+TIMELINE_PAGE_SIZE = int(os.getenv('TIMELINE_PAGE_SIZE', '100'))
+TIMELINE_MAX_PAGE_SIZE = 1000
+TYPES = ('job_started', 'job_finished', 'alert')
+ORDERS = ('asc', 'desc')
+
+JOB_FIELDS = ('jobType', 'status', 'startTime', 'endTime', 'alertTime', 'estimatedTime', 'actualDuration')
+ALERT_FIELDS = ('alertType', 'severity', 'message', 'status', 'triggeredBy', 'requiresMaintenance')
+
+def encode_cursor(key):
+    time, machine_id, event_type, event_id = key
+    raw = json.dumps([time.isoformat(), machine_id, event_type, event_id], separators=(',', ':'))
+    return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(time, machine id, type, id) from a page cursor; raises ValueError"""
+    try:
+        time, machine_id, event_type, event_id = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return parse_utc(time), str(machine_id), str(event_type), str(event_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid timeline cursor") from e
+
+def _job_event(event_type, field, machine_id, job):
+    event = {f: job[f] for f in JOB_FIELDS if job.get(f) is not None}
+    return dict(event, time=job[field], type=event_type, machineId=machine_id,
+                id=str(job['_id']), jobId=str(job['_id']))
+
+def _alert_event(machine_id, alert):
+    event = {f: alert[f] for f in ALERT_FIELDS if alert.get(f) is not None}
+    if alert.get('jobId'):
+        event['jobId'] = alert['jobId']
+    return dict(event, time=alert['timestamp'], type='alert', machineId=machine_id, id=str(alert['_id']))
+
+def _sources(store, machine, types, start, end, descending, batch_size):
+    """[(store cursor, event builder)] for this machine, each cursor time-ordered"""
+    args = dict(start=start, end=end, descending=descending, batch_size=batch_size)
+    sources = []
+    if 'job_started' in types:
+        sources.append((store.jobs.between(machine, 'startTime', **args),
+                        lambda job: _job_event('job_started', 'startTime', machine.id, job)))
+    if 'job_finished' in types:
+        sources.append((store.jobs.between(machine, 'endTime', **args),
+                        lambda job: _job_event('job_finished', 'endTime', machine.id, job)))
+        sources.append((store.jobs.between(machine, 'alertTime', unset='endTime', **args),
+                        lambda job: _job_event('job_finished', 'alertTime', machine.id, job)))
+    if 'alert' in types:
+        sources.append((store.alerts.between(machine, **args), lambda alert: _alert_event(machine.id, alert)))
+    return sources
+
+def event_key(event):
+    return event['time'], event['machineId'], event['type'], event['id']
+
+def _stream(source):
+    """The source's events, with the first one read (the query runs) up front"""
+    cursor, build = source
+    first = next(cursor, None)
+    return None if first is None else chain([build(first)], map(build, cursor))
+
+class Timeline:
+    def __init__(self):
+        self._indexed = set()  # machine ids whose time indexes exist
+        self._lock = Lock()
+
+    def _ensure_indexes(self, store, machines):
+        missing = [m for m in machines if m.id not in self._indexed]
+        if not missing:
+            return
+        fleet_map(store.ensure_indexes, missing)
+        with self._lock:
+            self._indexed.update(m.id for m in missing)
+
+    def page(self, store, machines, types=TYPES, start=None, end=None, order='desc',
+             limit=TIMELINE_PAGE_SIZE, cursor=None):
+        """(events, next page cursor or None), newest first unless order='asc'"""
+        descending = order == 'desc'
+        after = decode_cursor(cursor) if cursor else None
+        if after:
+            # The cursor's time is inclusive; ties with it are skipped below
+            if descending:
+                end = min(end, after[0]) if end else after[0]
+            else:
+                start = max(start, after[0]) if start else after[0]
+        self._ensure_indexes(store, machines)
+
+        sources = [s for m in machines for s in _sources(store, m, types, start, end, descending, limit + 1)]
+        # Opening a cursor is a round trip; open them all at once
+        streams = fleet_map(_stream, sources)
+        merged = merge(*filter(None, streams), key=event_key, reverse=descending)
+
+        events = []
+        try:
+            for event in merged:
+                key = event_key(event)
+                if after and (key >= after if descending else key <= after):
+                    continue
+                if len(events) == limit:
+                    return events, encode_cursor(event_key(events[-1]))
+                events.append(event)
+            return events, None
+        finally:
+            for results, _ in sources:
+                results.close()  # releases the server-side cursor
+
+timeline = Timeline()
@@ -0,0 +1,272 @@
+from datetime import timedelta
+from heapq import merge
+from app.registry import fleet_map
+import json
+import os
+import pickle
+import random
+import re
+import time
+
+# Out-of-core training of the failure model (train_failure_model.py).
+#
+# Every reading of every lathe becomes one row: the five sensor values the
+# simulator feeds the model, labelled 1 if it is a criticalFailure reading or
+# falls within TRAIN_LABEL_HORIZON_MINUTES before its job's alert
+# (status "alert_triggered"), else 0. Readings of jobs still running have no
+# outcome yet and are left out. The outcome comes from a merge join: a
+# machine's readings and its jobs are both read in time order, and only the
+# jobs open at the current reading are held.
+#
+# The machines' rows are merged in time order and streamed in batches
+# through a bounded shuffle buffer, never all at once, so every batch mixes
+# machines and memory is the same for a week of data or for years:
+#
+#   1. the training range once to fit the feature scaler and count classes
+#   2. the training range once per epoch into SGDClassifier.partial_fit
+#      (logistic loss), with class-balanced sample weights
+#   3. the holdout range (the most recent stretch of time) for evaluation
+#
+# The model is written as MODEL_DIR/failure-model-v<N>.pkl (the next free N)
+# with the training report next to it as failure-model-v<N>.json. The
+# simulator loads the highest version (or ML_MODEL_VERSION) from MODEL_DIR.
+MODEL_DIR = os.getenv('ML_MODEL_DIR', 'models')
+MODEL_FEATURES = ('airTemperature', 'processTemperature', 'rotationalSpeed', 'torque', 'toolWear')
+LABEL_HORIZON = timedelta(minutes=float(os.getenv('TRAIN_LABEL_HORIZON_MINUTES', '10')))
+BATCH_SIZE = 10000
+SHUFFLE_ROWS = 200000
+SCORE_BINS = 1000
+_MODEL_FILE = re.compile(r'^failure-model-v(\d+)\.pkl$')
+
+# ------------------ Versioned model files ------------------
+
+def model_path(version, directory=MODEL_DIR):
+    return os.path.join(directory, f"failure-model-v{version}.pkl")
+
+def model_versions(directory=MODEL_DIR):
+    """Versions present in `directory`, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(m.group(1)) for m in map(_MODEL_FILE.match, os.listdir(directory)) if m)
+
+def current_model_path(directory=MODEL_DIR, version=None):
+    """The pinned `version` or the highest one in `directory`; None if there is none"""
+    versions = model_versions(directory)
+    if version is not None:
+        return model_path(version, directory) if int(version) in versions else None
+    return model_path(versions[-1], directory) if versions else None
+
+def save_model(model, report, directory=MODEL_DIR):
+    """Write the next version of the model and its report; (version, path)"""
+    os.makedirs(directory, exist_ok=True)
+    version = (model_versions(directory) or [0])[-1] + 1
+    path = model_path(version, directory)
+    report = dict(report, version=version)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(model, f)
+    os.replace(tmp, path)  # a simulator never sees a half-written model
+    with open(path[:-len('.pkl')] + '.json', 'w') as f:
+        json.dump(report, f, indent=2, default=lambda value: value.isoformat())
+    return version, path
+
+# ------------------ Rows ------------------
+
+def _outcome_end(job):
+    return job.get('endTime') or job.get('alertTime')
+
+def label(reading, job, horizon=LABEL_HORIZON):
+    """1, 0, or None when the job has no outcome yet"""
+    if reading.get('criticalFailure'):
+        return 1
+    if job is None or job.get('status') in (None, 'ongoing'):
+        return None
+    alert_time = job.get('alertTime')
+    if job.get('status') == 'alert_triggered' and alert_time is not None:
+        return int(alert_time - horizon <= reading['timestamp'] <= alert_time)
+    return 0
+
+def labelled_rows(store, machine, start=None, before=None, horizon=LABEL_HORIZON):
+    """(timestamp, features, label) for the machine's readings in [start, before), in time order"""
+    jobs = store.jobs.between(machine, 'startTime', start, before)
+    next_job = next(jobs, None)
+    open_jobs = {}  # job id -> job, for jobs that may still have readings ahead
+    try:
+        for reading in store.readings.between(machine, start, before):
+            ts = reading['timestamp']
+            if before is not None and ts >= before:
+                break
+            while next_job is not None and next_job['startTime'] <= ts:
+                open_jobs[next_job['_id']] = next_job
+                for job_id, job in list(open_jobs.items()):
+                    if _outcome_end(job) is not None and _outcome_end(job) < ts:
+                        del open_jobs[job_id]
+                next_job = next(jobs, None)
+            job_id = reading.get('jobId')
+            if job_id is None:
+                continue
+            job = open_jobs.get(job_id)
+            if job is None:
+                # Started before `start` (or gone): look it up once
+                job = open_jobs[job_id] = store.jobs.get(machine, job_id) or {}
+            values = tuple(reading.get(f) for f in MODEL_FEATURES)
+            outcome = label(reading, job, horizon)
+            if outcome is not None and None not in values:
+                yield ts, values, outcome
+    finally:
+        jobs.close()
+
+def batches(store, machines, start=None, before=None, batch_size=BATCH_SIZE,
+            shuffle_rows=SHUFFLE_ROWS, seed=0, horizon=LABEL_HORIZON):
+    """(X, y) numpy batches over every machine's rows. The machines' streams
+    are merged in time order, then pass through a shuffle buffer of
+    `shuffle_rows`, so a batch mixes machines and the times in the buffer
+    (0 keeps the merged order)."""
+    import numpy as np  # deferred like app/recent.py
+    rng = random.Random(seed)
+    buffer = []
+
+    def drain(rows):
+        if shuffle_rows:
+            rng.shuffle(rows)
+        for i in range(0, len(rows), batch_size):
+            chunk = rows[i:i + batch_size]
+            yield (np.array([r[1] for r in chunk], dtype=np.float64),
+                   np.array([r[2] for r in chunk], dtype=np.int8))
+
+    # One cursor per machine, interleaved like app/export.py's merge
+    streams = [labelled_rows(store, machine, start, before, horizon) for machine in machines]
+    for row in merge(*streams, key=lambda r: r[0]):
+        buffer.append(row)
+        if len(buffer) >= max(shuffle_rows, batch_size):
+            yield from drain(buffer)
+            buffer = []
+    if buffer:
+        yield from drain(buffer)
+
+def time_span(store, machines):
+    """(first, last) reading time across `machines`, or (None, None)"""
+    def span(machine):
+        readings = store.readings.between(machine)
+        first = next(readings, None)
+        readings.close()
+        last = store.readings.latest(machine)
+        return first and first['timestamp'], last and last['timestamp']
+    spans = [s for s in fleet_map(span, machines) if s[0] is not None]
+    if not spans:
+        return None, None
+    return min(s[0] for s in spans), max(s[1] for s in spans)
+
+# ------------------ Evaluation ------------------
+
+class Evaluation:
+    """Holdout metrics from score histograms, so memory doesn't grow with rows"""
+
+    def __init__(self, threshold=0.5, bins=SCORE_BINS):
+        import numpy as np
+        self.threshold = threshold
+        self.bins = bins
+        self.histograms = np.zeros((2, bins), dtype=np.int64)  # [label][score bin]
+        self.log_loss = 0.0
+        self.brier = 0.0
+        self.tp = self.fp = self.fn = 0
+
+    def add(self, scores, y):
+        import numpy as np
+        y = y.astype(bool)
+        index = np.minimum((scores * self.bins).astype(np.int64), self.bins - 1)
+        self.histograms[1] += np.bincount(index[y], minlength=self.bins)
+        self.histograms[0] += np.bincount(index[~y], minlength=self.bins)
+        clipped = np.clip(scores, 1e-7, 1 - 1e-7)
+        self.log_loss -= float(np.sum(np.where(y, np.log(clipped), np.log(1 - clipped))))
+        self.brier += float(np.sum((scores - y) ** 2))
+        predicted = scores >= self.threshold
+        self.tp += int(np.sum(predicted & y))
+        self.fp += int(np.sum(predicted & ~y))
+        self.fn += int(np.sum(~predicted & y))
+
+    def auc(self):
+        """ROC AUC with scores binned to 1/bins; ties within a bin count half"""
+        negatives, positives = self.histograms
+        if not negatives.sum() or not positives.sum():
+            return None
+        below = 0.0
+        area = 0.0
+        for neg, pos in zip(negatives.tolist(), positives.tolist()):
+            area += pos * (below + neg / 2)
+            below += neg
+        return area / (negatives.sum() * positives.sum())
+
+    def to_doc(self):
+        rows = int(self.histograms.sum())
+        auc = self.auc()
+        return {
+            'rows': rows,
+            'positives': int(self.histograms[1].sum()),
+            'auc': auc and round(float(auc), 4),
+            'logLoss': round(self.log_loss / rows, 4) if rows else None,
+            'brier': round(self.brier / rows, 4) if rows else None,
+            'threshold': self.threshold,
+            'precision': round(self.tp / (self.tp + self.fp), 4) if self.tp + self.fp else None,
+            'recall': round(self.tp / (self.tp + self.fn), 4) if self.tp + self.fn else None
+        }
+
+# ------------------ Training ------------------
+
+def train(store, machines, start=None, end=None, holdout_from=None, holdout_fraction=0.2,
+          epochs=2, batch_size=BATCH_SIZE, shuffle_rows=SHUFFLE_ROWS, horizon=LABEL_HORIZON,
+          alpha=1e-4, log=print):
+    """(fitted scaler + SGDClassifier pipeline, report dict); raises ValueError
+    when the range has no readings or no labelled failures to learn from"""
+    import numpy as np
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    if holdout_from is None:
+        first, last = time_span(store, machines)
+        if first is None:
+            raise ValueError("No readings to train on")
+        first, last = max(first, start) if start else first, min(last, end) if end else last
+        holdout_from = last - (last - first) * holdout_fraction
+    started = time.perf_counter()
+
+    scaler = StandardScaler()
+    counts = np.zeros(2, dtype=np.int64)
+    for X, y in batches(store, machines, start, holdout_from, batch_size, shuffle_rows=0, horizon=horizon):
+        scaler.partial_fit(X)
+        counts += np.bincount(y, minlength=2)
+    log(f"📊 Training rows: {int(counts.sum())} ({int(counts[1])} failures) before {holdout_from.isoformat()}")
+    if not counts[1] or not counts[0]:
+        raise ValueError("The training range needs both failure and normal readings")
+
+    # Balanced: each class carries half the total weight
+    weights = counts.sum() / (2.0 * counts)
+    model = SGDClassifier(loss='log_loss', alpha=alpha, random_state=0)
+    for epoch in range(epochs):
+        for X, y in batches(store, machines, start, holdout_from, batch_size, shuffle_rows, epoch, horizon):
+            model.partial_fit(scaler.transform(X), y, classes=[0, 1], sample_weight=weights[y])
+        log(f"🔁 Epoch {epoch + 1}/{epochs} done ({time.perf_counter() - started:.1f}s)")
+    pipeline = make_pipeline(scaler, model)
+
+    evaluation = Evaluation()
+    for X, y in batches(store, machines, holdout_from, end, batch_size, shuffle_rows=0, horizon=horizon):
+        evaluation.add(pipeline.predict_proba(X)[:, 1], y)
+    holdout = evaluation.to_doc()
+    log(f"🧪 Holdout: {holdout}")
+
+    report = {
+        'features': list(MODEL_FEATURES),
+        'machines': [m.id for m in machines],
+        'start': start,
+        'end': end,
+        'holdoutFrom': holdout_from,
+        'labelHorizonMinutes': horizon.total_seconds() / 60,
+        'trainRows': int(counts.sum()),
+        'trainFailures': int(counts[1]),
+        'epochs': epochs,
+        'learner': 'StandardScaler + SGDClassifier(log_loss), class-balanced',
+        'holdout': holdout,
+        'seconds': round(time.perf_counter() - started, 1)
+    }
+    return pipeline, report
@@ -0,0 +1,195 @@
+from datetime import datetime
+from threading import Thread, Condition, Lock
+from app.storage import get_store
+from app.registry import registry, fleet_map
+from app.maintenance import schedule as maintenance_schedule
+from app.events import subscribe
+import math
+import os
+import struct
+import time
+
+# Binary fleet snapshot for the Unity digital twin (/api/twin/frame and
+# /api/twin/stream; the layout is documented in "Digital Twin/readme.md").
+#
+# The snapshot lives in memory: the simulator feeds it every reading it
+# stores and the job_started / job_finished events flip the running flag.
+# Readings written by other processes (farm workers, other gunicorn workers)
+# are picked up by one refresh every TWIN_REFRESH_INTERVAL seconds: a latest
+# reading and an ongoing-job check per machine, however many twins connect.
+# Any change bumps the snapshot version; the packed frame is built once per
+# version and the same bytes go to every twin.
+TWIN_REFRESH_INTERVAL = float(os.getenv('TWIN_REFRESH_INTERVAL', '5'))
+TWIN_STREAM_HZ = float(os.getenv('TWIN_STREAM_HZ', '10'))
+TWIN_MAX_HZ = 60
+TWIN_MAX_WAIT = 30
+
+MAGIC = b'LTWN'
+LAYOUT_VERSION = 1
+# magic, layout version, machine count, snapshot version, generated at (epoch s)
+HEADER = struct.Struct('<4sHHQd')
+# machine id, status, flags, reserved, last reading (epoch s, NaN if none),
+# airTemperature, processTemperature, rotationalSpeed, torque, toolWear,
+# failureProbability
+RECORD = struct.Struct('<16sBBHd6f')
+TWIN_FIELDS = ('airTemperature', 'processTemperature', 'rotationalSpeed',
+               'torque', 'toolWear', 'failureProbability')
+
+STATUS_IDLE, STATUS_RUNNING, STATUS_ALERT, STATUS_MAINTENANCE, STATUS_INACTIVE = range(5)
+FLAG_ALERT_TRIGGERED = 1
+FLAG_CRITICAL_FAILURE = 2
+
+_EPOCH = datetime(1970, 1, 1)
+
+def reading_state(reading):
+    """(epoch seconds or None, sensor values, flags) of one reading"""
+    if not reading:
+        return None, (0.0,) * len(TWIN_FIELDS), 0
+    flags = ((FLAG_ALERT_TRIGGERED if reading.get('alertTriggered') else 0) |
+             (FLAG_CRITICAL_FAILURE if reading.get('criticalFailure') else 0))
+    ts = reading.get('timestamp')
+    return ((ts - _EPOCH).total_seconds() if ts else None,
+            tuple(float(reading.get(f) or 0.0) for f in TWIN_FIELDS), flags)
+
+class MachineState:
+    __slots__ = ('active', 'running', 'maintenance', 'timestamp', 'values', 'flags')
+
+    def __init__(self, active=True):
+        self.active = active
+        self.running = False
+        self.maintenance = False
+        self.timestamp, self.values, self.flags = reading_state(None)
+
+    @property
+    def status(self):
+        if not self.active:
+            return STATUS_INACTIVE
+        if self.maintenance:
+            return STATUS_MAINTENANCE
+        if self.running:
+            return STATUS_RUNNING
+        if self.flags & FLAG_CRITICAL_FAILURE:
+            return STATUS_ALERT
+        return STATUS_IDLE
+
+    def key(self):
+        return self.status, self.flags, self.timestamp, self.values
+
+def encode_frame(version, states, generated_at=None):
+    """Header plus one record per (machine id, MachineState), as bytes"""
+    frame = bytearray(HEADER.size + RECORD.size * len(states))
+    HEADER.pack_into(frame, 0, MAGIC, LAYOUT_VERSION, len(states), version,
+                     generated_at if generated_at is not None else time.time())
+    offset = HEADER.size
+    for machine_id, state in states:
+        RECORD.pack_into(frame, offset, machine_id.encode()[:16], state.status, state.flags, 0,
+                         math.nan if state.timestamp is None else state.timestamp, *state.values)
+        offset += RECORD.size
+    return bytes(frame)
+
+def decode_frame(frame):
+    """(snapshot version, generated at, [record dicts]); the reference reader"""
+    magic, layout, count, version, generated_at = HEADER.unpack_from(frame, 0)
+    if magic != MAGIC or layout != LAYOUT_VERSION:
+        raise ValueError(f"Not a layout {LAYOUT_VERSION} twin frame")
+    records = []
+    for i in range(count):
+        machine_id, status, flags, _, ts, *values = RECORD.unpack_from(frame, HEADER.size + i * RECORD.size)
+        records.append(dict(zip(TWIN_FIELDS, values), machineId=machine_id.rstrip(b'\0').decode(),
+                            status=status, flags=flags, timestamp=ts))
+    return version, generated_at, records
+
+class TwinFeed:
+    def __init__(self, refresh_interval=TWIN_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._states = {}  # machine id -> MachineState, registry order
+        self._version = 0
+        self._frame = None  # (version, bytes)
+        self._changed = Condition()
+        self._start_lock = Lock()
+        self._poller = None
+        subscribe('job_started', lambda event: self._update(event['machineId'], running=True))
+        subscribe('job_finished', lambda event: self._update(event['machineId'], running=False))
+
+    def _update(self, machine_id, **changes):
+        if self._poller is None:
+            return  # nobody has asked for the feed in this process
+        with self._changed:
+            state = self._states.get(machine_id)
+            if state is None:
+                return
+            changed = False
+            for name, value in changes.items():
+                if getattr(state, name) != value:
+                    setattr(state, name, value)
+                    changed = True
+            if changed:
+                self._version += 1
+                self._changed.notify_all()
+
+    def record(self, machine_id, reading):
+        """Called from the simulator write path"""
+        timestamp, values, flags = reading_state(reading)
+        self._update(machine_id, timestamp=timestamp, values=values, flags=flags)
+
+    def refresh(self, now=None):
+        """Rebuild every machine's state from the store (one pass per interval)"""
+        now = now or datetime.utcnow()
+        store = get_store()
+        machines = registry.machines(include_inactive=True)
+        latest = fleet_map(lambda m: (store.readings.latest(m), store.jobs.has_ongoing(m)), machines)
+        states = {}
+        with self._changed:
+            for machine, (reading, running) in zip(machines, latest):
+                state = states[machine.id] = MachineState(machine.active)
+                state.running = running
+                state.maintenance = maintenance_schedule.is_under_maintenance(machine.id, now)
+                state.timestamp, state.values, state.flags = reading_state(reading)
+                # A reading recorded here may not be in the store yet (batched writes)
+                known = self._states.get(machine.id)
+                if known is not None and (known.timestamp or 0) > (state.timestamp or 0):
+                    state.timestamp, state.values, state.flags = known.timestamp, known.values, known.flags
+            old = self._states
+            if list(old) != list(states) or any(old[k].key() != s.key() for k, s in states.items()):
+                self._states = states
+                self._version += 1
+                self._changed.notify_all()
+
+    def _poll(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️ Twin feed refresh failed: {e}")
+
+    def _ensure_started(self):
+        if self._poller is not None:
+            return
+        with self._start_lock:
+            if self._poller is None:
+                self.refresh()
+                self._poller = Thread(target=self._poll, daemon=True, name="twin-poller")
+                self._poller.start()
+
+    def frame(self):
+        """(snapshot version, frame bytes), encoded once per version"""
+        self._ensure_started()
+        with self._changed:
+            if self._frame is None or self._frame[0] != self._version:
+                self._frame = (self._version, encode_frame(self._version, list(self._states.items())))
+            return self._frame
+
+    def wait(self, since, timeout):
+        """Block until the version moves past `since` or `timeout` passes; the version"""
+        self._ensure_started()
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while self._version == since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            return self._version
+
+feed = TwinFeed()
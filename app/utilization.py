@@ -0,0 +1,351 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from threading import Thread, Lock
+from app.storage import get_store
+from app.registry import registry, fleet_map
+from app.events import subscribe
+import os
+import time
+
+# Utilization engine behind /api/utilization and the analytics panel. Per
+# machine it keeps every finished job run as a sorted, non-overlapping
+# interval with prefix sums of busy time, alert time, completed runs and
+# estimated/actual minutes, plus the open run of the ongoing job and the
+# machine's maintenance windows. "How much busy/alert/maintenance/idle time in
+# [start, end]" is then two bisects and a few subtractions per machine, however
+# much history there is; a bucketed query (by hour, shift, day or week) does
+# the bisects for every bucket edge at once with numpy's searchsorted.
+#
+#   busy         runs of jobs that completed (or are still running)
+#   alert        runs of jobs that ended in an alert or failed
+#   maintenance  booked maintenance windows, minus any run inside them
+#   idle         the rest of the window (up to now)
+#
+# Runs arrive through the job_started / job_finished events; the whole index
+# is rebuilt from the job collections every UTILIZATION_REFRESH_INTERVAL
+# seconds to pick up jobs that finished in other processes (farm workers).
+REFRESH_INTERVAL = float(os.getenv('UTILIZATION_REFRESH_INTERVAL', '300'))
+SHIFT_START_HOUR = int(os.getenv('SHIFT_START_HOUR', '6'))
+SHIFT_HOURS = int(os.getenv('SHIFT_HOURS', '8'))
+MAX_BUCKETS = 1000
+MAINTENANCE_VERSION_ID = "windows"
+
+EPOCH = datetime(1970, 1, 1)
+HOUR = 3600
+# bucket -> (length, offset from the epoch of the first boundary), in seconds
+BUCKETS = {
+    'hour': (HOUR, 0),
+    'shift': (SHIFT_HOURS * HOUR, SHIFT_START_HOUR * HOUR),
+    'day': (24 * HOUR, 0),
+    'week': (7 * 24 * HOUR, 4 * 24 * HOUR)  # 1970-01-05 was a Monday
+}
+
+def to_seconds(dt):
+    return (dt - EPOCH).total_seconds()
+
+def from_seconds(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+def run_state(status):
+    return 'alert' if status in ('alert_triggered', 'failed') else 'busy'
+
+class RunIndex:
+    """Disjoint [start, end) intervals of one machine, sorted, with prefix sums"""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.states = []
+        self._rows = []  # (estimated minutes, actual minutes, completed) per interval
+        self._prefix = {'busy': [0.0], 'alert': [0.0], 'completed': [0], 'estimated': [0.0], 'actual': [0.0]}
+        self._arrays = None
+
+    def _append_prefix(self, i):
+        duration = self.ends[i] - self.starts[i]
+        estimated, actual, completed = self._rows[i]
+        p = self._prefix
+        p['busy'].append(p['busy'][-1] + (duration if self.states[i] == 'busy' else 0.0))
+        p['alert'].append(p['alert'][-1] + (duration if self.states[i] == 'alert' else 0.0))
+        p['completed'].append(p['completed'][-1] + completed)
+        p['estimated'].append(p['estimated'][-1] + estimated)
+        p['actual'].append(p['actual'][-1] + actual)
+
+    def add(self, start, end, state, estimated=0.0, actual=0.0, completed=False):
+        i = bisect_right(self.starts, start)
+        # Clip against the neighbours so the intervals stay disjoint (jobs that
+        # overlapped before the queue kept one job per lathe)
+        if i > 0:
+            start = max(start, self.ends[i - 1])
+        if i < len(self.starts):
+            end = min(end, self.starts[i])
+        if end <= start:
+            return
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.states.insert(i, state)
+        self._rows.insert(i, (estimated or 0.0, actual or 0.0, int(completed)))
+        self._arrays = None
+        if i == len(self.starts) - 1:
+            self._append_prefix(i)
+        else:
+            for values in self._prefix.values():
+                del values[1:]
+            for j in range(len(self.starts)):
+                self._append_prefix(j)
+
+    def before(self, t):
+        """(busy, alert) seconds of all runs up to t"""
+        i = bisect_left(self.starts, t)
+        busy, alert = self._prefix['busy'][i], self._prefix['alert'][i]
+        if i and self.ends[i - 1] > t:
+            overhang = self.ends[i - 1] - t
+            if self.states[i - 1] == 'busy':
+                busy -= overhang
+            else:
+                alert -= overhang
+        return busy, alert
+
+    def covered(self, a, b):
+        """Busy plus alert seconds inside [a, b]"""
+        busy_a, alert_a = self.before(a)
+        busy_b, alert_b = self.before(b)
+        return (busy_b - busy_a) + (alert_b - alert_a)
+
+    def arrays(self):
+        """numpy copies of the intervals and prefix sums, rebuilt after a change"""
+        if self._arrays is None:
+            import numpy as np  # deferred like app/recent.py: only processes that answer queries pay for it
+            p = self._prefix
+            self._arrays = (np.array(self.starts, dtype=np.float64), np.array(self.ends, dtype=np.float64),
+                            np.array([state == 'busy' for state in self.states], dtype=bool),
+                            np.array([p['busy'], p['alert'], p['completed'], p['estimated'], p['actual']],
+                                     dtype=np.float64))
+        return self._arrays
+
+    def before_many(self, t):
+        """before() and runs/completed/estimated/actual ended by t, for an array of times"""
+        import numpy as np
+        starts, ends, busy_flags, prefix = self.arrays()
+        i = np.searchsorted(starts, t, side='left')
+        busy, alert = prefix[0][i], prefix[1][i]
+        if len(starts):
+            # The run in progress at t only counts up to t
+            prev = np.maximum(i - 1, 0)
+            overhang = np.where(i > 0, np.maximum(ends[prev] - t, 0.0), 0.0)
+            busy = busy - np.where(busy_flags[prev], overhang, 0.0)
+            alert = alert - np.where(busy_flags[prev], 0.0, overhang)
+        k = np.searchsorted(ends, t, side='right')
+        return np.stack([busy, alert, k.astype(np.float64), prefix[2][k], prefix[3][k], prefix[4][k]])
+
+# A usage row: seconds busy/alert/maintenance/idle and the window length, then
+# the runs that ended in the window and their OEE inputs
+USAGE_KEYS = ('busy', 'alert', 'maintenance', 'idle', 'span', 'runs', 'completed', 'estimated', 'actual')
+
+class MachineTimeline:
+    def __init__(self):
+        self.runs = RunIndex()
+        self.open_run = None  # start (seconds) of the ongoing job
+        self.maintenance = RunIndex()
+
+    def add_run(self, job):
+        start = job.get('startTime')
+        if start is None:
+            return
+        status = job.get('status')
+        end = job.get('endTime') or job.get('alertTime')
+        if status == 'ongoing' or end is None:
+            if status == 'ongoing':
+                self.open_run = max(self.open_run or 0.0, to_seconds(start))
+            return
+        self.runs.add(to_seconds(start), to_seconds(end), run_state(status),
+                      job.get('estimatedTime') if status == 'completed' else 0.0,
+                      job.get('actualDuration') if status == 'completed' else 0.0,
+                      status == 'completed')
+
+    def _maintenance(self, a, b):
+        """Booked maintenance inside [a, b] that no job ran through"""
+        windows = self.maintenance
+        total = 0.0
+        for k in range(bisect_right(windows.ends, a), bisect_left(windows.starts, b)):
+            lo, hi = max(a, windows.starts[k]), min(b, windows.ends[k])
+            total += (hi - lo) - self.runs.covered(lo, hi)
+        return total
+
+    def usage(self, edges, now):
+        """Usage rows (buckets x USAGE_KEYS) for the buckets between consecutive edges, clipped at now"""
+        import numpy as np
+        edges = np.minimum(np.asarray(edges, dtype=np.float64), now)
+        marks = self.runs.before_many(edges)
+        if self.open_run is not None:
+            marks[0] += np.maximum(edges - self.open_run, 0.0)
+        busy, alert, runs, completed, estimated, actual = np.diff(marks, axis=1)
+        span = np.diff(edges)
+        maintenance = np.zeros(len(span))
+        if self.maintenance.starts:
+            for k in range(len(span)):
+                if span[k] > 0:
+                    maintenance[k] = self._maintenance(edges[k], edges[k + 1])
+        idle = np.maximum(span - busy - alert - maintenance, 0.0)
+        return np.stack([busy, alert, maintenance, idle, span, runs, completed, estimated, actual], axis=1)
+
+def summarize_usage(row):
+    """Round the seconds and add utilization and the OEE factors"""
+    busy, alert, maintenance, idle, span, runs, completed, estimated, actual = row
+    runs, completed = int(round(runs)), int(round(completed))
+    planned = span - maintenance
+    availability = (busy + alert) / planned if planned > 0 else 0.0
+    performance = min(1.0, estimated / actual) if actual > 0 else None
+    quality = completed / runs if runs else None
+    oee = availability * performance * quality if performance is not None and quality is not None else None
+    return {
+        'busy': round(busy, 1),
+        'alert': round(alert, 1),
+        'maintenance': round(maintenance, 1),
+        'idle': round(idle, 1),
+        'utilization': round(busy / span, 4) if span else 0.0,
+        'runs': runs,
+        'completed': completed,
+        'availability': round(availability, 4),
+        'performance': round(performance, 4) if performance is not None else None,
+        'quality': round(quality, 4) if quality is not None else None,
+        'oee': round(oee, 4) if oee is not None else None
+    }
+
+def bucket_edges(start, end, bucket):
+    """Boundaries (seconds) splitting [start, end] into hour/shift/day/week buckets"""
+    length, offset = BUCKETS[bucket]
+    edges = [start]
+    boundary = (start - offset) // length * length + offset + length
+    while boundary < end:
+        edges.append(boundary)
+        boundary += length
+        if len(edges) > MAX_BUCKETS:
+            raise ValueError(f"More than {MAX_BUCKETS} {bucket} buckets; use a larger bucket")
+    edges.append(end)
+    return edges
+
+class UtilizationIndex:
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._machines = {}  # machine id -> MachineTimeline
+        self._maintenance_version = None
+        self._replay = None  # events that arrive while a rebuild is running
+        self._lock = Lock()
+        self._load_lock = Lock()
+        self._start_lock = Lock()
+        self._poller = None
+        subscribe('job_started', self._on_started)
+        subscribe('job_finished', self._on_finished)
+
+    def _apply(self, machines, kind, event):
+        timeline = machines.get(event['machineId'])
+        if timeline is None:
+            return
+        if kind == 'started':
+            timeline.open_run = to_seconds(event.get('startTime') or datetime.utcnow())
+        else:
+            timeline.open_run = None
+            timeline.add_run(event)
+
+    def _on_event(self, kind, event):
+        with self._lock:
+            self._apply(self._machines, kind, event)
+            if self._replay is not None:
+                self._replay.append((kind, event))
+
+    def _on_started(self, event):
+        self._on_event('started', event)
+
+    def _on_finished(self, event):
+        self._on_event('finished', event)
+
+    def _load(self):
+        with self._load_lock:
+            with self._lock:
+                self._replay = []
+            store = get_store()
+            machines = registry.machines(include_inactive=True)
+            timelines = {m.id: MachineTimeline() for m in machines}
+            for machine, runs in zip(machines, fleet_map(store.jobs.runs, machines)):
+                for job in sorted(runs, key=lambda j: j.get('startTime') or EPOCH):
+                    timelines[machine.id].add_run(job)
+            self._load_maintenance(timelines, force=True)
+            with self._lock:
+                for kind, event in self._replay:
+                    self._apply(timelines, kind, event)
+                self._machines, self._replay = timelines, None
+
+    def _load_maintenance(self, timelines=None, force=False):
+        store = get_store()
+        version = store.versions.get(MAINTENANCE_VERSION_ID)
+        if version == self._maintenance_version and not force:
+            return
+        by_machine = {}
+        for w in store.maintenance.find():
+            by_machine.setdefault(w['machineId'], []).append((to_seconds(w['start']), to_seconds(w['end'])))
+        with self._lock:
+            for machine_id, timeline in (timelines or self._machines).items():
+                index = RunIndex()
+                # Merge overlapping bookings first; add() would clip, not merge
+                merged = []
+                for start, end in sorted(by_machine.get(machine_id, ())):
+                    if merged and start <= merged[-1][1]:
+                        merged[-1][1] = max(merged[-1][1], end)
+                    else:
+                        merged.append([start, end])
+                for start, end in merged:
+                    index.add(start, end, 'maintenance')
+                timeline.maintenance = index
+        self._maintenance_version = version
+
+    def _poll(self):
+        last_rebuild = time.monotonic()
+        while True:
+            time.sleep(min(self.refresh_interval, 5))
+            try:
+                if time.monotonic() - last_rebuild >= self.refresh_interval:
+                    self._load()
+                    last_rebuild = time.monotonic()
+                else:
+                    self._load_maintenance()
+            except Exception as e:
+                print(f"⚠️ Utilization index refresh failed: {e}")
+
+    def _ensure_loaded(self):
+        if self._poller is not None:
+            return
+        with self._start_lock:
+            if self._poller is not None:
+                return
+            self._load()
+            self._poller = Thread(target=self._poll, daemon=True, name="utilization-poller")
+            self._poller.start()
+
+    def query(self, machine_ids, start, end, bucket=None, now=None):
+        """Usage per machine and for the whole set over [start, end], optionally per bucket"""
+        import numpy as np
+        self._ensure_loaded()
+        now = to_seconds(now or datetime.utcnow())
+        a, b = to_seconds(start), to_seconds(end)
+        edges = bucket_edges(a, b, bucket) if bucket else [a, b]
+        with self._lock:
+            rows = {m: self._machines[m].usage(edges, now) for m in machine_ids if m in self._machines}
+        ids = list(rows)
+        # machines x buckets x USAGE_KEYS
+        grid = np.stack([rows[m] for m in ids]) if ids else np.zeros((0, len(edges) - 1, len(USAGE_KEYS)))
+        result = {
+            'machines': dict(zip(ids, map(summarize_usage, grid.sum(axis=1).tolist()))),
+            'fleet': summarize_usage(grid.sum(axis=(0, 1)).tolist())
+        }
+        if bucket:
+            per_bucket = grid.sum(axis=0).tolist()
+            spans = grid[:, :, 4]
+            machine_utilization = np.round(np.divide(grid[:, :, 0], spans, out=np.zeros_like(spans),
+                                                     where=spans > 0), 4).T.tolist()
+            result['series'] = [dict(summarize_usage(per_bucket[k]),
+                                     start=from_seconds(lo).isoformat(), end=from_seconds(hi).isoformat(),
+                                     machines=dict(zip(ids, machine_utilization[k])))
+                                for k, (lo, hi) in enumerate(zip(edges, edges[1:]))]
+        return result
+
+utilization = UtilizationIndex()
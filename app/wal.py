@@ -0,0 +1,398 @@
+from threading import Thread, Condition, Lock
+from app.storage import get_store
+from app.registry import registry
+import json
+import mmap
+import os
+import shutil
+import struct
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock on the log directory
+    fcntl = None
+
+# Write-ahead log for sensor readings (SENSOR_WAL=1). The simulator appends
+# each reading to a local log and moves on; a forwarder thread drains the log
+# into the store with one bulk write per batch. A slow or unreachable
+# database no longer fails jobs or loses readings: they wait on disk, and the
+# forwarder retries with backoff until it gets through.
+#
+# The log is a directory of fixed-size, preallocated, memory-mapped segments
+# (SENSOR_WAL_SEGMENT_MB each). A record is a length, a CRC32 and the BSON of
+# {machine id, reading}; a zero length ends a segment's data. After each
+# forwarded batch a checkpoint file records how far the store has it, and
+# segments wholly before the checkpoint are deleted. After a crash the
+# forwarder starts again from the checkpoint; the store skips anything it
+# already has (readings.store_many), so nothing is written twice.
+#
+# SENSOR_WAL_FSYNC: "always" (msync after every record), "interval" (every
+# SENSOR_WAL_FSYNC_INTERVAL seconds, the default) or "never" (leave it to the
+# OS). A record is in the page cache as soon as append returns, so only a
+# machine crash, not a process crash, can lose the unsynced tail.
+#
+# Backpressure: a new segment is only created while the log is under
+# SENSOR_WAL_MAX_MB and the disk has SENSOR_WAL_MIN_FREE_MB free. Otherwise
+# append blocks until the forwarder frees a segment (which slows the
+# simulations feeding it), and raises WalFull after SENSOR_WAL_BLOCK_TIMEOUT.
+#
+# Each process takes its own log directory (SENSOR_WAL_DIR/main, then main-1,
+# ... when another process holds the lock). drain_sensor_wal.py forwards logs
+# no running process holds.
+SENSOR_WAL = os.getenv('SENSOR_WAL', '0') == '1'
+SENSOR_WAL_DIR = os.getenv('SENSOR_WAL_DIR', 'wal')
+SEGMENT_BYTES = int(float(os.getenv('SENSOR_WAL_SEGMENT_MB', '64')) * 1024 * 1024)
+FSYNC = os.getenv('SENSOR_WAL_FSYNC', 'interval')
+FSYNC_INTERVAL = float(os.getenv('SENSOR_WAL_FSYNC_INTERVAL', '1'))
+MAX_BYTES = int(float(os.getenv('SENSOR_WAL_MAX_MB', '2048')) * 1024 * 1024)
+MIN_FREE_BYTES = int(float(os.getenv('SENSOR_WAL_MIN_FREE_MB', '512')) * 1024 * 1024)
+BLOCK_TIMEOUT = float(os.getenv('SENSOR_WAL_BLOCK_TIMEOUT', '60'))
+FORWARD_BATCH = int(os.getenv('SENSOR_WAL_BATCH', '1000'))
+FORWARD_INTERVAL = float(os.getenv('SENSOR_WAL_FORWARD_INTERVAL', '0.5'))
+MAX_RETRY_DELAY = 30
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+SEGMENT_MAGIC = b'LWAL\x01\x00\x00\x00'  # magic, format version 1, padding
+RECORD_HEADER = struct.Struct('<II')  # payload length, CRC32 of the payload
+SEGMENT_SUFFIX = '.seg'
+CHECKPOINT_FILE = 'checkpoint'
+
+class WalFull(Exception):
+    """The log stayed over its size or disk budget for BLOCK_TIMEOUT seconds"""
+
+def _segment_name(number):
+    return f"{number:010d}{SEGMENT_SUFFIX}"
+
+def segment_numbers(directory):
+    return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                  if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+def scan(data, offset):
+    """Yield (offset after, payload) for each intact record from `offset` until
+    the end marker, a torn record or the end of `data`"""
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size + length
+        if length == 0 or end > len(data):
+            return
+        payload = bytes(data[offset + RECORD_HEADER.size:end])
+        if zlib.crc32(payload) != crc:
+            return
+        yield end, payload
+        offset = end
+
+def read_checkpoint(directory):
+    """(segment, offset) the store has everything before, or None"""
+    try:
+        with open(os.path.join(directory, CHECKPOINT_FILE)) as f:
+            doc = json.load(f)
+        return doc['segment'], doc['offset']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def write_checkpoint(directory, position):
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'segment': position[0], 'offset': position[1]}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+def lock_directory(directory):
+    """An open lock file if no other process holds `directory`, else None"""
+    os.makedirs(directory, exist_ok=True)
+    handle = open(os.path.join(directory, 'lock'), 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+    return handle
+
+class WriteAheadLog:
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, fsync=FSYNC, fsync_interval=FSYNC_INTERVAL,
+                 max_bytes=MAX_BYTES, min_free_bytes=MIN_FREE_BYTES, block_timeout=BLOCK_TIMEOUT):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"SENSOR_WAL_FSYNC must be one of {', '.join(FSYNC_POLICIES)}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.block_timeout = block_timeout
+        self._changed = Condition()  # appends, syncs and freed segments
+        self._file = None
+        self._map = None
+        self._synced = 0
+        self.appended = 0
+
+        numbers = segment_numbers(directory)
+        if numbers:
+            self._open_segment(numbers[-1])
+            end = len(SEGMENT_MAGIC)
+            for end, _ in scan(self._map, end):
+                pass
+            # Clear whatever a crash left past the last intact record
+            self._map[end:] = bytes(len(self._map) - end)
+            self._offset = self._synced = end
+        else:
+            self._create_segment(1)
+        self.first_segment = numbers[0] if numbers else 1
+        if self.fsync == 'interval':
+            Thread(target=self._sync_periodically, daemon=True, name="wal-sync").start()
+
+    # ---- segments ----
+
+    def _open_segment(self, number):
+        path = os.path.join(self.directory, _segment_name(number))
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self.segment = number
+
+    def _create_segment(self, number):
+        path = os.path.join(self.directory, _segment_name(number))
+        try:
+            with open(path, 'wb') as f:
+                if hasattr(os, 'posix_fallocate'):
+                    # Reserve the blocks now: running out of disk under a mapping is a SIGBUS
+                    os.posix_fallocate(f.fileno(), 0, self.segment_bytes)
+                else:
+                    f.truncate(self.segment_bytes)
+                f.write(SEGMENT_MAGIC)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            os.remove(path)
+            raise
+        self._open_segment(number)
+        self._offset = self._synced = len(SEGMENT_MAGIC)
+
+    def _has_room(self):
+        on_disk = (self.segment - self.first_segment + 2) * self.segment_bytes
+        return on_disk <= self.max_bytes and shutil.disk_usage(self.directory).free >= self.min_free_bytes
+
+    def _make_room(self, size):
+        """Start a new segment if `size` more bytes don't fit, waiting while the
+        log is over budget (lock held; the wait releases it)"""
+        deadline = time.monotonic() + self.block_timeout
+        # Keep room for the zero header that ends the segment
+        while self._offset + size + RECORD_HEADER.size > self.segment_bytes:
+            if self._has_room():
+                self._sync()
+                try:
+                    self._create_segment(self.segment + 1)
+                    continue
+                except OSError as e:
+                    print(f"⚠️ Sensor WAL could not start a segment: {e}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise WalFull(f"Sensor WAL in {self.directory} is full; the forwarder is behind")
+            self._changed.wait(min(remaining, 1.0))
+
+    def release(self, before_segment):
+        """Delete segments the store has everything of (numbers below `before_segment`)"""
+        with self._changed:
+            upto = min(before_segment, self.segment)
+            for number in range(self.first_segment, upto):
+                try:
+                    os.remove(os.path.join(self.directory, _segment_name(number)))
+                except FileNotFoundError:
+                    pass
+            self.first_segment = max(self.first_segment, upto)
+            self._changed.notify_all()
+
+    # ---- writes ----
+
+    def append(self, machine_id, reading):
+        """Log one reading; (segment, offset) just past it"""
+        import bson
+        payload = bson.encode({'m': machine_id, 'r': reading})
+        size = RECORD_HEADER.size + len(payload)
+        if size + RECORD_HEADER.size > self.segment_bytes - len(SEGMENT_MAGIC):
+            raise ValueError(f"Reading of {size} bytes doesn't fit in a WAL segment")
+        with self._changed:
+            self._make_room(size)
+            offset = self._offset
+            self._map[offset + RECORD_HEADER.size:offset + size] = payload
+            RECORD_HEADER.pack_into(self._map, offset, len(payload), zlib.crc32(payload))
+            self._offset = offset + size
+            self.appended += 1
+            if self.fsync == 'always':
+                self._sync()
+            self._changed.notify_all()
+            return self.segment, self._offset
+
+    def _sync(self):
+        if self._offset > self._synced:
+            start = self._synced - self._synced % mmap.ALLOCATIONGRANULARITY
+            self._map.flush(start, self._offset - start)
+            self._synced = self._offset
+
+    def sync(self):
+        with self._changed:
+            self._sync()
+
+    def _sync_periodically(self):
+        while not self._map.closed:
+            time.sleep(self.fsync_interval)
+            try:
+                self.sync()
+            except (ValueError, OSError) as e:
+                print(f"⚠️ Sensor WAL sync failed: {e}")
+
+    def position(self):
+        with self._changed:
+            return self.segment, self._offset
+
+    # ---- reads ----
+
+    def read(self, position, limit):
+        """(up to `limit` (machine id, reading) from `position` on, the position after them)"""
+        import bson
+        segment, offset = position
+        with self._changed:
+            end = (self.segment, self._offset)
+        records = []
+        while len(records) < limit and (segment, offset) < end:
+            with open(os.path.join(self.directory, _segment_name(segment)), 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    view = memoryview(data)[:end[1] if segment == end[0] else len(data)]
+                    try:
+                        for offset, payload in scan(view, offset):
+                            doc = bson.decode(payload)
+                            records.append((doc['m'], doc['r']))
+                            if len(records) >= limit:
+                                break
+                    finally:
+                        view.release()
+            if len(records) >= limit or segment >= end[0]:
+                break
+            # A sealed segment read to its end marker
+            segment, offset = segment + 1, len(SEGMENT_MAGIC)
+        return records, (segment, offset)
+
+    def wait(self, position, timeout):
+        """Block until something is appended past `position` or `timeout` passes"""
+        with self._changed:
+            if (self.segment, self._offset) <= tuple(position):
+                self._changed.wait(timeout)
+
+    def close(self):
+        with self._changed:
+            self._sync()
+            self._map.close()
+            self._file.close()
+
+class Forwarder:
+    """Drains a WriteAheadLog into the store, checkpointing after each batch"""
+
+    def __init__(self, log, store=None, batch_size=FORWARD_BATCH, interval=FORWARD_INTERVAL):
+        self.log = log
+        self.store = store
+        self.batch_size = batch_size
+        self.interval = interval
+        self.forwarded = 0
+        self.failures = 0
+        self._done = Condition()
+        start = (log.first_segment, len(SEGMENT_MAGIC))
+        self.position = max(read_checkpoint(log.directory) or start, start)
+
+    def forward_batch(self):
+        """Forward what the log has past the checkpoint (one batch); the readings sent"""
+        records, position = self.log.read(self.position, self.batch_size)
+        if not records:
+            if position != self.position:
+                self._advance(position, 0)
+            return 0
+        by_machine = {}
+        for machine_id, reading in records:
+            by_machine.setdefault(machine_id, []).append(reading)
+        store = self.store or get_store()
+        for machine_id, readings in by_machine.items():
+            machine = registry.get(machine_id)
+            if machine is None:
+                print(f"⚠️ Sensor WAL: dropping {len(readings)} readings of unknown machine {machine_id}")
+                continue
+            store.readings.add_many(machine, readings)
+        self._advance(position, len(records))
+        return len(records)
+
+    def _advance(self, position, forwarded):
+        with self._done:
+            self.position = position
+            self.forwarded += forwarded
+            self._done.notify_all()
+        write_checkpoint(self.log.directory, position)
+        self.log.release(position[0])
+
+    def run(self, stop=None):
+        delay = self.interval
+        while stop is None or not stop():
+            try:
+                sent = self.forward_batch()
+                delay = self.interval
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ Sensor WAL forward failed, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            if not sent:
+                self.log.wait(self.position, self.interval)
+            elif sent < self.batch_size:
+                time.sleep(self.interval)  # let the next batch fill up
+
+    def wait_forwarded(self, position, timeout):
+        """Block until the store has everything before `position`; False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._done:
+            while tuple(self.position) < tuple(position):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._done.wait(remaining)
+            return True
+
+def open_log(base=SENSOR_WAL_DIR, name='main', attempts=16):
+    """(WriteAheadLog, lock handle) in the first of base/name, base/name-1, ... nobody holds"""
+    for i in range(attempts):
+        directory = os.path.join(base, name if i == 0 else f"{name}-{i}")
+        handle = lock_directory(directory)
+        if handle is not None:
+            return WriteAheadLog(directory), handle
+    raise RuntimeError(f"No free sensor WAL directory under {base}")
+
+_log = None
+_forwarder = None
+_lock_handle = None
+_start_lock = Lock()
+
+def get_log():
+    """This process's log, with its forwarder running; None unless SENSOR_WAL=1"""
+    global _log, _forwarder, _lock_handle
+    if not SENSOR_WAL:
+        return None
+    if _log is None:
+        with _start_lock:
+            if _log is None:
+                log, _lock_handle = open_log()
+                _forwarder = Forwarder(log)
+                Thread(target=_forwarder.run, daemon=True, name="wal-forwarder").start()
+                print(f"📝 Sensor WAL at {log.directory} (fsync={log.fsync})")
+                _log = log
+    return _log
+
+def settle(timeout, position=None):
+    """Wait up to `timeout` for the store to have this process's log up to
+    `position` (an append's return value; default: all of it)"""
+    log = get_log()
+    if log is None:
+        return True
+    return _forwarder.wait_forwarded(position or log.position(), timeout)
@@ -0,0 +1,60 @@
+"""Write the per-job summary (app/job_summary.py) and similarity signature
+(app/similarity.py) onto jobs that don't have them.
+
+    python backfill_job_summaries.py [--machines LATHE-01,LATHE-02] [--force]
+
+Each finished job's readings are streamed once, bounded by its start and end
+time, and folded into the same accumulator the simulator uses. Ongoing jobs
+are skipped; their simulation writes the summary when it finishes. --force
+recomputes jobs that already have both (e.g. after changing
+JOB_SUMMARY_THRESHOLD or SIGNATURE_POINTS).
+"""
+import argparse
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.job_summary import summarize, job_readings, SUMMARY_THRESHOLD
+from app.similarity import signature, SIGNATURE_DIM
+from app.registry import registry
+from app.storage import get_store
+
+
+def backfill_machine(store, machine, force, threshold):
+    updated = 0
+    for job in store.jobs.history(machine):
+        # [] marks a job too short for a signature
+        has_signature = job.get('signature') == [] or len(job.get('signature') or ()) == SIGNATURE_DIM
+        if job.get('status') == 'ongoing' or (job.get('summary') and has_signature and not force):
+            continue
+        readings = list(job_readings(store, machine, job))
+        fields = {"summary": summarize(readings, threshold)}
+        vector = signature(readings)
+        fields["signature"] = [] if vector is None else [round(float(v), 5) for v in vector]
+        store.jobs.update(machine, job['_id'], fields)
+        updated += 1
+    return updated
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--machines', help='comma-separated machine ids (default: whole registry)')
+    parser.add_argument('--force', action='store_true', help='recompute summaries and signatures that already exist')
+    parser.add_argument('--threshold', type=float, default=SUMMARY_THRESHOLD,
+                        help='failureProbability threshold for secondsAboveThreshold')
+    args = parser.parse_args()
+
+    store = get_store()
+    machines = registry.machines(include_inactive=True)
+    if args.machines:
+        wanted = set(args.machines.split(','))
+        machines = [m for m in machines if m.id in wanted]
+
+    for machine in machines:
+        started = time.perf_counter()
+        count = backfill_machine(store, machine, args.force, args.threshold)
+        print(f"✅ {machine.id}: {count} job summaries written in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
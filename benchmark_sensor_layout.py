@@ -0,0 +1,120 @@
+"""Compare the per-reading and bucketed sensor layouts on a live MongoDB.
+
+    python benchmark_sensor_layout.py --readings 50000 --machines 4 --batch 1
+
+Writes the same synthetic readings (5 s apart, one job per machine) into both
+layouts in a scratch database, then reports write throughput, document
+count, storage and index size, and the latency of the read adapters the app
+uses. --batch > 1 sends writes in bulk_write batches like a farm worker does.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from pymongo import InsertOne, UpdateOne
+
+load_dotenv()
+
+from app import readings
+from app.db import get_client
+
+
+def synthetic_readings(machine_index, count, start):
+    rng = random.Random(machine_index)
+    machine_id = f"LATHE-{machine_index:02d}"
+    for i in range(count):
+        yield {
+            "machineId": machine_id,
+            "jobId": f"BENCH-{machine_index}",
+            "timestamp": start + timedelta(seconds=5 * i),
+            "airTemperature": round(rng.gauss(298, 3), 2),
+            "processTemperature": round(rng.gauss(650, 10), 2),
+            "rotationalSpeed": round(rng.gauss(1000, 30), 1),
+            "torque": round(rng.gauss(25, 2), 2),
+            "toolWear": round(i * 0.004, 2),
+            "failureProbability": rng.random() * 0.3
+        }
+
+def write(collections, layout, docs, batch):
+    target = collections['buckets' if layout == 'bucket' else 'sensor']
+    if batch <= 1:
+        for doc in docs:
+            readings.store(collections, doc, layout=layout)
+        return
+    operations = []
+    for doc in docs:
+        if layout == 'bucket':
+            operations.append(UpdateOne(*readings.bucket_update(doc), upsert=True))
+        else:
+            operations.append(InsertOne(doc))
+        if len(operations) >= batch:
+            target.bulk_write(operations, ordered=True)
+            operations = []
+    if operations:
+        target.bulk_write(operations, ordered=True)
+
+def timed(fn, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readings', type=int, default=50000, help='readings per machine')
+    parser.add_argument('--machines', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--db', default='LayoutBenchmark')
+    args = parser.parse_args()
+
+    client = get_client()
+    client.drop_database(args.db)
+    db = client[args.db]
+    start = datetime(2025, 1, 6, 6, 0)
+    results = {}
+
+    for layout in ('document', 'bucket'):
+        per_machine = []
+        for m in range(1, args.machines + 1):
+            collections = {
+                'sensor': db[f'{layout}_lathe{m}_sensory_data'],
+                'buckets': db[f'{layout}_lathe{m}_sensory_data_buckets']
+            }
+            readings.ensure_indexes(collections)
+            per_machine.append(collections)
+
+        started = time.perf_counter()
+        for m, collections in enumerate(per_machine, 1):
+            write(collections, layout, synthetic_readings(m, args.readings, start), args.batch)
+        write_seconds = time.perf_counter() - started
+
+        name = 'buckets' if layout == 'bucket' else 'sensor'
+        stats = [db.command('collStats', c[name].name) for c in per_machine]
+        sample = per_machine[0]
+        window_start = start + timedelta(seconds=5 * args.readings // 2)
+        results[layout] = {
+            'writes/s': args.readings * args.machines / write_seconds,
+            'documents': sum(s['count'] for s in stats),
+            'data MiB': sum(s['size'] for s in stats) / 2**20,
+            'storage MiB': sum(s['storageSize'] for s in stats) / 2**20,
+            'index MiB': sum(s['totalIndexSize'] for s in stats) / 2**20,
+            'latest ms': timed(lambda: readings.latest(sample, layout=layout)),
+            '1h range ms': timed(lambda: list(readings.between(
+                sample, window_start, window_start + timedelta(hours=1), layout=layout)), 5),
+            'averages ms': timed(lambda: readings.averages(sample, layout=layout), 3)
+        }
+
+    print("=" * 60)
+    print(f"{args.machines} machines x {args.readings} readings, batch {args.batch}")
+    print(f"{'':16}{'document':>14}{'bucket':>14}{'ratio':>10}")
+    for key in results['document']:
+        doc_value, bucket_value = results['document'][key], results['bucket'][key]
+        ratio = bucket_value / doc_value if doc_value else float('nan')
+        print(f"{key:16}{doc_value:>14,.2f}{bucket_value:>14,.2f}{ratio:>10.2f}")
+    print("=" * 60)
+    client.drop_database(args.db)
+
+if __name__ == '__main__':
+    main()
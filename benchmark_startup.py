@@ -0,0 +1,101 @@
+"""Measure cold `import app` time and per-worker RSS, and fail on regressions.
+
+    python benchmark_startup.py --runs 5 --max-import-ms 800 --max-rss-mib 60
+
+Every run is a fresh interpreter, the way a new gunicorn worker or an
+autoreload starts. It reports the median/max import time, RSS after import
+and after the first request, and which heavy modules were loaded. It exits
+non-zero if the median import time or RSS goes over budget, or if any
+--forbid module (numpy, scikit-learn, pymongo, ... by default) is imported
+before the first query or simulation needs it.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ('numpy', 'sklearn', 'scipy', 'pandas', 'pymongo', 'bson', 'multiprocessing', 'gevent')
+
+CHILD = r"""
+import json, resource, sys, time
+started = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - started) * 1000
+import_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+loaded = [m for m in %(heavy)r if m in sys.modules]
+started = time.perf_counter()
+app.app.test_client().get('/login')
+request_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({
+    'import_ms': import_ms, 'import_rss_mib': import_rss, 'loaded': loaded,
+    'first_request_ms': request_ms,
+    'request_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+}))
+"""
+
+def run_child(env):
+    result = subprocess.run([sys.executable, '-c', CHILD % {'heavy': HEAVY_MODULES}],
+                            capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        sys.exit(f"❌ import failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def slowest_imports(env, top):
+    """Top modules by cumulative import time from one `-X importtime` run"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), int(own), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float, default=800)
+    parser.add_argument('--max-rss-mib', type=float, default=60)
+    parser.add_argument('--forbid', default='numpy,sklearn,scipy,pandas,pymongo',
+                        help='modules that must not be loaded by `import app` (comma-separated, empty to skip)')
+    parser.add_argument('--top', type=int, default=10, help='show the N slowest imports')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    runs = [run_child(env) for _ in range(args.runs)]
+    import_ms = [r['import_ms'] for r in runs]
+    rss = [r['import_rss_mib'] for r in runs]
+    loaded = sorted(set().union(*(r['loaded'] for r in runs)))
+
+    print("=" * 60)
+    print(f"Runs               : {args.runs}")
+    print(f"Import time        : median {statistics.median(import_ms):.0f} ms, max {max(import_ms):.0f} ms")
+    print(f"RSS after import   : median {statistics.median(rss):.1f} MiB")
+    print(f"First request      : median {statistics.median(r['first_request_ms'] for r in runs):.0f} ms, "
+          f"RSS {statistics.median(r['request_rss_mib'] for r in runs):.1f} MiB")
+    print(f"Heavy modules      : {', '.join(loaded) or 'none'}")
+    if args.top:
+        print(f"Slowest imports (cumulative / own ms):")
+        for cumulative, own, name in slowest_imports(env, args.top):
+            print(f"  {cumulative / 1000:8.1f} {own / 1000:8.1f}  {name}")
+    print("=" * 60)
+
+    failures = []
+    if statistics.median(import_ms) > args.max_import_ms:
+        failures.append(f"import time {statistics.median(import_ms):.0f} ms > {args.max_import_ms:.0f} ms")
+    if statistics.median(rss) > args.max_rss_mib:
+        failures.append(f"RSS {statistics.median(rss):.1f} MiB > {args.max_rss_mib:.1f} MiB")
+    forbidden = [m for m in args.forbid.split(',') if m and m in loaded]
+    if forbidden:
+        failures.append(f"imported eagerly: {', '.join(forbidden)}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if not failures:
+        print("✅ Startup within budget")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Hold many SSE streams open against a single gevent worker and report its memory.
+
+    python benchmark_streams.py --streams 1000 --user Yash --password op123
+
+Starts `gunicorn -c gunicorn.conf.py wsgi:app` with one worker, logs in once,
+opens N concurrent streams with the same session and samples the worker's RSS
+before and after. Needs the same MongoDB as the app (MONGO_URI) and a user
+created by create_test_users.py.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import gevent
+from gevent.pool import Pool
+
+
+def read_rss_kib(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+def find_worker_pid(master_pid):
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            return int(entry)
+    return None
+
+def http_request(host, port, raw):
+    sock = socket.create_connection((host, port))
+    sock.sendall(raw.encode())
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    head, _, body = data.partition(b'\r\n\r\n')
+    length = re.search(rb'Content-Length: (\d+)', head, re.I)
+    if length:
+        while len(body) < int(length.group(1)):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            body += chunk
+    sock.close()
+    return head.decode(errors='replace'), body.decode(errors='replace')
+
+def login(host, port, user, password):
+    """Log in through the real form (CSRF included) and return the session cookie"""
+    head, body = http_request(host, port, f"GET /login HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n")
+    cookie = re.search(r'Set-Cookie: (session=[^;]+)', head, re.I).group(1)
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', body).group(1)
+    form = f"csrf_token={token}&userID={user}&password={password}"
+    head, _ = http_request(host, port,
+        f"POST /login HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n"
+        f"Content-Type: application/x-www-form-urlencoded\r\nContent-Length: {len(form)}\r\n"
+        f"Connection: close\r\n\r\n{form}")
+    match = re.search(r'Set-Cookie: (session=[^;]+)', head, re.I)
+    if not match or ' 302 ' not in head.splitlines()[0]:
+        raise SystemExit(f"❌ Login failed for {user}")
+    return match.group(1)
+
+def hold_stream(host, port, path, cookie, hold_until, stats):
+    """Open one stream, wait for its first event, then keep draining until hold_until"""
+    try:
+        sock = socket.create_connection((host, port))
+        sock.sendall(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n\r\n".encode())
+        buffered = b''
+        while b'data:' not in buffered:
+            chunk = sock.recv(4096)
+            if not chunk:
+                stats['failed'] += 1
+                return
+            buffered += chunk
+        stats['connected'] += 1
+        while time.time() < hold_until:
+            if not sock.recv(4096):
+                stats['dropped'] += 1
+                return
+        sock.close()
+    except OSError:
+        stats['failed'] += 1
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=1000)
+    parser.add_argument('--path', default='/stream/sensor-data/LATHE-01')
+    parser.add_argument('--user', default='Yash')
+    parser.add_argument('--password', default='op123')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--hold', type=float, default=30, help='seconds to hold all streams open')
+    parser.add_argument('--max-kib-per-stream', type=float, default=256,
+                        help='fail if the worker grows more than this per open stream')
+    args = parser.parse_args()
+
+    host = '127.0.0.1'
+    env = dict(os.environ, BIND=f'{host}:{args.port}', WEB_CONCURRENCY='1',
+               GEVENT_WORKER_CONNECTIONS=str(args.streams + 100))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection((host, args.port)).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise SystemExit("❌ gunicorn did not start")
+                time.sleep(0.2)
+        worker_pid = find_worker_pid(server.pid)
+        cookie = login(host, args.port, args.user, args.password)
+
+        # Warm up imports, the Mongo pool and the first stream before measuring
+        warm = {'connected': 0, 'dropped': 0, 'failed': 0}
+        hold_stream(host, args.port, args.path, cookie, time.time() + 1, warm)
+        baseline_kib = read_rss_kib(worker_pid)
+
+        stats = {'connected': 0, 'dropped': 0, 'failed': 0}
+        hold_until = time.time() + args.hold
+        pool = Pool(args.streams)
+        started = time.time()
+        for _ in range(args.streams):
+            pool.spawn(hold_stream, host, args.port, args.path, cookie, hold_until, stats)
+        while stats['connected'] + stats['failed'] < args.streams and time.time() < hold_until:
+            gevent.sleep(0.1)
+        ramp_seconds = time.time() - started
+        gevent.sleep(max(0, hold_until - time.time() - 1))
+        peak_kib = read_rss_kib(worker_pid)
+        pool.join()
+
+        per_stream = (peak_kib - baseline_kib) / max(1, stats['connected'])
+        print("=" * 50)
+        print(f"Streams requested : {args.streams}")
+        print(f"Streams connected : {stats['connected']} (ramp {ramp_seconds:.1f}s)")
+        print(f"Dropped / failed  : {stats['dropped']} / {stats['failed']}")
+        print(f"Worker RSS        : {baseline_kib / 1024:.1f} MiB -> {peak_kib / 1024:.1f} MiB")
+        print(f"Per stream        : {per_stream:.1f} KiB")
+        print("=" * 50)
+        if stats['connected'] < args.streams or per_stream > args.max_kib_per_stream:
+            sys.exit(1)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+if __name__ == '__main__':
+    main()
@@ -5,5 +5,10 @@ load_dotenv()
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'default-secret-key')
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-SENSOR_INTERVAL = 5
+# Seconds between readings; SAMPLING_MODE=adaptive varies it (app/sampling.py)
+SENSOR_INTERVAL = float(os.getenv('SENSOR_INTERVAL', '5'))
 SIMULATION_TIMEOUT = 300
+# Profile the Mongo commands of every request, or only those sent with
+# X-Query-Profile: 1 (always allowed in debug mode); see app/query_profiler.py
+QUERY_PROFILER = os.getenv('QUERY_PROFILER', '0') == '1'
+QUERY_PROFILER_HEADER = os.getenv('QUERY_PROFILER_HEADER', '0') == '1'
@@ -0,0 +1,35 @@
+"""Add lathes to the machine registry (Fleet.machines).
+
+    python create_machine_registry.py [--count 20] [--start 1] [--plant Main] [--line Line-1]
+
+Each lathe is saved through app/registry.py's register_machine, which also
+creates every index the store uses for it and tells running web workers to
+reload the registry.
+"""
+import argparse
+
+from dotenv import load_dotenv
+
+# Load MONGO_URI from .env
+load_dotenv()
+
+from app.registry import default_machine_doc, register_machine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20, help="number of lathes to register")
+    parser.add_argument("--start", type=int, default=1, help="first lathe number")
+    parser.add_argument("--plant", default="Main")
+    parser.add_argument("--line", default=None, help="line name; defaults to Line-<n> groups of --per-line")
+    parser.add_argument("--per-line", type=int, default=20, help="lathes per generated line")
+    args = parser.parse_args()
+
+    for number in range(args.start, args.start + args.count):
+        line = args.line or f"Line-{(number - 1) // args.per_line + 1}"
+        doc = default_machine_doc(number, plant=args.plant, line=line)
+        register_machine(doc)
+        print(f"Registered {doc['_id']} ({args.plant} / {line})")
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,11 @@
-from pymongo import MongoClient
 from werkzeug.security import generate_password_hash
-from datetime import datetime
-import os
 from dotenv import load_dotenv
 
-# Load MONGO_URI from .env
+# Load MONGO_URI / STORAGE_BACKEND from .env
 load_dotenv()
-mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 
-# Connect to AuthDB
-client = MongoClient(mongo_uri)
-auth_db = client["AuthDB"]
+from app.storage import get_store
+from app.models import bump_users_version
 
 # Define users
 users = [
@@ -46,29 +41,25 @@ users = [
     }
 ]
 
-# Insert users
-for u in users:
-    existing = auth_db.users.find_one({"userID": u["userID"]})
-    if existing:
-        # Update userType and password if changed
-        auth_db.users.update_one(
-            {"userID": u["userID"]},
-            {
-                "$set": {
-                    "userType": u["userType"],
-                    "passwordHash": generate_password_hash(u["password"]),
-                    "employeeId": u["employeeId"]
-                }
-            }
-        )
-        print(f"User {u['userID']} already existed — updated info.")
-    else:
-        auth_db.users.insert_one({
+def create_test_users(store=None):
+    """Insert or update the test users in the active store"""
+    store = store or get_store()
+    for u in users:
+        created = store.users.save({
             "employeeId": u["employeeId"],
             "userID": u["userID"],
             "passwordHash": generate_password_hash(u["password"]),
             "userType": u["userType"],
             "lastLogin": None
         })
-        print(f"User {u['userID']} created successfully.")
+        if created:
+            print(f"User {u['userID']} created successfully.")
+        else:
+            print(f"User {u['userID']} already existed — updated info.")
 
+    # Tell running web workers to drop their cached users (see app/models.py)
+    bump_users_version()
+    print("User cache version bumped.")
+
+if __name__ == '__main__':
+    create_test_users()
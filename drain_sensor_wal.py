@@ -0,0 +1,60 @@
+"""Forward sensor write-ahead logs that no running process holds.
+
+    python drain_sensor_wal.py [--dir wal]
+
+A process forwards its own log (app/wal.py) while it runs. If it crashed,
+or there are fewer processes now than before, readings can be left in a log
+nobody opens again. This forwards each unheld log from its checkpoint into
+the store and exits. Readings the store already has are skipped, so it is
+safe to run at any time.
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app import wal
+
+
+def drain(directory):
+    lock = wal.lock_directory(directory)
+    if lock is None:
+        print(f"⏭️ {directory} is in use by a running process")
+        return 0
+    try:
+        log = wal.WriteAheadLog(directory, fsync='never')
+        forwarder = wal.Forwarder(log)
+        total = 0
+        while True:
+            sent = forwarder.forward_batch()
+            if not sent:
+                break
+            total += sent
+        log.close()
+        return total
+    finally:
+        lock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=wal.SENSOR_WAL_DIR, help='SENSOR_WAL_DIR of the processes that wrote the logs')
+    args = parser.parse_args()
+    if not os.path.isdir(args.dir):
+        parser.error(f"{args.dir} does not exist")
+
+    started = time.perf_counter()
+    total = 0
+    for name in sorted(os.listdir(args.dir)):
+        directory = os.path.join(args.dir, name)
+        if os.path.isdir(directory):
+            sent = drain(directory)
+            if sent:
+                print(f"📤 {directory}: {sent} readings forwarded")
+            total += sent
+    print(f"✅ {total} readings forwarded in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
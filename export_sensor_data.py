@@ -0,0 +1,85 @@
+"""Stream sensor readings to a file or stdout as NDJSON or CSV.
+
+    python export_sensor_data.py --machines LATHE-01,LATHE-02 --from 2025-01-01 --to 2025-02-01 \
+        --format csv --gzip --output january.csv.gz
+
+Same merge and encoding as /api/export/sensor (app/export.py): one batched
+cursor per machine, merged in timestamp order, so memory stays flat for any
+range. The resume token of the last row written goes to stderr when the
+export stops (finished, --limit reached or Ctrl-C). Pass it back with
+--resume and --append to carry on where the file ends.
+"""
+import argparse
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app import export
+from app.clock import parse_utc
+from app.registry import registry
+from app.storage import get_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--machines', help='comma-separated machine ids (default: whole registry)')
+    parser.add_argument('--from', dest='start', type=parse_utc, help='ISO 8601 start, UTC if no offset')
+    parser.add_argument('--to', dest='end', type=parse_utc, help='ISO 8601 end, UTC if no offset')
+    parser.add_argument('--format', choices=export.FORMATS, default='ndjson')
+    parser.add_argument('--gzip', action='store_true', help='gzip the output')
+    parser.add_argument('--output', help='file to write (default: stdout)')
+    parser.add_argument('--append', action='store_true', help='append to --output instead of replacing it')
+    parser.add_argument('--resume', help='resume token printed by an earlier export')
+    parser.add_argument('--limit', type=int, help='stop after this many rows')
+    args = parser.parse_args()
+
+    if args.resume:
+        try:
+            export.parse_resume_token(args.resume)
+        except ValueError as e:
+            parser.error(str(e))
+
+    machines = registry.machines(include_inactive=True)
+    if args.machines:
+        wanted = set(args.machines.split(','))
+        machines = [m for m in machines if m.id in wanted]
+
+    last = None
+    rows = 0
+
+    def on_row(key):
+        nonlocal last, rows
+        last = key
+        rows += 1
+
+    readings = export.merged_readings(get_store(), machines, args.start, args.end, args.resume)
+    chunks = export.encode(readings, args.format, args.limit, on_row, resume_line=False,
+                           resume=args.resume, header=not (args.resume or args.append))
+    if args.gzip:
+        chunks = export.gzipped(chunks)
+    elif args.output:
+        chunks = (chunk.encode() for chunk in chunks)
+    if args.output:
+        out = open(args.output, 'ab' if args.append else 'wb')
+    else:
+        out = sys.stdout.buffer if args.gzip else sys.stdout
+
+    started = time.perf_counter()
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    except KeyboardInterrupt:
+        print("⏹️ Interrupted", file=sys.stderr)
+    finally:
+        out.flush()
+        if args.output:
+            out.close()
+    print(f"✅ {rows} rows from {len(machines)} machines in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    if last is not None:
+        print(f"resume={export.resume_token(*last)}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
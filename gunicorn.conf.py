@@ -0,0 +1,18 @@
+# Gunicorn settings for the cooperative (gevent) serving mode:
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Each SSE stream is a greenlet parked in a cooperative sleep, so one worker
+# holds up to `worker_connections` open dashboards instead of one per thread.
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+worker_class = 'gevent'
+# Simulations run inside the web worker and are tracked per process, so keep a
+# single worker unless you know every stop/alert lands on the same one.
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+worker_connections = int(os.getenv('GEVENT_WORKER_CONNECTIONS', '2000'))
+# Streams never finish on their own; gevent workers heartbeat independently of
+# request length so a long timeout only guards against a wedged hub.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+keepalive = 75
@@ -0,0 +1,74 @@
+"""Copy per-reading sensor documents into the bucketed layout.
+
+    python migrate_sensor_layout.py [--machines LATHE-01,LATHE-02] [--batch-size 500]
+
+Readings are streamed from lathe{n}_sensory_data in timestamp order and
+appended to lathe{n}_sensory_data_buckets, one bulk_write per batch. Source
+documents are left in place unless --drop-source is given. Set
+SENSOR_LAYOUT=bucket once every machine is migrated.
+"""
+import argparse
+import time
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+load_dotenv()
+
+from app import readings
+from app.registry import registry
+
+
+def migrate_machine(machine, batch_size, force):
+    collections = machine.collections()
+    if collections['buckets'].estimated_document_count() and not force:
+        print(f"⏭️  {machine.id}: bucket collection is not empty, skipping (use --force to append)")
+        return 0
+    readings.ensure_indexes(collections)
+
+    migrated = 0
+    pending = {}  # bucket id -> readings, in timestamp order
+    pending_count = 0
+
+    def flush():
+        nonlocal pending, pending_count
+        if pending:
+            operations = [UpdateOne(*readings.bucket_update_batch(batch), upsert=True) for batch in pending.values()]
+            collections['buckets'].bulk_write(operations, ordered=True)
+        pending, pending_count = {}, 0
+
+    cursor = collections['sensor'].find({}, {'_id': 0}).sort('timestamp', 1).batch_size(batch_size)
+    for doc in cursor:
+        if 'jobId' not in doc or 'timestamp' not in doc:
+            continue
+        pending.setdefault(readings.bucket_id(doc['jobId'], doc['timestamp']), []).append(doc)
+        pending_count += 1
+        migrated += 1
+        if pending_count >= batch_size:
+            flush()
+    flush()
+    return migrated
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--machines', help='comma-separated machine ids (default: whole registry)')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--force', action='store_true', help='append even if buckets already exist')
+    parser.add_argument('--drop-source', action='store_true', help='drop the per-reading collection afterwards')
+    args = parser.parse_args()
+
+    machines = registry.machines(include_inactive=True)
+    if args.machines:
+        wanted = set(args.machines.split(','))
+        machines = [m for m in machines if m.id in wanted]
+
+    for machine in machines:
+        started = time.perf_counter()
+        count = migrate_machine(machine, args.batch_size, args.force)
+        print(f"✅ {machine.id}: {count} readings migrated in {time.perf_counter() - started:.1f}s")
+        if args.drop_source and count:
+            machine.collections()['sensor'].drop()
+            print(f"🗑️  {machine.id}: dropped {machine.sensor_collection}")
+
+if __name__ == '__main__':
+    main()
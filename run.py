@@ -1,4 +1,14 @@
 from app import app
+from app.storage import STORAGE_BACKEND
+from app.job_queue import queue as job_queue, JOB_DISPATCHER
+import os
 
 if __name__ == '__main__':
+    if STORAGE_BACKEND == 'memory':
+        # Nothing persists in memory; give the dev server the usual logins
+        from create_test_users import create_test_users
+        create_test_users()
+    # The reloader's parent process only watches files; dispatch in the child
+    if JOB_DISPATCHER and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_queue.start()
     app.run(debug=True)
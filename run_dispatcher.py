@@ -0,0 +1,17 @@
+"""Run the job queue dispatcher on its own, outside the web workers.
+
+    JOB_DISPATCHER=0 gunicorn -c gunicorn.conf.py wsgi:app
+    python run_dispatcher.py
+
+With several web workers each one would otherwise dispatch; queued jobs are
+claimed atomically, so nothing starts twice, but two dispatchers can pick the
+same free lathe in the same tick. One dispatcher process avoids that. Jobs it
+starts run in this process, or on the simulation farm when FARM_ADDRESS is set.
+"""
+import time
+from app.job_queue import queue
+
+if __name__ == '__main__':
+    queue.start()
+    while True:
+        time.sleep(3600)
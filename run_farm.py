@@ -0,0 +1,27 @@
+"""Standalone simulation farm: runs lathe simulations in worker processes.
+
+    python run_farm.py --workers 4 --address 127.0.0.1:6001
+
+Start the web app with SIM_FARM_ADDRESS set to the same address (and the same
+SECRET_KEY) to have it hand jobs to the farm instead of running threads.
+"""
+import argparse
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.farm import SimulationFarm
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes (default: CPU count)')
+    parser.add_argument('--address', default=os.getenv('SIM_FARM_ADDRESS', '127.0.0.1:6001'))
+    args = parser.parse_args()
+
+    farm = SimulationFarm(workers=args.workers, address=args.address)
+    try:
+        farm.serve_forever()
+    except KeyboardInterrupt:
+        print("🛑 Shutting down simulation farm")
+        farm.shutdown()
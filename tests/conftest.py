@@ -0,0 +1,27 @@
+import os
+
+# Behaviour tests run on the in-process store (app/memory_storage.py); set
+# before any app module reads STORAGE_BACKEND.
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+
+import pytest
+
+from app.memory_storage import MemoryStore
+from app.registry import registry
+from app import storage
+
+
+@pytest.fixture
+def store():
+    """A fresh memory store installed as the process-wide one"""
+    previous = storage._store
+    fresh = MemoryStore()
+    storage.set_store(fresh)
+    registry.machines()  # loaded (and seeded) once per process; the fleet is fixed
+    yield fresh
+    storage.set_store(previous)
+
+@pytest.fixture
+def machine(store):
+    return registry.get('LATHE-01')
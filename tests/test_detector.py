@@ -0,0 +1,55 @@
+from datetime import datetime
+from threading import Event
+import random
+
+from app import detector, simulator
+from app.clock import VirtualClock
+
+
+def feed(machine_detector, probabilities, **values):
+    return [machine_detector.observe(dict(values, failureProbability=p)) for p in probabilities]
+
+
+def test_fires_after_consecutive_high_probability_readings():
+    results = feed(detector.MachineDetector('JOB-1'), [0.9] * detector.CONSECUTIVE)
+    assert results[:-1] == [None] * (detector.CONSECUTIVE - 1)
+    assert 'failureProbability' in results[-1][0]
+
+def test_rearms_only_after_falling_to_the_low_threshold():
+    machine_detector = detector.MachineDetector('JOB-1')
+    high = [0.9] * detector.CONSECUTIVE
+    assert feed(machine_detector, high)[-1]
+    # Between the thresholds: still latched
+    assert not any(feed(machine_detector, [0.7] + high))
+    assert feed(machine_detector, [0.5] + high)[-1]
+
+def test_sustained_rise_after_warmup_is_anomalous():
+    machine_detector = detector.MachineDetector('JOB-1')
+    rng = random.Random(1)
+    for _ in range(detector.WARMUP + 5):
+        assert machine_detector.observe({'torque': 30 + rng.gauss(0, 0.5), 'failureProbability': 0.1}) is None
+    results = [machine_detector.observe({'torque': 80.0, 'failureProbability': 0.1})
+               for _ in range(detector.CONSECUTIVE)]
+    assert results[-1] and results[-1][0].startswith('anomalous torque')
+
+def test_detector_alert_on_the_last_tick_stops_the_job(store, machine, monkeypatch):
+    clock = VirtualClock(start=datetime(2025, 1, 6, 9, 0), speed=None)
+    duration = 0.25  # minutes: readings at 0, 5 and 10 s
+    calls = []
+
+    def observe(machine_id, job_id, reading):
+        calls.append(reading)
+        if len(calls) == 3:
+            clock._elapsed = duration * 60  # the last tick ran up to the end of the job
+            return ['test reason']
+        return None
+
+    monkeypatch.setattr(simulator.detector, 'observe', observe)
+    monkeypatch.setattr(simulator, 'get_model', lambda: None)
+    simulator.generate_sensor_data(machine.id, 'JOB-LAST', duration, 'Aluminum', 'turning', 1, Event(),
+                                   clock=clock, rng=random.Random(1), store=store)
+
+    job = store.jobs.get(machine, 'JOB-LAST')
+    assert job['status'] == 'alert_triggered'
+    assert job['alertTime'] == clock.now()
+    assert store.alerts.latest_critical(machine)['jobId'] == 'JOB-LAST'
@@ -0,0 +1,74 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import export
+from app.registry import registry
+
+T0 = datetime(2025, 1, 6, 9, 0)
+
+
+@pytest.fixture
+def machines(store):
+    machines = [registry.get('LATHE-02'), registry.get('LATHE-01')]
+    for i in range(6):
+        for m in machines:
+            store.readings.add(m, {'machineId': m.id, 'jobId': f'{m.id}-JOB', 'timestamp': T0 + timedelta(seconds=5 * i),
+                                   'torque': float(i)})
+    # Two readings with the same timestamp on one machine
+    m = machines[1]
+    store.readings.add(m, {'machineId': m.id, 'jobId': f'{m.id}-JOB', 'timestamp': T0 + timedelta(seconds=10),
+                           'torque': 2.5})
+    return machines
+
+def keys(rows):
+    return [(r['timestamp'], r['machineId'], r['torque']) for r in rows]
+
+def ndjson(chunks):
+    return [json.loads(line) for line in ''.join(chunks).splitlines()]
+
+
+def test_merged_readings_are_ordered_by_timestamp_then_machine(store, machines):
+    merged = list(export.merged_readings(store, machines))
+    assert len(merged) == 13
+    assert [(r['timestamp'], r['machineId']) for r in merged] == \
+        sorted((r['timestamp'], r['machineId']) for r in merged)
+
+@pytest.mark.parametrize('limit', [1, 5, 6, 7])
+def test_resumed_pages_add_up_to_the_full_export(store, machines, limit):
+    full = ndjson(export.encode(export.merged_readings(store, machines)))
+    pages, resume = [], None
+    while True:
+        lines = ndjson(export.encode(export.merged_readings(store, machines, resume=resume),
+                                     limit=limit, resume=resume))
+        if lines and 'resume' in lines[-1]:
+            resume = lines.pop()['resume']
+            pages.extend(lines)
+        else:
+            pages.extend(lines)
+            break
+    assert keys(pages) == keys(full)
+
+def test_resume_token_round_trip():
+    token = export.resume_token(T0, 'LATHE-01', 2)
+    assert export.parse_resume_token(token) == (T0, 'LATHE-01', 2)
+    assert export.parse_resume_token(f'{T0.isoformat()},LATHE-01') == (T0, 'LATHE-01', 1)
+    with pytest.raises(ValueError):
+        export.parse_resume_token('nonsense')
+
+def test_csv_has_a_header_and_no_resume_line(store, machines):
+    text = ''.join(export.encode(export.merged_readings(store, machines), fmt='csv', limit=4))
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert len(rows) == 4
+    assert rows[0]['machineId'] == 'LATHE-01' and rows[0]['timestamp'] == T0.isoformat()
+
+    without_header = ''.join(export.encode(export.merged_readings(store, machines), fmt='csv', limit=4, header=False))
+    assert without_header == text.split('\n', 1)[1]
+
+def test_gzipped_stream_decompresses_to_the_export(store, machines):
+    chunks = list(export.encode(export.merged_readings(store, machines)))
+    assert gzip.decompress(b''.join(export.gzipped(iter(chunks)))).decode() == ''.join(chunks)
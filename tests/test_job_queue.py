@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import job_queue
+from app.registry import registry
+
+NOW = datetime(2025, 1, 6, 9, 0)
+
+
+def spec(**fields):
+    return dict({'jobType': 'turning', 'material': 'Aluminum', 'toolNo': 2, 'estimatedTime': 30}, **fields)
+
+@pytest.fixture
+def started(monkeypatch):
+    """Simulations the queue started, as (machine id, job id); none really run"""
+    calls = []
+    monkeypatch.setattr(job_queue, 'start_simulation', lambda **kw: calls.append((kw['machine_id'], kw['job_id'])))
+    return calls
+
+@pytest.fixture
+def queue(store):
+    return job_queue.JobQueue(reconcile_interval=3600)
+
+def submit(queue, *specs, now=NOW):
+    jobs = [job_queue.new_job(s, submitted_by='Yash', now=now + timedelta(seconds=i)) for i, s in enumerate(specs)]
+    queue.submit(jobs)
+    return [job['_id'] for job in jobs]
+
+
+def test_new_job_rejects_bad_specs(store):
+    with pytest.raises(ValueError):
+        job_queue.new_job(spec(material='Titanium'))
+    with pytest.raises(ValueError):
+        job_queue.new_job(spec(priority=11))
+    with pytest.raises(ValueError):
+        job_queue.new_job(spec(machineId='LATHE-99'))
+
+def test_first_dispatch_reconciles_the_free_machines(queue, started, monkeypatch):
+    # A freshly booted host: the monotonic clock is still below the interval
+    monkeypatch.setattr(job_queue.time, 'monotonic', lambda: 5.0)
+    submit(queue, spec())
+    # Nothing has marked any lathe free yet; only the reconcile can
+    assert queue.dispatch_once(NOW)
+    assert len(started) == 1
+
+def test_higher_priority_then_earlier_deadline_goes_first(store, queue, started):
+    low, urgent, high = submit(queue, spec(priority=3), spec(priority=8, deadline='2025-01-06T10:00:00Z'),
+                               spec(priority=8, deadline='2025-01-07T10:00:00Z'))
+    dispatched = [job_id for job_id, _ in queue.dispatch_once(NOW)]
+    assert dispatched == [urgent, high, low]
+
+def test_pinned_job_waits_for_its_lathe(store, queue, started):
+    (job_id,) = submit(queue, spec(machineId='LATHE-03'))
+    lathe = registry.get('LATHE-03')
+    store.jobs.insert(lathe, {'_id': 'BUSY', 'status': 'ongoing'})
+    assert queue.dispatch_once(NOW) == []
+    store.jobs.update(lathe, 'BUSY', {'status': 'completed'})
+    queue.free.mark_free('LATHE-03')
+    assert queue.dispatch_once(NOW) == [(job_id, 'LATHE-03')]
+
+def test_failed_start_leaves_no_job_and_is_retried(store, queue, monkeypatch):
+    attempts = []
+
+    def start_simulation(**kw):
+        attempts.append(kw['job_id'])
+        if len(attempts) == 1:
+            raise OSError('farm unreachable')
+
+    monkeypatch.setattr(job_queue, 'start_simulation', start_simulation)
+    (job_id,) = submit(queue, spec(machineId='LATHE-05'))
+    lathe = registry.get('LATHE-05')
+    assert queue.dispatch_once(NOW) == []
+    assert store.jobs.get(lathe, job_id) is None
+    assert store.queue.get(job_id)['status'] == 'queued'
+    assert queue.dispatch_once(NOW) == [(job_id, 'LATHE-05')]
+    assert store.jobs.get(lathe, job_id)['status'] == 'ongoing'
+
+def test_cancelled_jobs_are_not_dispatched(queue, started):
+    (job_id,) = submit(queue, spec())
+    assert queue.cancel(job_id)
+    assert queue.dispatch_once(NOW) == []
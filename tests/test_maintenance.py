@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.maintenance import IntervalIndex
+
+T0 = datetime(2025, 1, 6, 9, 0)
+
+
+def at(minutes):
+    return T0 + timedelta(minutes=minutes)
+
+
+def test_interval_index_merges_overlapping_windows():
+    index = IntervalIndex([(at(30), at(40)), (at(0), at(10)), (at(5), at(20))])
+    assert index.starts == [at(0), at(30)]
+    assert index.ends == [at(20), at(40)]
+    assert index.contains(at(0)) and index.contains(at(15)) and index.contains(at(40))
+    assert not index.contains(at(-1)) and not index.contains(at(25)) and not index.contains(at(41))
+
+def test_interval_index_next_after():
+    index = IntervalIndex([(at(0), at(10)), (at(30), at(40))])
+    assert index.next_after(at(5)) == (at(0), at(10))
+    assert index.next_after(at(20)) == (at(30), at(40))
+    assert index.next_after(at(-5)) == (at(0), at(10))
+    assert index.next_after(at(50)) is None
+
+
+@pytest.fixture
+def manager_client(store):
+    from app import app
+    from create_test_users import create_test_users
+    create_test_users(store)
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    client = app.test_client()
+    client.post('/login', data={'userID': 'Sahil', 'password': 'man123'})
+    return client
+
+def test_booking_maintenance_needs_a_registered_machine(manager_client, store):
+    assert manager_client.get('/lathe/NO-SUCH-LATHE/maintenance').status_code == 404
+    assert manager_client.get('/lathe/NO-SUCH-LATHE/maintenance/windows').status_code == 404
+    assert store.maintenance.find('NO-SUCH-LATHE', None) == []
+
+    assert manager_client.get('/lathe/LATHE-01/maintenance').status_code == 302
+    assert len(store.maintenance.find('LATHE-01', None)) == 1
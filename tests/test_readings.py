@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import readings
+
+T0 = datetime(2025, 1, 6, 14, 5, 40)
+
+
+def reading(i, job_id='JOB-1', **extra):
+    return dict({'machineId': 'LATHE-01', 'jobId': job_id, 'timestamp': T0 + timedelta(seconds=5 * i),
+                 'airTemperature': 300.0 + i, 'processTemperature': 310.0 + i, 'rotationalSpeed': 1500.0,
+                 'torque': 40.0 + i, 'toolWear': float(i), 'failureProbability': 0.1,
+                 'interval': 5.0}, **extra)
+
+@pytest.fixture
+def collections():
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient()['SensorData']
+    return {'sensor': db['lathe1_sensory_data'], 'buckets': db['lathe1_sensory_data_buckets']}
+
+def append(collections, batch, layout='bucket'):
+    """store_many without bulk_write, which mongomock can't take from current pymongo"""
+    if layout != 'bucket':
+        return readings.store_many(collections, batch, layout=layout)
+    groups = {}
+    for r in batch:
+        groups.setdefault(readings.bucket_id(r['jobId'], r['timestamp']), []).append(r)
+    for group in groups.values():
+        collections['buckets'].update_one(*readings.bucket_update_batch(group), upsert=True)
+
+
+def test_bucket_id_is_per_job_and_minute():
+    assert readings.bucket_id('JOB-1', T0) == 'JOB-1:202501061405'
+    assert readings.minute_of(T0) == datetime(2025, 1, 6, 14, 5)
+
+def test_single_and_batched_appends_build_the_same_buckets(collections):
+    batch = [reading(i) for i in range(12)]
+    for r in batch:
+        readings.store(collections, r, layout='bucket')
+    one_by_one = list(collections['buckets'].find().sort('_id', 1))
+    collections['buckets'].delete_many({})
+
+    append(collections, batch)
+    batched = list(collections['buckets'].find().sort('_id', 1))
+    assert batched == one_by_one
+    # 14:05:40 to 14:06:35 spans two minutes
+    assert [b['count'] for b in batched] == [4, 8]
+    assert batched[0]['sum']['torque'] == 40 + 41 + 42 + 43
+    assert batched[1]['min']['torque'] == 44 and batched[1]['max']['torque'] == 51
+    assert batched[1]['last'] == batch[-1]['timestamp']
+
+def test_unpack_restores_the_document_shape(collections):
+    batch = [reading(i) for i in range(3)]
+    append(collections, batch)
+    assert readings.unpack(collections['buckets'].find_one()) == batch
+
+def test_critical_flag_lands_on_the_last_reading(collections):
+    batch = [reading(0), reading(1, alertTriggered=True, criticalFailure=True)]
+    append(collections, batch)
+    unpacked = readings.unpack(collections['buckets'].find_one())
+    assert unpacked[-1]['criticalFailure'] and unpacked[-1]['alertTriggered']
+    assert 'criticalFailure' not in unpacked[0]
+
+@pytest.mark.parametrize('layout', ['document', 'bucket'])
+def test_reads_agree_across_layouts(collections, layout):
+    batch = [reading(i) for i in range(30)]
+    append(collections, [dict(r) for r in batch], layout)
+
+    def plain(docs):
+        return [{k: v for k, v in d.items() if k != '_id'} for d in docs]
+
+    assert plain([readings.latest(collections, layout=layout)]) == batch[-1:]
+    assert plain(readings.newest(collections, 7, layout=layout)) == batch[-7:]
+    assert plain(readings.newest(collections, 100, after=batch[24]['timestamp'], layout=layout)) == batch[25:]
+    start, end = batch[5]['timestamp'], batch[20]['timestamp']
+    assert plain(readings.between(collections, start, end, layout=layout)) == batch[5:21]
+    assert list(readings.between(collections, job_id='JOB-2', layout=layout)) == []
+    means = readings.averages(collections, layout=layout)
+    assert means['torque'] == pytest.approx(sum(r['torque'] for r in batch) / len(batch))
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('numpy')
+from app.recent import RingBuffer, _to_epoch
+
+T0 = datetime(2025, 1, 6, 9, 0)
+
+
+def fill(buffer, count, start=0):
+    for i in range(start, start + count):
+        buffer.append({'timestamp': T0 + timedelta(seconds=5 * i), 'torque': float(i)})
+
+def torques(values):
+    return [float(v) for v in values[:, 3]]
+
+
+def test_wrapped_buffer_keeps_the_newest_readings_in_order():
+    buffer = RingBuffer(capacity=8)
+    fill(buffer, 13)
+    timestamps, values = buffer.latest(100)
+    assert torques(values) == [float(i) for i in range(5, 13)]
+    assert list(timestamps) == sorted(timestamps)
+    assert buffer.last_timestamp == _to_epoch(T0 + timedelta(seconds=60))
+
+def test_window_after_wraparound():
+    buffer = RingBuffer(capacity=8)
+    fill(buffer, 13)
+    # The head sits mid-array; the window must still cut on time, not position
+    _, values = buffer.window(10)
+    assert torques(values) == [10.0, 11.0, 12.0]
+    _, values = buffer.window(10, now=_to_epoch(T0 + timedelta(seconds=50)))
+    assert torques(values) == [8.0, 9.0, 10.0, 11.0, 12.0]
+
+def test_older_or_repeated_readings_are_ignored():
+    buffer = RingBuffer(capacity=8)
+    fill(buffer, 4)
+    fill(buffer, 4)
+    assert buffer.count == 4
+
+def test_stats_over_a_window():
+    buffer = RingBuffer(capacity=8)
+    assert buffer.stats(60) == {'count': 0}
+    fill(buffer, 5)
+    stats = buffer.stats(10)
+    assert stats['count'] == 3
+    assert stats['to'] == (T0 + timedelta(seconds=20)).isoformat()
+    assert stats['fields']['torque'] == {'mean': 3.0, 'min': 2.0, 'max': 4.0, 'std': 0.8165, 'last': 4.0}
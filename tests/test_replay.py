@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+from threading import Barrier, Thread
+
+from app import replay
+
+T0 = datetime(2025, 1, 6, 9, 0)
+
+
+def add_readings(store, machine, count):
+    for i in range(count):
+        store.readings.add(machine, {'machineId': machine.id, 'jobId': 'JOB-1',
+                                     'timestamp': T0 + timedelta(seconds=5 * i), 'torque': float(i)})
+
+
+def test_concurrent_creates_stay_within_the_cap(store, machine):
+    manager = replay.ReplayManager(max_sessions=3, idle_timeout=600)
+    barrier = Barrier(10)
+    created = []
+
+    def create():
+        barrier.wait()
+        created.append(manager.create(store, machine, T0, T0 + timedelta(minutes=1)))
+
+    threads = [Thread(target=create) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(manager) == 3
+    assert sum(session is not None for session in created) == 3
+
+def test_ended_session_is_reaped_while_a_stream_polls_it(store, machine):
+    add_readings(store, machine, 3)
+    manager = replay.ReplayManager(max_sessions=3, idle_timeout=0.2)
+    session = manager.create(store, machine, T0, T0 + timedelta(seconds=10), speed=100)
+    played = []
+    while not session.ended:
+        new, _ = session.readings_after(played[-1][0] if played else 0, timeout=0.5)
+        played.extend(new)
+    assert [r['torque'] for _, r in played] == [0.0, 1.0, 2.0]
+
+    # A stream keeps polling the ended replay; it must not keep it alive
+    for _ in range(4):
+        session.readings_after(played[-1][0], timeout=0.1)
+    assert manager.get(session.id) is None
@@ -0,0 +1,35 @@
+from datetime import datetime
+from threading import Event
+
+from app import simulator
+from app.clock import WALL_CLOCK, VirtualClock, make_clock
+from app.memory_storage import MemoryStore
+
+START = datetime(2025, 1, 6, 6, 0)
+
+
+def run_job(store, machine, seed, speed, job_id='JOB-SEEDED', start=START):
+    simulator.generate_sensor_data(
+        machine.id, job_id, 1, 'Mild Steel', 'turning', 3, Event(),
+        clock=make_clock(speed, start, seed), rng=simulator.job_rng(job_id, seed), store=store)
+    return [{k: v for k, v in r.items() if k != '_id'} for r in store.readings.between(machine, job_id=job_id)]
+
+
+def test_seeded_runs_get_a_virtual_clock_even_at_real_time():
+    assert make_clock(1) is WALL_CLOCK
+    clock = make_clock(1, seed='42')
+    assert isinstance(clock, VirtualClock) and clock.speed == 1
+    assert make_clock(1, START, '42').now() == START
+
+def test_same_seed_gives_identical_readings_at_any_speed(store, machine, monkeypatch):
+    monkeypatch.setattr(simulator, 'get_model', lambda: None)
+    fast = run_job(store, machine, '42', None)
+    paced = run_job(MemoryStore(), machine, '42', 6000)
+    assert fast and fast == paced
+    assert fast[0]['timestamp'] == START
+
+def test_different_seeds_give_different_readings(store, machine, monkeypatch):
+    monkeypatch.setattr(simulator, 'get_model', lambda: None)
+    first = run_job(store, machine, '42', None)
+    second = run_job(MemoryStore(), machine, '43', None)
+    assert [r['torque'] for r in first] != [r['torque'] for r in second]
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+
+from app import similarity
+
+T0 = datetime(2025, 1, 6, 9, 0)
+
+
+def add_job(store, machine, job_id, count):
+    start = T0 + timedelta(hours=len(store.jobs.history(machine)))
+    for i in range(count):
+        store.readings.add(machine, {'machineId': machine.id, 'jobId': job_id,
+                                     'timestamp': start + timedelta(seconds=5 * i), 'torque': 30.0 + i})
+    store.jobs.insert(machine, {'_id': job_id, 'status': 'completed', 'startTime': start,
+                                'endTime': start + timedelta(seconds=5 * count)})
+    return store.jobs.get(machine, job_id)
+
+
+def test_short_job_is_marked_and_not_picked_up_again(store, machine):
+    index = similarity.SimilarityIndex()
+    short = add_job(store, machine, 'JOB-SHORT', 1)
+    add_job(store, machine, 'JOB-LONG', 20)
+    missing = index._load()
+    assert sorted(job['_id'] for _, job in missing) == ['JOB-LONG', 'JOB-SHORT']
+    for m, job in missing:
+        index.index_job(m, job)
+
+    assert store.jobs.get(machine, 'JOB-SHORT')['signature'] == []
+    assert index._load() == []
+    assert len(index._index) == 1
+    assert index.index_job(machine, short) is None
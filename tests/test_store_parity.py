@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.memory_storage import MemoryStore
+from app.registry import registry
+
+T0 = datetime(2025, 1, 6, 9, 0)
+
+
+@pytest.fixture(params=['memory', 'mongo'])
+def backend(request, store):
+    if request.param == 'memory':
+        return MemoryStore()
+    mongomock = pytest.importorskip('mongomock')
+    from app.storage import MongoStore
+    return MongoStore(mongomock.MongoClient(), db_prefix='test_')
+
+def job(job_id, minutes, status='completed', **fields):
+    return dict({'_id': job_id, 'machineId': 'LATHE-01', 'status': status,
+                 'startTime': T0 + timedelta(minutes=minutes), 'estimatedTime': 30}, **fields)
+
+
+def test_jobs(backend, machine):
+    jobs = backend.jobs
+    jobs.insert(machine, job('J1', 0, signature=[0.5] * 3))
+    jobs.insert(machine, job('J2', 60, signature=[]))
+    jobs.insert(machine, job('J3', 120, status='ongoing'))
+
+    assert [j['_id'] for j in jobs.history(machine)] == ['J3', 'J2', 'J1']
+    assert jobs.current(machine)['_id'] == 'J3'
+    assert jobs.has_ongoing(machine)
+    assert jobs.counts(machine) == {'total': 3, 'ongoing': 1}
+    assert [j['_id'] for j in jobs.signatures(machine)] == ['J1']
+    assert [j['_id'] for j in jobs.between(machine, 'startTime', T0 + timedelta(minutes=30))] == ['J2', 'J3']
+    # stalled() isn't compared: mongomock's $add can't add to a date
+
+    assert not jobs.update(machine, 'J1', {'status': 'stopped'}, if_status='ongoing')
+    assert jobs.update(machine, 'J3', {'status': 'completed'}, if_status='ongoing')
+    assert jobs.current(machine) is None and not jobs.has_ongoing(machine)
+    assert jobs.remove(machine, 'J2') and not jobs.remove(machine, 'J2')
+    assert jobs.counts(machine) == {'total': 2, 'ongoing': 0}
+
+def test_readings(backend, machine):
+    other = registry.get('LATHE-02')
+    for i in range(10):
+        backend.readings.add(machine, {'machineId': machine.id, 'jobId': 'J1', 'timestamp': T0 + timedelta(seconds=5 * i),
+                                       'torque': float(i)})
+    backend.readings.add(other, {'machineId': other.id, 'jobId': 'J9', 'timestamp': T0, 'torque': 99.0})
+
+    def torques(docs):
+        return [d['torque'] for d in docs]
+
+    assert backend.readings.latest(machine)['torque'] == 9.0
+    assert torques(backend.readings.newest(machine, 3)) == [7.0, 8.0, 9.0]
+    assert torques(backend.readings.newest(machine, 100, after=T0 + timedelta(seconds=35))) == [8.0, 9.0]
+    assert torques(backend.readings.between(machine, T0 + timedelta(seconds=10), T0 + timedelta(seconds=20))) == \
+        [2.0, 3.0, 4.0]
+    assert list(backend.readings.between(machine, job_id='J9')) == []
+    assert backend.readings.averages(machine)['torque'] == pytest.approx(4.5)
+    assert backend.readings.latest(registry.get('LATHE-03')) is None
+
+def test_alerts(backend, machine):
+    for i, severity in enumerate([3, 5, 5]):
+        backend.alerts.insert(machine, {'_id': f'A{i}', 'machineId': machine.id, 'timestamp': T0 + timedelta(minutes=i),
+                                        'severity': severity, 'status': 'active', 'requiresMaintenance': i < 2})
+    assert [a['_id'] for a in backend.alerts.history(machine)] == ['A2', 'A1', 'A0']
+    assert [a['_id'] for a in backend.alerts.between(machine, T0 + timedelta(minutes=1))] == ['A1', 'A2']
+    assert backend.alerts.latest_critical(machine)['_id'] == 'A1'
+
+def test_maintenance_and_versions(backend):
+    window_id = backend.maintenance.add({'machineId': 'LATHE-01', 'start': T0, 'end': T0 + timedelta(minutes=10)})
+    backend.maintenance.add({'machineId': 'LATHE-02', 'start': T0, 'end': T0 + timedelta(minutes=30)})
+    assert [w['machineId'] for w in backend.maintenance.find('LATHE-01')] == ['LATHE-01']
+    assert [w['machineId'] for w in backend.maintenance.find(ending_after=T0 + timedelta(minutes=20))] == ['LATHE-02']
+    assert backend.maintenance.remove(str(window_id)) and not backend.maintenance.remove(str(window_id))
+
+    before = backend.versions.get('windows')
+    backend.versions.bump('windows')
+    assert backend.versions.get('windows') != before
@@ -0,0 +1,48 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('numpy')
+from app.utilization import RunIndex, MachineTimeline, bucket_edges, summarize_usage, to_seconds, USAGE_KEYS
+
+HOUR = 3600
+
+
+def test_run_index_clips_overlaps_and_keeps_prefix_sums_in_order():
+    index = RunIndex()
+    index.add(100, 200, 'busy')
+    index.add(400, 500, 'alert')
+    index.add(150, 300, 'busy')  # overlaps the first run; inserted mid-list
+    assert list(zip(index.starts, index.ends)) == [(100, 200), (200, 300), (400, 500)]
+    assert index.before(250) == (150, 0)
+    assert index.before(1000) == (200, 100)
+    assert index.covered(250, 450) == 50 + 50
+
+def test_before_many_matches_before():
+    index = RunIndex()
+    for start, state in [(0, 'busy'), (50, 'alert'), (120, 'busy'), (300, 'alert')]:
+        index.add(start, start + 40, state)
+    times = [-10, 0, 20, 45, 60, 119, 150, 310, 999]
+    marks = index.before_many(times)
+    for k, t in enumerate(times):
+        assert (marks[0][k], marks[1][k]) == index.before(t)
+
+def test_usage_splits_a_window_into_busy_alert_maintenance_and_idle():
+    timeline = MachineTimeline()
+    timeline.runs.add(0, 600, 'busy', estimated=10, actual=10, completed=True)
+    timeline.runs.add(600, 900, 'alert')
+    timeline.maintenance.add(800, 1500, 'busy')  # the alert run covers its first 100 s
+    timeline.open_run = 3000
+    rows = timeline.usage([0, HOUR], now=3300)
+    usage = dict(zip(USAGE_KEYS, rows[0]))
+    assert usage == {'busy': 600 + 300, 'alert': 300, 'maintenance': 600, 'idle': 3300 - 1800,
+                     'span': 3300, 'runs': 2, 'completed': 1, 'estimated': 10, 'actual': 10}
+    summary = summarize_usage(rows[0])
+    assert summary['quality'] == 0.5 and summary['performance'] == 1.0
+
+def test_shift_buckets_start_at_the_shift_boundary():
+    start, end = to_seconds(datetime(2025, 1, 6, 5, 0)), to_seconds(datetime(2025, 1, 6, 23, 0))
+    edges = bucket_edges(start, end, 'shift')
+    assert [e - start for e in edges] == [0, 1 * HOUR, 9 * HOUR, 17 * HOUR, 18 * HOUR]
+    with pytest.raises(ValueError):
+        bucket_edges(0, 2000 * HOUR, 'hour')
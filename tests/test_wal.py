@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+from app import readings, wal
+
+T0 = datetime(2025, 1, 6, 9, 0)
+
+
+def reading(i, job_id='JOB-1', machine_id='LATHE-01'):
+    return {'_id': ObjectId(), 'machineId': machine_id, 'jobId': job_id,
+            'timestamp': T0 + timedelta(seconds=i), 'torque': float(i)}
+
+def open_log(tmp_path):
+    return wal.WriteAheadLog(str(tmp_path), segment_bytes=64 * 1024, fsync='never')
+
+def stored_torques(store, machine):
+    return [r['torque'] for r in store.readings.between(machine)]
+
+
+def test_forwarded_readings_reach_the_store(tmp_path, store, machine):
+    log = open_log(tmp_path)
+    for i in range(5):
+        log.append(machine.id, reading(i))
+    assert wal.Forwarder(log, store=store).forward_batch() == 5
+    assert stored_torques(store, machine) == [0.0, 1.0, 2.0, 3.0, 4.0]
+    log.close()
+
+def test_reforward_of_an_overlapping_batch_stores_each_reading_once(tmp_path, store, machine):
+    log = open_log(tmp_path)
+    start = log.position()
+    for i in range(3):
+        log.append(machine.id, reading(i))
+    wal.Forwarder(log, store=store).forward_batch()
+    for i in range(3, 7):
+        log.append(machine.id, reading(i))
+    # Crash before the checkpoint was written: the retry re-reads a longer batch
+    wal.write_checkpoint(log.directory, start)
+    forwarder = wal.Forwarder(log, store=store)
+    assert forwarder.position == start
+    assert forwarder.forward_batch() == 7
+    assert stored_torques(store, machine) == [float(i) for i in range(7)]
+    log.close()
+
+def test_recovery_resumes_after_the_checkpoint(tmp_path, store, machine):
+    log = open_log(tmp_path)
+    for i in range(4):
+        log.append(machine.id, reading(i))
+    wal.Forwarder(log, store=store, batch_size=2).forward_batch()
+    log.close()
+
+    reopened = open_log(tmp_path)
+    assert wal.Forwarder(reopened, store=store).forward_batch() == 2
+    assert stored_torques(store, machine) == [0.0, 1.0, 2.0, 3.0]
+    reopened.close()
+
+def test_a_full_log_raises_wal_full(tmp_path):
+    log = wal.WriteAheadLog(str(tmp_path), segment_bytes=16 * 1024, max_bytes=32 * 1024,
+                            block_timeout=0.1, fsync='never')
+    try:
+        for i in range(10000):
+            log.append('LATHE-01', reading(i))
+    except wal.WalFull:
+        pass
+    else:
+        raise AssertionError("the log never filled up")
+    assert len(wal.segment_numbers(log.directory)) == 2
+    log.close()
+
+
+class FakeBuckets:
+    """Just enough of a bucket collection for store_many: find by _id and
+    bulk_write of its UpdateOne upserts ($push/$max on t and last)"""
+
+    def __init__(self):
+        self.docs = {}
+
+    def find(self, query, projection=None):
+        return [{'_id': key, 'last': self.docs[key]['last']}
+                for key in query['_id']['$in'] if key in self.docs]
+
+    def bulk_write(self, operations, ordered=True):
+        for op in operations:
+            query, update = op._filter, op._doc
+            doc = self.docs.setdefault(query['_id'], {'t': [], 'last': None})
+            doc['t'].extend(update['$push']['t']['$each'])
+            doc['last'] = max(filter(None, (doc['last'], update['$max']['last'])))
+
+def test_bucket_store_many_appends_only_what_a_bucket_lacks():
+    buckets = FakeBuckets()
+    collections = {'buckets': buckets, 'sensor': None}
+    readings.store_many(collections, [reading(i) for i in range(3)], layout='bucket')
+    # The retried batch overlaps the stored readings and goes on past them
+    readings.store_many(collections, [reading(i) for i in range(1, 6)], layout='bucket')
+    readings.store_many(collections, [reading(i) for i in range(2)], layout='bucket')
+    (bucket,) = buckets.docs.values()
+    assert bucket['t'] == [T0 + timedelta(seconds=i) for i in range(6)]
+
+def test_document_store_many_skips_stored_ids():
+    mongomock = pytest.importorskip('mongomock')
+    sensor = mongomock.MongoClient()['SensorData']['lathe1_sensory_data']
+    batch = [reading(i) for i in range(5)]
+    readings.store_many({'sensor': sensor}, batch[:3], layout='document')
+    readings.store_many({'sensor': sensor}, batch, layout='document')
+    assert sensor.count_documents({}) == 5
@@ -0,0 +1,70 @@
+"""Train the failure model on the readings and job outcomes in the store.
+
+    python train_failure_model.py [--machines LATHE-01,LATHE-02] [--from 2024-01-01] [--to 2025-01-01] \
+        [--holdout-from 2024-11-01] [--epochs 2]
+
+Readings are streamed in batches, labelled from their job's outcome (see
+app/training.py) and fed to an incremental learner, so memory stays bounded
+however much history there is. The most recent stretch (--holdout-from, or
+the last --holdout-fraction of the range) is held out and scored. The model
+is saved as the next version in ML_MODEL_DIR (default models/) with its
+training report next to it; simulations started after that load it.
+"""
+import argparse
+import json
+import sys
+from datetime import timedelta
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app import training
+from app.clock import parse_utc
+from app.registry import registry
+from app.storage import get_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--machines', help='comma-separated machine ids (default: whole registry)')
+    parser.add_argument('--from', dest='start', type=parse_utc, help='ISO 8601 start, UTC if no offset')
+    parser.add_argument('--to', dest='end', type=parse_utc, help='ISO 8601 end (exclusive), UTC if no offset')
+    parser.add_argument('--holdout-from', type=parse_utc, help='hold out readings from this time on')
+    parser.add_argument('--holdout-fraction', type=float, default=0.2,
+                        help='without --holdout-from, hold out this last fraction of the time range')
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=training.BATCH_SIZE)
+    parser.add_argument('--shuffle-rows', type=int, default=training.SHUFFLE_ROWS,
+                        help='rows held in the shuffle buffer (0: no shuffling)')
+    parser.add_argument('--horizon', type=float, default=training.LABEL_HORIZON.total_seconds() / 60,
+                        help='minutes before an alert whose readings count as failures')
+    parser.add_argument('--output-dir', default=training.MODEL_DIR)
+    parser.add_argument('--min-auc', type=float, help="don't save the model if its holdout AUC is lower")
+    args = parser.parse_args()
+    if not 0 < args.holdout_fraction < 1:
+        parser.error("--holdout-fraction must be between 0 and 1")
+
+    machines = registry.machines(include_inactive=True)
+    if args.machines:
+        wanted = set(args.machines.split(','))
+        machines = [m for m in machines if m.id in wanted]
+
+    try:
+        model, report = training.train(
+            get_store(), machines, args.start, args.end, args.holdout_from, args.holdout_fraction,
+            args.epochs, args.batch_size, args.shuffle_rows, timedelta(minutes=args.horizon))
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    auc = report['holdout']['auc']
+    if args.min_auc is not None and (auc is None or auc < args.min_auc):
+        print(f"❌ Holdout AUC {auc} is below --min-auc {args.min_auc}; model not saved", file=sys.stderr)
+        sys.exit(2)
+    version, path = training.save_model(model, report, args.output_dir)
+    print(f"✅ Saved model v{version} to {path}")
+    print(json.dumps(report['holdout'], indent=2))
+
+if __name__ == '__main__':
+    main()
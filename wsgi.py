@@ -0,0 +1,23 @@
+"""Entry point for the cooperative (gevent) serving mode.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Patching has to happen before Flask, pymongo or the simulator are imported so
+that sockets, time.sleep and threading all yield to the gevent hub.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+from app import app
+from app.job_queue import queue as job_queue, JOB_DISPATCHER
+
+if JOB_DISPATCHER:
+    job_queue.start()
+
+if __name__ == '__main__':
+    import os
+    from gevent.pywsgi import WSGIServer
+
+    port = int(os.getenv('PORT', '8000'))
+    print(f"🌐 Serving cooperatively on port {port}")
+    WSGIServer(('0.0.0.0', port), app).serve_forever()